@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Compares result set throughput at different "fetchsize" settings, using a
+# scratch SQLite database.
+#
+# Usage: python bench/fetchsize.py [rows] [batch_size ...]
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from grizzled import db
+
+from sqlcmd.dbapi import fetch_batches
+from sqlcmd.render import ResultSetRenderer
+
+DEFAULT_ROWS = 200000
+DEFAULT_BATCH_SIZES = [1, 10, 100, 500, 1000, 5000]
+QUERY = 'select id, name, amount, created from bench'
+
+def create_database(path, total_rows):
+    database = db.get_driver('sqlite').connect(database=path)
+    cursor = database.cursor()
+    cursor.execute('create table bench (id integer, name varchar(30), '
+                   'amount real, created varchar(20))')
+    rows = [(i, 'name-%d' % i, i * 1.25, '2011-03-11 12:%02d:00' % (i % 60))
+            for i in xrange(total_rows)]
+    cursor.executemany('insert into bench values (?, ?, ?, ?)', rows)
+    cursor.close()
+    database.commit()
+    return database
+
+def time_fetch_only(database, batch_size):
+    cursor = database.cursor()
+    start = time.time()
+    cursor.execute(QUERY)
+    rows = 0
+    if batch_size == 1:
+        # What sqlcmd used to do.
+        rs = cursor.fetchone()
+        while rs is not None:
+            rows += 1
+            rs = cursor.fetchone()
+    else:
+        for batch in fetch_batches(cursor, batch_size):
+            rows += len(batch)
+    elapsed = time.time() - start
+    cursor.close()
+    return rows, elapsed
+
+def time_render(database, batch_size, out):
+    cursor = database.cursor()
+    renderer = ResultSetRenderer(database, out=out, fetch_size=batch_size)
+    start = time.time()
+    cursor.execute(QUERY)
+    rows = renderer.render(cursor)
+    elapsed = time.time() - start
+    cursor.close()
+    return rows, elapsed
+
+def main(argv):
+    total_rows = DEFAULT_ROWS
+    batch_sizes = DEFAULT_BATCH_SIZES
+    if len(argv) > 1:
+        total_rows = int(argv[1])
+    if len(argv) > 2:
+        batch_sizes = [int(a) for a in argv[2:]]
+
+    fd, path = tempfile.mkstemp('.db', 'sqlcmd-bench')
+    os.close(fd)
+    out = open(os.devnull, 'w')
+    try:
+        print 'Creating %d rows in "%s"...' % (total_rows, path)
+        database = create_database(path, total_rows)
+
+        print
+        print '%10s %15s %15s' % ('fetchsize', 'fetch rows/s', 'render rows/s')
+        print '%10s %15s %15s' % ('-' * 10, '-' * 15, '-' * 15)
+        for batch_size in batch_sizes:
+            rows, fetch_elapsed = time_fetch_only(database, batch_size)
+            rows, render_elapsed = time_render(database, batch_size, out)
+            print '%10d %15.0f %15.0f' % (batch_size,
+                                          rows / max(fetch_elapsed, 1e-9),
+                                          rows / max(render_elapsed, 1e-9))
+        database.close()
+    finally:
+        out.close()
+        os.remove(path)
+
+if __name__ == '__main__':
+    main(sys.argv)
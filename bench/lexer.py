@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#
+# Compares the cost of splitting a large generated script into statements,
+# using the line-at-a-time logic sqlcmd used before the SQL lexer (a
+# statement ends with the line that ends in ";") and the lexer itself.
+# Both sides substitute variables the way their versions of precmd do:
+# the old one substituted every line; the new one substitutes the first
+# line of each command (to classify it) and each complete statement.
+#
+# Usage: python bench/lexer.py [statements] [lines_per_statement ...]
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd import SQLCmdStringTemplate, VARIABLE_REFERENCE_PREFIX
+from sqlcmd.lexer import SQLLexer
+
+DEFAULT_STATEMENTS = 200000
+DEFAULT_STATEMENT_LINES = [10000, 25000]
+
+VARIABLES = {'schema' : 'public'}
+
+def substitute_baseline(s):
+    return SQLCmdStringTemplate(s).substitute(VARIABLES)
+
+def substitute(s):
+    # As SQLCmd.__substitute_variables() does it.
+    if not VARIABLE_REFERENCE_PREFIX in s:
+        return s
+    return SQLCmdStringTemplate(s).substitute(VARIABLES)
+
+def one_line_statements(n, literals):
+    for i in xrange(n):
+        if literals:
+            yield "insert into t values (%d, 'name-%d', '2011-03-11');" %\
+                  (i, i)
+        else:
+            yield 'insert into t values (%d, %d, %d.25);' % (i, i * 2, i)
+
+def multi_line_statement(n):
+    yield 'insert into t values'
+    for i in xrange(n):
+        yield "    (%d, 'name-%d')," % (i, i)
+    yield "    (-1, 'end');"
+
+def write_script(path, lines):
+    f = open(path, 'w')
+    try:
+        for line in lines:
+            f.write(line + '\n')
+    finally:
+        f.close()
+
+def split_baseline(path):
+    # The logic precmd used before the lexer.
+    partial = None
+    count = 0
+    for line in open(path):
+        s = substitute_baseline(line[:-1]).strip()
+        if not s:
+            continue
+        if s[-1] != ';':
+            if partial is None:
+                partial = s
+            else:
+                partial = partial + ' ' + s
+        else:
+            if partial is not None:
+                s = partial + ' ' + s
+                partial = None
+            count += 1
+    return count
+
+def split_lexer(path):
+    lexer = SQLLexer()
+    count = 0
+    for line in open(path):
+        line = line[:-1]
+        if not lexer.pending:
+            substitute(line)
+        for statement in lexer.feed(line):
+            statement.text(substitute)
+            count += 1
+    return count
+
+def run(name, path):
+    for label, split in (('baseline', split_baseline), ('lexer', split_lexer)):
+        start = time.time()
+        count = split(path)
+        elapsed = time.time() - start
+        print '%-38s %-8s %7.3f seconds (%d statement%s)' %\
+              (name, label, elapsed, count, count != 1 and 's' or '')
+
+def main(argv):
+    statements = DEFAULT_STATEMENTS
+    statement_lines = DEFAULT_STATEMENT_LINES
+    if len(argv) > 1:
+        statements = int(argv[1])
+    if len(argv) > 2:
+        statement_lines = [int(a) for a in argv[2:]]
+
+    fd, path = tempfile.mkstemp('.sql', 'sqlcmd-bench')
+    os.close(fd)
+    try:
+        cases = [('%d one-line INSERTs' % statements,
+                  one_line_statements(statements, False)),
+                 ('%d one-line INSERTs with literals' % statements,
+                  one_line_statements(statements, True))]
+        cases += [('one %d-line INSERT' % n, multi_line_statement(n))
+                  for n in statement_lines]
+        for name, lines in cases:
+            write_script(path, lines)
+            run(name, path)
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    main(sys.argv)
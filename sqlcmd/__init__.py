@@ -56,14 +56,12 @@ $Id$
 from __future__ import with_statement
 
 from cmd import Cmd
-import cPickle
 import logging
 import os
 import re
 from StringIO import StringIO
 from string import Template as StringTemplate
 import sys
-import tempfile
 import textwrap
 import time
 import traceback
@@ -79,6 +77,23 @@ from enum import Enum
 from sqlcmd.config import SQLCmdConfig
 from sqlcmd.exception import *
 from sqlcmd.ecmd import ECmd
+from sqlcmd import batch
+from sqlcmd import bind
+from sqlcmd import cancel
+from sqlcmd import dbapi
+from sqlcmd import export
+from sqlcmd import fanout
+from sqlcmd import jobs
+from sqlcmd import lexer
+from sqlcmd import load
+from sqlcmd import metadata
+from sqlcmd import pager
+from sqlcmd import parallel
+from sqlcmd import pool
+from sqlcmd import render
+from sqlcmd import resultcache
+from sqlcmd import stats
+from sqlcmd import timing
 
 # ---------------------------------------------------------------------------
 # Exports
@@ -112,12 +127,24 @@ DEFAULT_CONFIG_DIR = os.path.join(os.environ.get('HOME', os.getcwd()),
                                   '.sqlcmd')
 
 RC_FILE = os.path.join(DEFAULT_CONFIG_DIR, 'config')
+DEFAULT_PARALLEL_JOBS = 4
+
 HISTORY_FILE_FORMAT = os.path.join(DEFAULT_CONFIG_DIR, '%s.hist')
+STATS_FILE_FORMAT = os.path.join(DEFAULT_CONFIG_DIR, '%s.stats')
+SCHEMA_FILE_FORMAT = os.path.join(DEFAULT_CONFIG_DIR, '%s.schema')
 
 VARIABLE_ASSIGNMENT_RE = re.compile(r'^([A-Za-z0-9_-]+)=(.*)$')
 VARIABLE_RE = '[A-Za-z0-9_-]+'
 VARIABLE_REFERENCE_PREFIX = '$'
 
+# The table a SELECT reads from, if it reads from just one. Used to look up
+# the catalog sizes of its columns when "colwidths" is "metadata".
+SINGLE_TABLE_SELECT_RE = re.compile(
+    r'\bfrom\s+([A-Za-z_][\w.$]*)(?:\s+(?:as\s+)?[A-Za-z_]\w*)?\s*'
+    r'(?:\b(?:where|group|order|limit)\b.*)?$',
+    re.IGNORECASE | re.DOTALL
+)
+
 # ---------------------------------------------------------------------------
 # Globals
 # ---------------------------------------------------------------------------
@@ -131,10 +158,10 @@ log = None
 def main():
     rc = 0
     try:
-        Main().run(sys.argv)
+        rc = Main().run(sys.argv) or 0
 
-    except SystemExit:
-        pass
+    except SystemExit, ex:
+        rc = ex.code or 0
 
     except:
         rc = 1
@@ -161,13 +188,17 @@ class Variable(object):
                  type,
                  initialValue,
                  docstring,
-                 onChangeFunc=None):
+                 onChangeFunc=None,
+                 legalValues=None,
+                 minValue=None):
         self.name = name
         self.type = type
         self.defaultValue = initialValue
         self.value = initialValue
         self.onChange = onChangeFunc
         self.docstring = docstring
+        self.legalValues = legalValues
+        self.minValue = minValue
 
     def set_value_from_string(self, s):
         new_value = None
@@ -176,13 +207,22 @@ class Variable(object):
 
         elif self.type == SQLCmd.VAR_TYPES.string:
             new_value = s
+            if self.legalValues:
+                new_value = new_value.lower()
+                if not new_value in self.legalValues:
+                    raise ValueError, s
 
         elif self.type == SQLCmd.VAR_TYPES.integer:
             new_value = int(s)
+            if (self.minValue is not None) and (new_value < self.minValue):
+                raise ValueError, s
 
         else:
             assert(false)
 
+        self.set_value(new_value)
+
+    def set_value(self, new_value):
         if new_value != self.value:
             self.value = new_value
             if self.onChange != None:
@@ -226,13 +266,13 @@ class SQLCmd(ECmd):
     """The SQLCmd command interpreter."""
 
     DEFAULT_HISTORY_MAX = history.DEFAULT_MAXLENGTH
+    DEFAULT_STATS_LIMIT = 20
     COMMENT_PREFIX = '--'
     MAIN_PROMPT = '? '
     CONTINUATION_PROMPT = '> '
     META_COMMAND_PREFIX = '.'
-    BINARY_VALUE_MARKER = "<binary>"
-    BINARY_FILTER = ''.join([(len(repr(chr(x)))==3) and chr(x) or '?'
-                             for x in range(256)])
+    BINARY_VALUE_MARKER = render.BINARY_VALUE_MARKER
+    BINARY_FILTER = render.BINARY_FILTER
 
     NO_SEMI_NEEDED = set(['help', '?', 'r', 'begin', 'commit', 'rollback',
                           'eof'])
@@ -242,21 +282,39 @@ class SQLCmd(ECmd):
     VAR_TYPES = Enum('boolean', 'string', 'integer')
 
     def __init__(self, cfg):
-        Cmd.__init__(self)
+        ECmd.__init__(self)
         self.prompt = "? "
         self.__config = cfg
         self.__db = None
-        self.__partial_command = None
+        self.__lexer = lexer.SQLLexer()
         self.__partial_cmd_history_start = None
         self.__db_config = None
         self.__history_file = None
+        self.__stats_log = None
+        self.__metadata = None
+        self.__pending_connection = None
+        self.__pool = pool.ConnectionPool(
+            check=lambda p: dbapi.ping(p.database, p.state['db_config'].db_type)
+        )
+        self.__jobs = jobs.JobList(pool.ConnectionPool(
+            check=lambda p: dbapi.ping(p.database, p.state['db_config'].db_type)
+        ))
+        self.__reported_jobs = set()
         self.__settings = {}
         self.__variables = {}
         self.__interactive = True
-        self.__in_multiline_command = False
         self.save_history = True
+        self.exit_status = 0
         self.identchars = Cmd.identchars + '.'
         self.__aborted = False
+        self.__batch = batch.CommitBatch()
+        self.__cursors = bind.CursorCache()
+        self.__results = resultcache.ResultCache(0, 0)
+        self.__server_timeout_set = False
+        self.__script_depth = 0
+        self.__script_position = None
+        self.__script_aborted = False
+        self.__statement_start = None
 
         def autocommitChanged(var):
             if var.value == True:
@@ -275,35 +333,171 @@ class SQLCmd(ECmd):
                      'Number of characters to show in a BINARY column, if '
                      '"showbinary" is "true".'),
             
+            Variable('bindvars', SQLCmd.VAR_TYPES.boolean, False,
+                     'Whether variable references in SQL statements are '
+                     'passed to the database as bind parameters, instead of '
+                     'being replaced with their values.'),
+
+            Variable('cachemax', SQLCmd.VAR_TYPES.integer, 10240,
+                     'Kilobytes of compressed rows the result cache may '
+                     'hold, if "cachettl" is set. Results that don\'t fit '
+                     'aren\'t cached.'),
+
+            Variable('cachettl', SQLCmd.VAR_TYPES.integer, 0,
+                     'Number of seconds for which the rows of a SELECT are '
+                     'cached, so that running the same query again shows '
+                     'them without asking the database. Changes made through '
+                     'sqlcmd discard the cached results for that database. '
+                     '0 disables the cache.'),
+
             Variable('colspacing', SQLCmd.VAR_TYPES.integer, 1,
                      'Number of spaces to use between columns when displaying '
                      'the output of a SELECT statement.'),
 
+            Variable('colwidthmax', SQLCmd.VAR_TYPES.integer,
+                     render.MAX_METADATA_WIDTH,
+                     'Maximum width of a column, if "colwidths" is '
+                     '"metadata". Longer strings are truncated.'),
+
+            Variable('colwidths', SQLCmd.VAR_TYPES.string, 'window',
+                     'How to size the columns of a SELECT result. "window" '
+                     'sizes them from the first "lookahead" rows and displays '
+                     'rows as they arrive. "exact" reads every row first, so '
+                     'each column is exactly as wide as its widest value. '
+                     '"metadata" sizes them from the column sizes the '
+                     'database reports, without reading any rows, and '
+                     'displays rows as they arrive.',
+                     legalValues=render.WIDTH_MODES),
+
+            Variable('commitevery', SQLCmd.VAR_TYPES.integer, 0,
+                     'If "autocommit" is "true", commit the statements run '
+                     'from a script in batches of this many, instead of one '
+                     'at a time. 0 means don\'t batch by count.'),
+
+            Variable('commitsecs', SQLCmd.VAR_TYPES.integer, 0,
+                     'If "autocommit" is "true", commit the current batch of '
+                     'script statements once it has been open this many '
+                     'seconds. 0 means don\'t batch by time.'),
+
             Variable('echo',       SQLCmd.VAR_TYPES.boolean, False,
                      'Whether or not SQL statements are echoed.'),
 
+            Variable('fanoutmax', SQLCmd.VAR_TYPES.integer, 8,
+                     'Maximum number of databases ".fanout" queries at '
+                     'once.'),
+
+            Variable('fetchsize', SQLCmd.VAR_TYPES.integer, 500,
+                     'Number of rows to fetch from the database at a time.'),
+
             Variable('history', SQLCmd.VAR_TYPES.boolean, True,
                      'Whether or not to save commands in the history.'),
 
+            Variable('importbatch', SQLCmd.VAR_TYPES.integer, 1000,
+                     'Number of rows ".import" inserts (and, if "autocommit" '
+                     'is "true", commits) at a time.'),
+
+            Variable('lookahead', SQLCmd.VAR_TYPES.integer, 1000,
+                     'Number of rows used to size the columns of a SELECT '
+                     'result, if "colwidths" is "window".'),
+
+            Variable('maxbytes', SQLCmd.VAR_TYPES.integer, 0,
+                     'Approximate number of bytes of rows a SELECT may '
+                     'fetch. The remaining rows are discarded, with a '
+                     'warning. 0 means no limit.'),
+
+            Variable('maxrows', SQLCmd.VAR_TYPES.integer, 0,
+                     'Number of rows a SELECT may fetch. The remaining rows '
+                     'are discarded, with a warning. 0 means no limit.'),
+
+            Variable('memorymax', SQLCmd.VAR_TYPES.integer, 10240,
+                     'Kilobytes of SELECT output to hold in memory, if '
+                     '"colwidths" is "exact". Larger results are written to '
+                     'a temporary file. -1 means no limit.'),
+
+            Variable('metadatattl', SQLCmd.VAR_TYPES.integer, 300,
+                     'Number of seconds before cached table names and column '
+                     'metadata, used for completion and ".describe", are '
+                     'refreshed. The cache is saved between sessions. 0 '
+                     'disables the cache. -1 means the metadata is cached '
+                     'until ".refresh" or a CREATE, ALTER or DROP statement.'),
+
+            Variable('poolsize', SQLCmd.VAR_TYPES.integer, 3,
+                     'Number of idle database connections ".connect" keeps '
+                     'open, so that switching back to a database is '
+                     'immediate. 0 closes each connection when switching.'),
+
+            Variable('pooltimeout', SQLCmd.VAR_TYPES.integer, 600,
+                     'Number of seconds after which an idle pooled '
+                     'connection is closed. -1 means never.'),
+
+            Variable('stmtcache', SQLCmd.VAR_TYPES.integer,
+                     bind.DEFAULT_CURSOR_CACHE_SIZE,
+                     'Number of statements with bind parameters whose '
+                     'cursors are kept open, for reuse, on each connection. '
+                     '0 disables the cache.',
+                     minValue=0),
+
             Variable('stacktrace', SQLCmd.VAR_TYPES.boolean, False,
                      'Whether or not to show a stack trace on error.'),
 
+            Variable('pager', SQLCmd.VAR_TYPES.boolean, False,
+                     'Whether or not to send the output of SELECT statements '
+                     'through a pager: the program named by $PAGER or, if '
+                     '$PAGER isn\'t set, a simple built-in pager. Quitting '
+                     'the pager cancels the query.'),
+
             Variable('showbinary', SQLCmd.VAR_TYPES.boolean, False,
                      'Whether or not to try to display BINARY column values.'),
 
+            Variable('statslog', SQLCmd.VAR_TYPES.boolean, True,
+                     'Whether or not to record the timings of SQL statements '
+                     'in the per-database statistics file shown by ".stats".'),
+
             Variable('timings',    SQLCmd.VAR_TYPES.boolean, True,
                      'Whether or not to show how SQL statements take.'),
+
+            Variable('timingformat', SQLCmd.VAR_TYPES.string, 'brief',
+                     'How to show timings, if "timings" is "true". "brief" '
+                     'shows just the execution time. "full" also shows the '
+                     'first-row latency, fetch time, render time, rows per '
+                     'second and bytes written. "json" shows the same '
+                     'information as a single-line JSON object.',
+                     legalValues=timing.TIMING_FORMATS),
+
+            Variable('timeout', SQLCmd.VAR_TYPES.integer, 0,
+                     'Number of seconds a SQL statement may run before it '
+                     'is cancelled. 0 means no limit.'),
                ]
         for v in vars:
             self.__settings[v.name] = v
 
         self.__init_settings_from_config()
 
+    def run_command_and_exit(self, command):
+        self.cmdqueue += [command, "EOF"]
+        self.__interactive = False
+        self.__prompt = ""
+        self.cmdloop()
+
+    def set_setting(self, varname, value):
+        """
+        Change a setting, as ".set" would.
+
+        :Parameters:
+            varname : str
+                the name of the setting
+            value : str
+                the new value, as a string
+
+        :raise BadCommandError: unknown setting or bad value
+        """
+        self.__set_setting(varname, value)
+
     def run_file_and_exit(self, file):
-        self.__run_file(file)
-        self.cmdqueue += ["EOF"]
         self.__interactive = False
         self.__prompt = ""
+        self.push_source(['EOF'])
+        self.__run_file(file)
         self.cmdloop()
 
     def preloop(self):
@@ -316,7 +510,8 @@ class SQLCmd(ECmd):
 
         if self.__db_config != None:
             try:
-                self.__connect_to(self.__db_config)
+                self.__connect_to(self.__db_config,
+                                  background=self.__interactive)
             except AssertionError:
                 traceback.print_exc()
             except:
@@ -340,38 +535,54 @@ class SQLCmd(ECmd):
         config_item = self.__config.find_match(database_alias)
         assert(config_item != None)
         self.__db_config = config_item
+        self.__lexer.backslash_escapes = (config_item.db_type == 'mysql')
 
     def interrupted(self):
-        self.__partial_command = None
+        self.__lexer.reset()
         self.prompt = SQLCmd.MAIN_PROMPT
         print
 
     def precmd(self, s):
+        if len(self.__jobs) > 0:
+            self.__report_finished_jobs()
+
+        if (self.__pending_connection is not None) and \
+           self.__pending_connection.ready:
+            # Finish up a background connect now, so any error is reported
+            # right away.
+            try:
+                self.__await_connection()
+            except:
+                etype, evalue, etb = sys.exc_info()
+                self.__handle_exception(evalue)
+
+        if len(self.__pool) > 0:
+            self.__configure_pool()
+            self.__pool.evict()
+
+        if self.__lexer.pending:
+            # In the middle of a SQL statement. The whole line is SQL.
+            return self.__next_statement(s)
+
         tokens = s.split(None, 1)
         if len(tokens) == 0:
             return ''
 
+        line = s
         if not (tokens[0] in SQLCmd.NO_VAR_SUB):
-            s = SQLCmdStringTemplate(s).substitute(self.__variables)
+            s = self.__substitute_variables(s)
 
         s = s.strip()
         # Split again, now that we've substituted.
         tokens = s.split(None, 1)
+        if len(tokens) == 0:
+            return ''
 
-        if len(tokens) == 1:
-            first = s
-            args = []
-        else:
-            first = tokens[0]
-            args = tokens[1:]
-
-        if not self.__in_multiline_command:
-            first = first.lower()
+        first = tokens[0].lower()
+        args = tokens[1:]
 
-        need_semi = not first in SQLCmd.NO_SEMI_NEEDED
         setvar_match = VARIABLE_ASSIGNMENT_RE.match(s)
         if setvar_match:
-            need_semi = False
             s = 'dot_var %s=%s' % (setvar_match.group(1), setvar_match.group(2))
 
         elif first.startswith(SQLCmd.COMMENT_PREFIX):
@@ -380,48 +591,74 @@ class SQLCmd(ECmd):
             # directly here, then return an empty string. That way, the
             # Cmd class's help functions don't notice and expose to view
             # special comment methods.
-            need_semi = False
             s = ''
 
         elif first.startswith(SQLCmd.META_COMMAND_PREFIX):
             s = ' '.join(['dot_' + first[1:]] + args)
-            need_semi = False
 
         elif s == "EOF":
-            need_semi = False
+            pass
 
-        else:
+        elif first in SQLCmd.NO_SEMI_NEEDED:
             s = ' '.join([first] + args)
+            if s[-1] == ';':
+                s = s[:-1]
 
-        if s == "":
-            pass
+        else:
+            # SQL. The lexer works on the line as typed; variables are
+            # substituted once the statement is complete.
+            return self.__next_statement(line)
+
+        self.prompt = SQLCmd.MAIN_PROMPT
+        return s
 
-        elif need_semi and (s[-1] != ';'):
-            if self.__partial_command == None:
-                self.__partial_command = s
-                self.__partial_cmd_history_start = self.__history.get_total()
+    def __next_statement(self, line):
+        if line == "EOF":
+            partial = self.__lexer.reset()
+            log.warning('Discarding incomplete statement: %s' % partial)
+            self.prompt = SQLCmd.MAIN_PROMPT
+            return line
+
+        continued = self.__lexer.pending
+        if not continued:
+            self.__partial_cmd_history_start = self.__history.get_total()
+            self.__statement_start = self.__script_position
+
+        statements = self.__lexer.feed(line)
+        if not statements:
+            if self.__lexer.pending:
+                self.prompt = SQLCmd.CONTINUATION_PROMPT
             else:
-                self.__partial_command = self.__partial_command + ' ' + s
-            s = ""
-            self.prompt = SQLCmd.CONTINUATION_PROMPT
-            self.__in_multiline_command = True
+                self.prompt = SQLCmd.MAIN_PROMPT
+            return ''
 
+        self.prompt = SQLCmd.MAIN_PROMPT
+        statement = statements[0]
+
+        # Anything else on the line (more statements, or the start of
+        # one) is queued up, as typed, to be run next.
+        rest = [str(st) + ';' for st in statements[1:]]
+        if self.__lexer.pending:
+            rest.append(self.__lexer.reset())
+        self.cmdqueue.extendleft(reversed(rest))
+
+        if self.__flag_is_set('bindvars'):
+            # The variables are bound when the statement is run.
+            s = statement.text()
         else:
-            self.__in_multiline_command = False
-            if self.__partial_command != None:
-                s = self.__partial_command + ' ' + s
-                self.__partial_command = None
-                cmd_start = self.__partial_cmd_history_start
-                self.__partial_cmd_history_start = None
-                if self.__flag_is_set('history'):
-                    self.__history.cut_back_to(cmd_start + 1)
-                    self.__history.add_item(s, force=True)
-
-            # Strip the trailing ';'
-            if s[-1] == ';':
-                s = s[:-1]
+            s = statement.text(self.__substitute_variables)
+        tokens = s.split(None, 1)
+        if len(tokens) == 0:
+            return ''
+        s = ' '.join([tokens[0].lower()] + tokens[1:])
 
-            self.prompt = SQLCmd.MAIN_PROMPT
+        cmd_start = self.__partial_cmd_history_start
+        self.__partial_cmd_history_start = None
+        if continued and self.__flag_is_set('history'):
+            # The statement spanned several lines. Replace them in the
+            # history with the whole statement.
+            self.__history.cut_back_to(cmd_start + 1)
+            self.__history.add_item(s, force=True)
 
         return s
 
@@ -673,13 +910,20 @@ class SQLCmd(ECmd):
         Run a SQL 'SELECT' statement.
         """
         self.__ensure_connected()
-        cursor = self.__db.cursor()
+        bound = self.__bind('select', args)
+        key = self.__result_key(bound)
+        if key is not None:
+            cached = self.__results.get(key)
+            if cached is not None:
+                self.__show_cached_result(args, cached)
+                return
+
+        cursor = self.__open_cursor(bound)
         try:
-            self.__handle_select(args, cursor)
+            self.__handle_select(args, cursor, bound=bound, cache_key=key)
         finally:
-            cursor.close()
-        if self.__flag_is_set('autocommit'):
-            self.__db.commit()
+            self.__close_cursor(cursor)
+        self.__statement_done()
 
     def complete_select(self, text, line, start_index, end_index):
         return self.__complete_no_context(text)
@@ -715,7 +959,10 @@ class SQLCmd(ECmd):
         """
         Run a SQL 'CREATE' statement (e.g., 'CREATE TABLE', 'CREATE INDEX')
         """
-        self.__handle_update('create', args)
+        try:
+            self.__handle_update('create', args)
+        finally:
+            self.__invalidate_metadata()
 
     def complete_create(self, text, line, start_index, end_index):
         return self.__complete_no_context(text)
@@ -724,7 +971,10 @@ class SQLCmd(ECmd):
         """
         Run a SQL 'ALTER' statement (e.g., 'ALTER TABLE', 'ALTER INDEX')
         """
-        self.__handle_update('alter', args)
+        try:
+            self.__handle_update('alter', args)
+        finally:
+            self.__invalidate_metadata()
 
     def complete_alter(self, text, line, start_index, end_index):
         return self.__complete_no_context(text)
@@ -733,7 +983,10 @@ class SQLCmd(ECmd):
         """
         Run a SQL 'DROP' statement (e.g., 'DROP TABLE', 'DROP INDEX')
         """
-        self.__handle_update('drop', args)
+        try:
+            self.__handle_update('drop', args)
+        finally:
+            self.__invalidate_metadata()
 
     def complete_drop(self, text, line, start_index, end_index):
         return self.__complete_no_context(text)
@@ -771,6 +1024,7 @@ class SQLCmd(ECmd):
         else:
             assert self.__db != None
             self.__db.rollback()
+            self.__invalidate_results()
 
     def do_EOF(self, args):
         """
@@ -780,13 +1034,27 @@ class SQLCmd(ECmd):
             print "\nBye."
             self.__save_history()
 
+        if len(self.__jobs) > 0:
+            # Don't abandon background jobs, or their output.
+            try:
+                self.do_dot_wait('')
+            except KeyboardInterrupt:
+                print '\nAbandoning %d background job(s).' %\
+                      len(self.__jobs.running())
+            self.__jobs.close()
+
         if self.__db != None:
+            try:
+                self.__commit_batch()
+            except db.Error, ex:
+                self.__handle_exception(ex)
             try:
                 self.__db.close()
             except db.Warning, ex:
                 log.warning('%s' % str(ex))
             except db.Error, ex:
                 log.error('%s' % str(ex))
+        self.__pool.close_all()
         return True
 
     def do_dot_about(self, args):
@@ -805,6 +1073,363 @@ class SQLCmd(ECmd):
         """
         self.cmdqueue += ['EOF']
 
+    def do_dot_export(self, args):
+        """
+        Run a query and write its results straight to a file, without
+        formatting them for display. If the file name ends in ".gz", the
+        file is gzip-compressed.
+
+        Usage: .export format file query
+
+        where 'format' is one of: csv, tsv, jsonl
+        """
+        tokens = args.split(None, 2)
+        if len(tokens) != 3:
+            raise BadCommandError('Usage: .export format file query')
+
+        format, path, query = tokens
+        format = format.lower()
+        if not format in export.EXPORT_FORMATS:
+            raise BadCommandError('Unknown export format "%s". Legal formats: '
+                                  '%s' % (format,
+                                          ', '.join(export.EXPORT_FORMATS)))
+
+        query = query.strip()
+        if query.endswith(';'):
+            query = query[:-1]
+
+        self.__ensure_connected()
+        self.__echo('.export', args, add_semi=False)
+        try:
+            f = export.open_data_file(path)
+        except IOError, ex:
+            raise BadCommandError('Unable to open "%s": %s' %
+                                  (path, ex.strerror))
+
+        cursor = self.__db.cursor()
+        try:
+            query_tokens = query.split(None, 1)
+            if len(query_tokens) == 1:
+                query_tokens.append('')
+            with self.__statement_watch() as watch:
+                timer = self.__exec_SQL(cursor, query_tokens[0],
+                                        query_tokens[1])
+
+                start = time.time()
+                rows = export.export_result_set(
+                    watch.cursor(cursor), format, f,
+                    fetch_size=self.__settings['fetchsize'].value,
+                    timer=timer
+                )
+                elapsed = time.time() - start
+        finally:
+            f.close()
+            cursor.close()
+
+        if watch.limit is not None:
+            log.warning(watch.limit)
+        self.__statement_done()
+
+        timer.finish(rows=rows,
+                     bytes=os.path.getsize(os.path.expanduser(path)))
+        pl = ''
+        if rows != 1:
+            pl = 's'
+        print '%d row%s exported to "%s".' % (rows, pl, path)
+        if self.__timing_format() == 'brief':
+            print 'Export time: %5.3f seconds (%d rows/second)' %\
+                  (elapsed, rows / max(elapsed, 0.001))
+        self.__finish_statement(timer)
+
+    def complete_dot_export(self, text, line, start_index, end_index):
+        tokens = line[:start_index].split()
+        if len(tokens) == 1:
+            return [f for f in export.EXPORT_FORMATS if f.startswith(text)]
+        elif len(tokens) == 2:
+            return self.complete_dot_run(text, line, start_index, end_index)
+        else:
+            return self.__complete_no_context(text)
+
+    def do_dot_fanout(self, args):
+        """
+        Run a query against every database whose alias matches a pattern,
+        in parallel. The rows are displayed as they arrive, each tagged with
+        the alias of the database it came from, followed by a summary of
+        each database's timings and any failures.
+
+        Usage: .fanout alias-pattern query
+
+        where 'alias-pattern' is a shell-style wildcard pattern (e.g.,
+        "shard*") matched against the aliases in the configuration file.
+        The 'fanoutmax' setting limits how many databases are queried
+        at once.
+        """
+        tokens = args.split(None, 1)
+        if len(tokens) != 2:
+            raise BadCommandError('Usage: .fanout alias-pattern query')
+
+        pattern, query = tokens
+        query = query.strip()
+        if query.endswith(';'):
+            query = query[:-1]
+
+        db_configs = fanout.match_databases(self.__config, pattern)
+        if not db_configs:
+            raise BadCommandError('No databases match "%s"' % pattern)
+
+        self.__echo('.fanout', args, add_semi=False)
+        fan_out = fanout.FanOut(
+            db_configs,
+            self.__open_connection,
+            workers=self.__settings['fanoutmax'].value,
+            fetch_size=max(self.__settings['fetchsize'].value, 1),
+            show_binary=self.__flag_is_set('showbinary'),
+            binary_max=self.__settings['binarymax'].value
+        )
+        start = time.time()
+        results = fan_out.run(query)
+        elapsed = time.time() - start
+
+        width = max([len('alias')] + [len(r.alias) for r in results])
+        print ''
+        print '%-*s  %-6s %8s %9s %9s' %\
+              (width, 'alias', 'status', 'rows', 'execute', 'total')
+        failed = 0
+        for r in results:
+            if r.succeeded:
+                rows = r.timer.rows
+                if (rows is None) or (rows < 0):
+                    rows = '-'
+                print '%-*s  %-6s %8s %9.3f %9.3f' %\
+                      (width, r.alias, 'ok', rows, r.timer.execute,
+                       r.timer.total)
+            else:
+                failed += 1
+                print '%-*s  %-6s %s' % (width, r.alias, 'FAILED', r.error)
+
+        print '%d of %d databases succeeded. Fan-out time: %5.3f seconds' %\
+              (len(results) - failed, len(results), elapsed)
+        if failed:
+            self.exit_status = 1
+
+    def complete_dot_fanout(self, text, line, start_index, end_index):
+        if len(line.split()) > 2 or \
+           ((len(line.split()) == 2) and line[-1].isspace()):
+            return self.__complete_no_context(text)
+        return [a for a in self.__config.get_aliases() if a.startswith(text)]
+
+    def do_dot_bg(self, args):
+        """
+        Run a SQL statement in the background, on a separate connection to
+        the current database, so that other commands can be run while it
+        does. The statement is committed when it finishes, if it succeeds.
+        Its output is saved until it's collected with ".fg" or ".wait". The
+        "timeout" setting applies, and ".kill" cancels the statement.
+
+        Usage: .bg statement
+        """
+        statement = args.strip()
+        if statement.endswith(';'):
+            statement = statement[:-1].strip()
+        if not statement:
+            raise BadCommandError('Usage: .bg statement')
+
+        self.__ensure_connected()
+        self.__echo('.bg', args, add_semi=False)
+
+        # The statement might change anything. Results cached before it
+        # finishes could be stale, so nothing is cached until it has.
+        self.__invalidate_results()
+        self.__invalidate_metadata()
+        self.__configure_pool()
+        options = self.__renderer_options()
+        words = statement.split(None, 1) + ['']
+        options['catalog'] = self.__catalog(words[0].lower(), words[1])
+        job = self.__jobs.submit(
+            statement,
+            self.__db_config,
+            self.__connector(),
+            lambda database, cursor, out:
+                render.ResultSetRenderer(database, out=out,
+                                         **options).render(cursor),
+            timeout=max(self.__settings['timeout'].value, 0)
+        )
+        print '[%d] Started.' % job.id
+
+    def complete_dot_bg(self, text, line, start_index, end_index):
+        return self.__complete_no_context(text)
+
+    def do_dot_jobs(self, args):
+        """
+        List the background jobs (see ".bg") whose output hasn't been
+        collected yet, with how long they've run and how many rows they
+        produced, or have fetched so far.
+
+        Usage: .jobs
+        """
+        if len(args.split()) > 0:
+            raise BadCommandError('Usage: .jobs')
+
+        job_list = self.__jobs.jobs()
+        if not job_list:
+            print 'No background jobs.'
+            return
+
+        print '%4s  %-7s %9s %8s  %s' %\
+              ('job', 'state', 'elapsed', 'rows', 'statement')
+        for job in job_list:
+            rows = job.rows
+            if rows is None:
+                rows = job.fetched
+            statement = ' '.join(job.statement.split())
+            if len(statement) > 40:
+                statement = statement[:37] + '...'
+            print '%4d  %-7s %9.3f %8s  %s' %\
+                  (job.id, job.state, job.elapsed, rows, statement)
+
+    def do_dot_fg(self, args):
+        """
+        Bring a background job (see ".bg") to the foreground: display its
+        output as it's produced, until the job finishes. Ctrl-C goes back
+        to the prompt, leaving the job running. The job defaults to the
+        most recently started one.
+
+        Usage: .fg [job]
+        """
+        job = self.__get_job(args, '.fg')
+        try:
+            while not job.wait(0.5):
+                sys.stdout.write(job.read_output())
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            print '\n[%d] Still running in the background.' % job.id
+            return
+
+        self.__collect_job(job)
+
+    def do_dot_kill(self, args):
+        """
+        Cancel a background job (see ".bg"). The job fails, and its
+        transaction is rolled back; its output is still collected with
+        ".fg" or ".wait". The job defaults to the most recently started
+        one.
+
+        Usage: .kill [job]
+        """
+        job = self.__get_job(args, '.kill')
+        if job.done:
+            raise BadCommandError('Job %d has already finished.' % job.id)
+
+        if job.cancel():
+            print '[%d] Cancel requested.' % job.id
+        else:
+            log.error('[%d] The database couldn\'t be asked to cancel the '
+                      'statement.' % job.id)
+
+    def do_dot_wait(self, args):
+        """
+        Wait for a background job (see ".bg") to finish, then display its
+        output. Without a job number, waits for every job, displaying each
+        one's output as it finishes.
+
+        Usage: .wait [job]
+        """
+        if len(args.split()) > 0:
+            job_list = [self.__get_job(args, '.wait')]
+        else:
+            job_list = self.__jobs.jobs()
+
+        while job_list:
+            done = [job for job in job_list if job.done]
+            if not done:
+                job_list[0].wait(0.5)
+                continue
+            for job in done:
+                job_list.remove(job)
+                self.__collect_job(job)
+
+    def do_dot_import(self, args):
+        """
+        Load the rows in a data file into a table. The file's format is
+        determined from its extension: .csv, .tsv or .jsonl, optionally
+        followed by .gz for a gzip-compressed file. CSV and TSV files must
+        start with a header line of column names. The rows are inserted
+        "importbatch" rows at a time.
+
+        Usage: .import table file
+        """
+        tokens = args.split()
+        if len(tokens) != 2:
+            raise BadCommandError('Usage: .import table file')
+
+        table, path = tokens
+        format = load.format_for_file(path)
+        if format is None:
+            raise BadCommandError('Can\'t tell the format of "%s" from its '
+                                  'extension. Legal extensions: %s' %
+                                  (path, ', '.join(['.%s' % f for f in
+                                                    load.IMPORT_FORMATS])))
+
+        self.__ensure_connected()
+        self.__commit_batch()
+        self.__invalidate_results()
+        self.__echo('.import', args, add_semi=False)
+        try:
+            f = export.open_data_file(path, 'rb')
+        except IOError, ex:
+            raise BadCommandError('Unable to open "%s": %s' %
+                                  (path, ex.strerror))
+
+        autocommit = self.__flag_is_set('autocommit')
+        rows = 0
+        start = time.time()
+        last_report = start
+        cursor = self.__db.cursor()
+        try:
+            col_names, source = load.read_rows(f, format)
+            if col_names:
+                statement = load.insert_statement(table, col_names,
+                                                  self.__db.paramstyle())
+                log.debug('Import statement: %s' % statement)
+                batch_size = self.__settings['importbatch'].value
+                for batch in load.batches(source, batch_size):
+                    if autocommit:
+                        dbapi.begin(self.__db, cursor)
+                    cursor.executemany(statement, batch)
+                    if autocommit:
+                        self.__db.commit()
+                    rows += len(batch)
+
+                    now = time.time()
+                    if now - last_report >= 1:
+                        last_report = now
+                        print '%d rows imported (%d rows/second)' %\
+                              (rows, rows / (now - start))
+        except:
+            if autocommit:
+                log.error('Import into "%s" failed after %d rows were '
+                          'committed.' % (table, rows))
+            raise
+        finally:
+            f.close()
+            cursor.close()
+
+        elapsed = time.time() - start
+        pl = ''
+        if rows != 1:
+            pl = 's'
+        print '%d row%s imported into "%s".' % (rows, pl, table)
+        if self.__flag_is_set('timings'):
+            print 'Import time: %5.3f seconds (%d rows/second)' %\
+                  (elapsed, rows / max(elapsed, 0.001))
+
+    def complete_dot_import(self, text, line, start_index, end_index):
+        tokens = line[:start_index].split()
+        if len(tokens) == 1:
+            return self.__complete_tables(text)
+        else:
+            return self.complete_dot_run(text, line, start_index, end_index)
+
     def do_dot_set(self, args):
         """
         Handles a 'sset' command, to set a sqlcmd variable. With no arguments,
@@ -860,6 +1485,9 @@ class SQLCmd(ECmd):
                     sys.stdout.write('\nEnter a number\n%s' % line)
                     sys.stdout.flush()
 
+                elif var.legalValues:
+                    matches = list(var.legalValues)
+
                 elif var.type == SQLCmd.VAR_TYPES.string:
                     sys.stdout.write('\nEnter a string\n%s' % line)
                     sys.stdout.flush()
@@ -899,6 +1527,47 @@ class SQLCmd(ECmd):
         """
         self.__show_history()
 
+    def do_dot_stats(self, args):
+        """
+        Summarize the timings recorded for the current database, one line
+        per distinct statement. Statements that differ only in their literal
+        values are counted as the same statement. Shows the number of runs,
+        the median (p50), 95th percentile (p95) and maximum times, in
+        seconds, and the average number of rows. The slowest statements
+        (by p95) are shown first.
+
+        Usage: .stats [n]
+
+        where 'n' is the number of statements to show. Default: 20
+        """
+        tokens = args.split()
+        if len(tokens) > 1:
+            raise BadCommandError, 'Usage: .stats [n]'
+
+        limit = SQLCmd.DEFAULT_STATS_LIMIT
+        if tokens:
+            try:
+                limit = int(tokens[0])
+            except ValueError:
+                raise BadCommandError, 'Bad statement count: "%s"' % tokens[0]
+
+        self.__ensure_connected()
+        summary = self.__stats_log.summarize()
+        if not summary:
+            print 'No statement timings recorded for this database.'
+            return
+
+        summary.sort(key=lambda s: (s.p95, s.max), reverse=True)
+        print '%6s %9s %9s %9s %9s  %s' %\
+              ('runs', 'p50', 'p95', 'max', 'rows', 'statement')
+        for s in summary[:limit]:
+            if s.avg_rows is None:
+                rows = '-'
+            else:
+                rows = '%.1f' % s.avg_rows
+            print '%6d %9.3f %9.3f %9.3f %9s  %s' %\
+                  (s.count, s.p50, s.p95, s.max, rows, s.fingerprint)
+
     def do_dot_show(self, args):
         """
         Run the ".show" command. There are several subcommands.
@@ -1016,6 +1685,22 @@ class SQLCmd(ECmd):
 
         print args
 
+    def do_dot_refresh(self, args):
+        """
+        Discard the cached table names and column metadata used for
+        completion and ".describe", and any cached query results, and
+        reload the table names from the database.
+
+        Usage: .refresh
+        """
+        if len(args.split()) > 0:
+            raise BadCommandError, 'Usage: .refresh'
+
+        self.__ensure_connected()
+        self.__invalidate_results()
+        tables = self.__metadata.refresh()
+        print 'Loaded %d table names.' % len(tables)
+
     def complete_dot_echo(self, text, line, start_index, end_index):
         return self.__complete_variables(text)
 
@@ -1095,15 +1780,26 @@ class SQLCmd(ECmd):
         sqlcmd, you will be prompted again for interactive input (if sqlcmd
         is running interactively).
 
-        Usage: .run file
-               .load file
+        If a line number is given, the lines of the file before it are
+        skipped. That's how a script whose batch of statements was rolled
+        back (see the "commitevery" setting) is resumed.
+
+        Usage: .run file [line]
+               .load file [line]
         """
-        tokens = args.split(None, 1)
-        if len(tokens) > 1:
+        tokens = args.split()
+        if len(tokens) > 2:
             raise BadCommandError, 'Too many arguments to ".load"'
 
+        start_line = 1
+        if len(tokens) == 2:
+            try:
+                start_line = int(tokens[1])
+            except ValueError:
+                raise BadCommandError, 'Bad line number "%s"' % tokens[1]
+
         try:
-            self.__run_file(os.path.expanduser(tokens[0]))
+            self.__run_file(os.path.expanduser(tokens[0]), start_line)
         except IOError, (ex, msg):
             log.error('Unable to load file "%s": %s' % (tokens[0], msg))
 
@@ -1161,7 +1857,9 @@ class SQLCmd(ECmd):
         Usage: .connect database_alias
 
         where 'database_alias' is a valid database alias from the .sqlcmd
-        startup file.
+        startup file. The current connection is kept open, along with its
+        history and settings, so that switching back to it is immediate.
+        (See the 'poolsize' and 'pooltimeout' settings.)
         """
         tokens = args.split(None, 1)
         if len(tokens) > 1:
@@ -1170,11 +1868,16 @@ class SQLCmd(ECmd):
         if len(tokens) == 0:
             raise BadCommandError, 'Usage: .connect databasename'
 
-        if self.__db != None:
+        # Look the alias up first, so a bad alias doesn't cost us the
+        # current connection.
+        self.__config.find_match(tokens[0])
+        if self.__pending_connection is not None:
             try:
-                self.__db.close()
-            except db.Error:
-                pass
+                self.__await_connection()
+            except db.Error, ex:
+                log.debug('Abandoning connection: %s' % ex)
+        if self.__db != None:
+            self.__park_connection()
 
         self.set_database(tokens[0])
         assert(self.__db_config != None)
@@ -1238,14 +1941,18 @@ The list of settings, their types, and their meaning follow:
 
         else:
             # Pass through to database engine, as if it were a SELECT.
+            # It might change anything, so it's never answered from, and
+            # always invalidates, the result cache.
             self.__ensure_connected()
-            cursor = self.__db.cursor()
+            self.__invalidate_results()
+            bound = self.__bind(command, args)
+            cursor = self.__open_cursor(bound)
             try:
-                self.__handle_select(args, cursor, command=command)
+                self.__handle_select(args, cursor, command=command,
+                                     bound=bound)
             finally:
-                cursor.close()
-            if self.__flag_is_set('autocommit'):
-                self.__db.commit()
+                self.__close_cursor(cursor)
+            self.__statement_done()
 
     def emptyline(self):
         pass
@@ -1263,15 +1970,12 @@ The list of settings, their types, and their meaning follow:
         return items
 
     def __complete_tables(self, text):
-        items = []
-        text = text.strip()
-        tables = self.__get_tables()
-        if len(text) > 0:
-            items = [t for t in tables if t.startswith(text)]
-        else:
-            items = tables
-
-        return items
+        # Never blocks: the metadata cache answers from whatever it has
+        # loaded so far.
+        if self.__metadata is None:
+            return []
+        self.__metadata.ttl = self.__settings['metadatattl'].value
+        return self.__metadata.complete(text.strip())
 
     def __complete_variables(self, text):
         items = []
@@ -1287,15 +1991,32 @@ The list of settings, their types, and their meaning follow:
 
     def __get_tables(self):
         self.__ensure_connected()
-        cursor = self.__db.cursor()
-
-        try:
-            tables = cursor.get_tables()
-            tables.sort()
-            return tables
-
-        finally:
-            cursor.close()
+        self.__metadata.ttl = self.__settings['metadatattl'].value
+        return self.__metadata.tables()
+
+    def __invalidate_metadata(self):
+        if self.__metadata is not None:
+            self.__metadata.invalidate()
+
+    def __result_key(self, bound):
+        # Results are only cached when the cache is enabled, and only
+        # within a session: the key says which database, what was asked
+        # and with which parameter values.
+        ttl = self.__settings['cachettl'].value
+        if ttl <= 0:
+            return None
+        db_key = self.__db_config.db_key
+        if [job for job in self.__jobs.running() if job.db_key == db_key]:
+            return None
+        self.__results.ttl = ttl
+        self.__results.max_bytes = self.__settings['cachemax'].value * 1024
+        (statement, parameters) = bound
+        return (db_key, resultcache.normalize(statement),
+                tuple(parameters or ()))
+
+    def __invalidate_results(self):
+        if self.__db_config is not None:
+            self.__results.invalidate(self.__db_config.db_key)
 
     def __show_vars(self, var_dict):
         width = 0
@@ -1321,9 +2042,18 @@ The list of settings, their types, and their meaning follow:
                                   (value, varname))
 
     def __handle_update(self, command, args):
+        self.__ensure_connected()
+        self.__invalidate_results()
         try:
-            cursor = self.__db.cursor()
-            self.__exec_SQL(cursor, command, args)
+            bound = self.__bind(command, args)
+            cursor = self.__open_cursor(bound)
+            try:
+                with self.__statement_watch():
+                    timer = self.__exec_SQL(cursor, command, args,
+                                            bound=bound)
+            except StatementCancelledError:
+                self.__discard_cursor(cursor)
+                raise
             rows = cursor.rowcount
             if rows == None:
                 print "No row count available."
@@ -1337,149 +2067,175 @@ The list of settings, their types, and their meaning follow:
         except db.Error:
             raise
         else:
-            cursor.close()
-            if self.__flag_is_set('autocommit'):
-                self.__db.commit()
-
-    def __handle_select(self, args, cursor, command="select"):
-        fd, temp = tempfile.mkstemp(".dat", "sqlcmd")
-        os.close(fd)
+            self.__close_cursor(cursor)
+            self.__statement_done()
+            timer.finish(rows=rows)
+            self.__finish_statement(timer)
+
+    def __handle_select(self, args, cursor, command="select", bound=None,
+                        cache_key=None):
+        catalog = self.__catalog(command, args)
+        try:
+            with self.__statement_watch() as watch:
+                timer = self.__exec_SQL(cursor, command, args, bound=bound)
+                (rows, bytes, source) = self.__render(cursor,
+                                                      watch.cursor(cursor),
+                                                      timer, cache_key,
+                                                      catalog)
+        except StatementCancelledError:
+            self.__discard_cursor(cursor)
+            raise
 
-        self.__exec_SQL(cursor, command, args)
+        if watch.limit is not None:
+            # The rest of the rows aren't wanted, and the partial result
+            # mustn't be cached.
+            dbapi.cancel(self.__db, cursor, self.__db_config.db_type,
+                         connect=self.__connector())
+            self.__cursors.discard(cursor)
+            log.warning(watch.limit)
+            cache_key = None
+
+        timer.finish(rows=rows, bytes=bytes)
+        self.__finish_statement(timer)
+        if (cache_key is not None) and (rows is not None):
+            self.__results.put(cache_key, source)
+
+    def __render(self, cursor, source, timer, cache_key, catalog):
+        # Display the rows fetched from source, which wraps cursor.
+        if cache_key is not None:
+            source = self.__results.recorder(source)
 
         # Don't rely on the row count from the cursor. It isn't always
-        # reliable.
-        rows, col_names, col_sizes = self.__calculate_column_sizes(cursor, temp)
-
-        pl = ""
-        if rows != 1:
-            pl = "s"
-        print "%d row%s\n" % (rows, pl)
-
-        if rows > 0:
-            self.__dump_result_set(rows, col_names, col_sizes, temp, cursor)
-
-    def __dump_result_set(self, rows, col_names, col_sizes, temp, cursor):
-
-        # Now, dump the header with the column names, being sure to
-        # honor the padding sizes.
-
-        headers = []
-        rules = []
-        for i in range(0, len(col_names)):
-            headers += ['%-*s' % (col_sizes[i], col_names[i])]
-            rules += ['-' * col_sizes[i]]
-
-        spacing = ' ' * self.__settings['colspacing'].value
-        print spacing.join(headers)
-        print spacing.join(rules)
-
-        # Finally, read back the data and dump it.
-
-        max_binary = self.__settings['binarymax'].value
-        if max_binary < 0:
-            max_binary = sys.maxint
-
-        f = open(temp)
-        eof = False
-        while not eof:
-            try:
-                rs = cPickle.load(f)
-            except EOFError:
-                break
-
-            data = []
-            i = 0
-            for col_value in rs:
-                if col_value == None:
-                    col_value = "NULL"
-                col_info = cursor.description[i]
-                type = col_info[1]
-                strValue = ""
-                format = '%-*s' # left justify
-                if type == self.__db.BINARY:
-                    if self.__flag_is_set('showbinary'):
-                        strValue = col_value.translate(SQLCmd.BINARY_FILTER)
-                        if len(strValue) > max_binary:
-                            strValue = strValue[:max_binary]
-                    else:
-                        strValue = SQLCmd.BINARY_VALUE_MARKER
-
-                elif type == self.__db.NUMBER:
-                    format = '%*s' # right justify
-                    if col_value == "NULL":
-                        pass
-                    elif (col_value - int(col_value)) == 0:
-                        strValue = int(col_value)
-                    else:
-                        strValue = str(col_value)
-                else:
-                    strValue = unicode(col_value)
-
-                data += [format % (col_sizes[i], strValue)]
-                i += 1
-
-            print spacing.join(data)
-
-        print ''
-        f.close()
+        # reliable. The renderer counts the rows as it displays them.
+        out = None
+        if self.__flag_is_set('pager') and self.__interactive and \
+           sys.stdout.isatty():
+            out = pager.open_pager()
+
+        renderer = self.__new_renderer(out=out, timer=timer, catalog=catalog)
+        rows = None
+        try:
+            rows = renderer.render(source)
+        except pager.PagerClosed:
+            # Nobody wants the rest of the rows. Stop the server from
+            # producing them.
+            log.debug('Pager closed. Cancelling query.')
+            dbapi.cancel(self.__db, cursor, self.__db_config.db_type,
+                         connect=self.__connector())
+            self.__cursors.discard(cursor)
+        finally:
+            if out is not None:
+                out.close()
+
+        return (rows, renderer.bytes_written, source)
+
+    def __show_cached_result(self, args, cached):
+        # A cache hit doesn't touch the database, so there's nothing to
+        # time or record in the statistics.
+        self.__echo('select', args)
+        pl = ''
+        if cached.rows != 1:
+            pl = 's'
+        print 'Cached result (%d row%s, %d seconds old).' %\
+              (cached.rows, pl, cached.age)
+
+        out = None
+        if self.__flag_is_set('pager') and self.__interactive and \
+           sys.stdout.isatty():
+            out = pager.open_pager()
 
         try:
-            os.remove(temp)
-            os.close(fd)
-        except:
+            catalog = self.__catalog('select', args)
+            self.__new_renderer(out=out,
+                                catalog=catalog).render(cached.cursor())
+        except pager.PagerClosed:
             pass
+        finally:
+            if out is not None:
+                out.close()
+
+    def __new_renderer(self, out=None, timer=None, catalog=None):
+        return render.ResultSetRenderer(self.__db, out=out, timer=timer,
+                                        catalog=catalog,
+                                        **self.__renderer_options())
+
+    def __catalog(self, command, args):
+        # The catalog metadata for the table a SELECT reads from, so that
+        # "metadata" mode can size its columns. Only simple, single-table
+        # queries are looked up; anything else is sized from the cursor
+        # alone. Only cached metadata is used, since a catalog query on
+        # this connection could abort the user's transaction if it failed;
+        # missing metadata is loaded in the background for next time.
+        if (self.__settings['colwidths'].value != 'metadata') or \
+           (command != 'select'):
+            return None
+
+        m = SINGLE_TABLE_SELECT_RE.search(args)
+        if not m:
+            return None
+
+        table = m.group(1)
+        try:
+            self.__metadata.ttl = self.__settings['metadatattl'].value
+            return self.__metadata.cached_columns(table)
+        except Exception, ex:
+            log.debug('No catalog metadata for "%s": %s' % (table, ex))
+            return None
+
+    def __renderer_options(self):
+        memory_limit = self.__settings['memorymax'].value
+        if memory_limit > 0:
+            memory_limit *= 1024
+
+        return {'col_spacing'  : self.__settings['colspacing'].value,
+                'show_binary'  : self.__flag_is_set('showbinary'),
+                'binary_max'   : self.__settings['binarymax'].value,
+                'width_mode'   : self.__settings['colwidths'].value,
+                'lookahead'    : self.__settings['lookahead'].value,
+                'max_width'    : self.__settings['colwidthmax'].value,
+                'memory_limit' : memory_limit,
+                'fetch_size'   : self.__settings['fetchsize'].value}
+
+    def __get_job(self, args, command):
+        tokens = args.split()
+        if len(tokens) > 1:
+            raise BadCommandError('Usage: %s [job]' % command)
 
-    def __calculate_column_sizes(self, cursor, temp_file):
-        col_names = []
-        col_sizes = []
-        rows = 0
-        if cursor.description:
-            for col in cursor.description:
-                col_names += [col[0]]
-                name_size = len(col[0])
-                if col[1] == self.__db.BINARY:
-                    col_sizes += [max(name_size, len(SQLCmd.BINARY_VALUE_MARKER))]
-                else:
-                    col_sizes += [name_size]
-
-            # Write the results (pickled) to a temporary file. We'll iterate
-            # through them twice: Once to calculate the column sizes, the
-            # second time to display them.
-
-            if cursor.rowcount > 1000:
-                print "Processing result set..."
-
-            max_binary = self.__settings['binarymax'].value
-            if max_binary < 0:
-                max_binary = sys.maxint
-
-            f = open(temp_file, "w")
-            rs = cursor.fetchone()
-            while rs != None:
-                cPickle.dump(rs, f)
-                i = 0
-                rows += 1
-                for col_value in rs:
-                    col_info = cursor.description[i]
-                    type = col_info[1]
-                    if type == self.__db.BINARY:
-                        if self.__flag_is_set('showbinary'):
-                            size = len(col_value.translate(SQLCmd.BINARY_FILTER))
-                            size = min(size, max_binary)
-                        else:
-                            size = len(SQLCmd.BINARY_VALUE_MARKER)
-                    else:
-                        size = len(unicode(col_value))
-
-                    col_sizes[i] = max(col_sizes[i], size)
-                    i += 1
-
-                rs = cursor.fetchone()
-
-            f.close()
-
-        return (rows, col_names, col_sizes)
+        id = None
+        if tokens:
+            try:
+                id = int(tokens[0].lstrip('%'))
+            except ValueError:
+                raise BadCommandError('Bad job number: "%s"' % tokens[0])
+
+        job = self.__jobs.get(id)
+        if job is None:
+            if id is None:
+                raise BadCommandError('No background jobs.')
+            raise BadCommandError('No such job: %d' % id)
+        return job
+
+    def __collect_job(self, job):
+        # Display the rest of a finished job's output, then forget it.
+        sys.stdout.write(job.read_output())
+        if job.state == jobs.FAILED:
+            log.error('[%d] Failed after %5.3f seconds: %s' %
+                      (job.id, job.elapsed, job.error))
+            if not self.__interactive:
+                self.exit_status = 1
+        else:
+            print '[%d] Done in %5.3f seconds.' % (job.id, job.elapsed)
+        self.__reported_jobs.discard(job.id)
+        self.__jobs.remove(job)
+
+    def __report_finished_jobs(self):
+        # Mention each job that has finished, once, before the next command.
+        for job in self.__jobs.jobs():
+            if job.done and (job.id not in self.__reported_jobs):
+                self.__reported_jobs.add(job.id)
+                if self.__interactive:
+                    print '[%d] %s. Use ".fg %d" to see its output.' %\
+                          (job.id, job.state.capitalize(), job.id)
 
     def __handle_describe(self, cmd, args, cursor):
         self.__echo(cmd, args)
@@ -1495,7 +2251,8 @@ The list of settings, their types, and their meaning follow:
                 full = True
 
         table = a[0]
-        results = cursor.get_table_metadata(table)
+        self.__metadata.ttl = self.__settings['metadatattl'].value
+        results = self.__metadata.columns(table)
         width = 0
         for col in results:
             name = col[0]
@@ -1568,7 +2325,16 @@ The list of settings, their types, and their meaning follow:
         print ''
 
     def __handle_exception(self, ex):
-        if isinstance(ex, NonFatalError):
+        if not self.__interactive:
+            self.exit_status = 1
+
+        if isinstance(ex, StatementCancelledError):
+            # Treated like a failed statement, so the connection is left
+            # ready for the next one.
+            log.error('%s' % ex.message)
+            self.__rollback_after_error()
+
+        elif isinstance(ex, NonFatalError):
             log.error('%s' % ex.message)
             if self.__flag_is_set('stacktrace'):
                 traceback.print_exc()
@@ -1580,20 +2346,121 @@ The list of settings, their types, and their meaning follow:
             log.error('%s' % ex.message)
             if self.__flag_is_set('stacktrace'):
                 traceback.print_exc()
-            if self.__db != None: # mostly a hack for PostgreSQL
-                try:
-                    self.__db.rollback()
-                except db.Error:
-                    pass
+            self.__rollback_after_error()
+
+        if self.__batch.open and not isinstance(ex, db.Warning):
+            self.__abort_batch()
+
+    def __rollback_after_error(self):
+        if self.__db != None: # mostly a hack for PostgreSQL
+            try:
+                self.__db.rollback()
+            except db.Error:
+                pass
+            self.__invalidate_results()
+
+    def __substitute_variables(self, s):
+        if not VARIABLE_REFERENCE_PREFIX in s:
+            # Nothing to substitute. This is the common case, and it's
+            # worth skipping the template.
+            return s
+        return SQLCmdStringTemplate(s).substitute(self.__variables)
+
+    def __bind(self, sql_command, args):
+        # Get the (statement, parameters) to run. Unless "bindvars" is set,
+        # the variables have already been substituted, and there are no
+        # parameters.
+        statement = ' '.join([sql_command, args])
+        if not self.__flag_is_set('bindvars'):
+            return (statement, None)
+        return bind.bind_variables(statement, self.__variables,
+                                   self.__db.paramstyle(),
+                                   substitute=self.__substitute_variables)
+
+    def __open_cursor(self, bound):
+        # Statements with parameters reuse the connection's cursor for the
+        # same statement, if it has one.
+        (statement, parameters) = bound
+        if parameters is None:
+            return self.__db.cursor()
+        self.__cursors.max_size = self.__settings['stmtcache'].value
+        return self.__cursors.cursor(statement, self.__db.cursor)
+
+    def __close_cursor(self, cursor):
+        if not self.__cursors.holds(cursor):
+            cursor.close()
 
-    def __exec_SQL(self, cursor, sql_command, args):
+    def __discard_cursor(self, cursor):
+        # Close a cursor whose statement was cancelled, even if it's cached.
+        self.__cursors.discard(cursor)
+        try:
+            cursor.close()
+        except db.Error, ex:
+            log.debug('Unable to close cancelled cursor: %s' % ex)
+
+    def __statement_watch(self):
+        # Ctrl-C, or running past "timeout", asks the database to cancel
+        # the statement. The request is sent from another thread.
+        database = self.__db
+        db_type = self.__db_config.db_type
+        connect = self.__connector()
+        return cancel.StatementWatch(
+            lambda: dbapi.interrupt(database, db_type, connect=connect),
+            timeout=max(self.__settings['timeout'].value, 0),
+            max_rows=max(self.__settings['maxrows'].value, 0),
+            max_bytes=max(self.__settings['maxbytes'].value, 0)
+        )
+
+    def __apply_statement_timeout(self):
+        # Where the database can enforce "timeout" itself, the limit is set
+        # before each statement, since a rollback can undo it. Once it's
+        # been set, it's cleared again when "timeout" goes back to 0.
+        timeout = max(self.__settings['timeout'].value, 0)
+        if (timeout > 0) or self.__server_timeout_set:
+            self.__server_timeout_set = \
+                dbapi.set_statement_timeout(self.__db,
+                                            self.__db_config.db_type,
+                                            timeout) and (timeout > 0)
+
+    def __connector(self):
+        # A function that opens another connection to the current database.
+        db_config = self.__db_config
+        return lambda: self.__open_connection(db_config)
+
+    def __exec_SQL(self, cursor, sql_command, args, bound=None):
         self.__echo(sql_command, args)
-        start_elapsed = time.time()
-        cursor.execute(' '.join([sql_command, args]))
-        end_elapsed = time.time()
-        if self.__flag_is_set('timings'):
-            total_elapsed = end_elapsed - start_elapsed
-            print 'Execution time: %5.3f seconds'  % total_elapsed
+        if (not self.__batch.open) and self.__batching():
+            dbapi.begin(self.__db, cursor)
+            self.__batch.begin(self.__statement_start)
+        if bound is None:
+            bound = self.__bind(sql_command, args)
+        (statement, parameters) = bound
+        self.__apply_statement_timeout()
+        timer = timing.StatementTimer(statement)
+        if parameters is not None:
+            log.debug('Parameters: %s' % ', '.join([repr(p)
+                                                    for p in parameters]))
+        cursor.execute(statement, parameters)
+        timer.executed()
+        if self.__timing_format() == 'brief':
+            print 'Execution time: %5.3f seconds'  % timer.execute
+        return timer
+
+    def __timing_format(self):
+        if not self.__flag_is_set('timings'):
+            return None
+        return self.__settings['timingformat'].value
+
+    def __finish_statement(self, timer):
+        if (self.__stats_log is not None) and self.__flag_is_set('statslog'):
+            self.__stats_log.record(timer)
+
+        format = self.__timing_format()
+        if format == 'full':
+            print timer.format_full()
+            print ''
+        elif format == 'json':
+            print timer.format_json()
 
     def __init_settings_from_config(self):
         errors = []
@@ -1652,45 +2519,226 @@ The list of settings, their types, and their meaning follow:
     def __show_history(self):
         self.__history.show()
 
-    def __run_file(self, file):
+    def __run_file(self, file, start_line=1):
+        try:
+            f = open(file)
+        except IOError, ex:
+            log.error('Cannot run file "%s": %s' % (file, str(ex)))
+            if not self.__interactive:
+                self.exit_status = 1
+        else:
+            self.push_source(self.__read_script(file, f, start_line))
+
+    def __read_script(self, file, f, start_line):
+        # Generate the file's lines one at a time, so that even a huge
+        # script is never read into memory.
+        history = self.__flag_is_set('history')
+        self.__script_depth += 1
         try:
-            with open(file) as f:
-                history = self.__flag_is_set('history')
-                #if history:
-                    #self.cmdqueue += '.set history false'
-                for line in f.readlines():
+            with f:
+                for i, line in enumerate(f):
+                    if self.__script_aborted:
+                        break
+                    if i + 1 < start_line:
+                        continue
                     if line[-1] == '\n':
                         line = line[:-1] # chop \n
-                    self.cmdqueue += [line]
-                if history:
-                    self.cmdqueue += ['.set history true']
+                    self.__script_position = (file, i + 1)
+                    yield line
 
-        except IOError, ex:
-            log.error('Cannot run file "%s": %s' % (file, str(ex)))
+            if self.__script_depth == 1:
+                try:
+                    self.__commit_batch()
+                except:
+                    etype, evalue, etb = sys.exc_info()
+                    self.__handle_exception(evalue)
+        finally:
+            self.__script_depth -= 1
+            if self.__script_depth == 0:
+                self.__script_position = None
+                self.__script_aborted = False
+
+        if history:
+            self.__set_setting('history', 'true')
+
+    def __batching(self):
+        # Whether to group the statements being run into transactions.
+        return (self.__script_depth > 0) and \
+               self.__flag_is_set('autocommit') and \
+               ((self.__settings['commitevery'].value > 0) or
+                (self.__settings['commitsecs'].value > 0))
+
+    def __statement_done(self):
+        # Called after each SQL statement succeeds.
+        if not self.__flag_is_set('autocommit'):
+            return
 
-    def __connect_to(self, db_config):
-        if self.__db != None:
-            self.__save_history()
+        if not self.__batch.open:
+            self.__db.commit()
+        else:
+            self.__batch.add()
+            if self.__batch.due(self.__settings['commitevery'].value,
+                                self.__settings['commitsecs'].value):
+                self.__commit_batch()
+
+    def __commit_batch(self):
+        if self.__batch.open:
+            log.debug('Committing a batch of %d statements.' %
+                      self.__batch.statements)
+            self.__db.commit()
+            self.__batch.clear()
+
+    def __abort_batch(self):
+        # A command failed in the middle of a batch: roll the whole batch
+        # back, and stop running the script, so that nothing runs after
+        # the statements that were lost.
+        statements = self.__batch.statements
+        position = self.__batch.position
+        self.__batch.clear()
+        try:
+            self.__db.rollback()
+        except db.Error:
+            pass
+        self.__invalidate_results()
+
+        self.__script_aborted = True
+        if position is None:
+            log.error('Rolled back the last %d statement(s). Stopped '
+                      'running the script.' % statements)
+        else:
+            (file, line) = position
+            log.error('Rolled back the %d statement(s) run since line %d of '
+                      '"%s". Stopped running the script. To resume from the '
+                      'start of the failed batch, use: .run %s %d' %
+                      (statements, line, file, file, line))
+
+    def __connect_to(self, db_config, background=False):
+        self.__configure_pool()
+        pooled = self.__pool.take(db_config.db_key)
+        if pooled is not None:
+            self.__resume_connection(db_config, pooled)
+            return
 
         driver = db.get_driver(db_config.db_type)
         print 'Connecting to %s database "%s" on host %s.' %\
               (driver.display_name, db_config.database, db_config.host)
-        self.__db = driver.connect(host=db_config.host,
-                                   port=db_config.port,
-                                   user=db_config.user,
-                                   password=db_config.password,
-                                   database=db_config.database)
 
+        # The connection can be opened in the background, so the prompt
+        # comes up right away, unless there's an on-connect script (which
+        # has to run before anything else) or the connection can't be
+        # handed from one thread to another.
+        background = background and (not db_config.on_connect) and \
+                     (not dbapi.is_thread_bound(db_config.db_type))
+        if background:
+            self.__pending_connection = pool.PendingConnection(
+                lambda: self.__open_connection(db_config)
+            )
+        else:
+            self.__db = self.__open_connection(db_config)
 
         history_file = HISTORY_FILE_FORMAT % db_config.primary_alias
         self.__history_file = os.path.expanduser(history_file)
         self.__init_history()
 
+        if self.__stats_log is not None:
+            self.__stats_log.close()
+        stats_file = STATS_FILE_FORMAT % db_config.primary_alias
+        self.__stats_log = stats.StatsLog(os.path.expanduser(stats_file))
+
+        if not background:
+            self.__connected(db_config)
+
+    def __await_connection(self):
+        # Wait for a background connect to finish. If it failed, the
+        # exception is raised here. If the wait is interrupted, the
+        # connection stays pending.
+        pending = self.__pending_connection
+        if not pending.ready:
+            print 'Waiting for the database connection...'
+        try:
+            database = pending.wait()
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.__pending_connection = None
+            raise
+
+        self.__pending_connection = None
+        self.__db = database
+        self.__connected(self.__db_config)
+
+    def __connected(self, db_config):
+        # Set up the things that need an open connection.
+        schema_file = SCHEMA_FILE_FORMAT % db_config.primary_alias
+        self.__metadata = metadata.MetadataCache(
+            self.__db,
+            ttl=self.__settings['metadatattl'].value,
+            store=metadata.SchemaStore(os.path.expanduser(schema_file),
+                                       db_config.db_key),
+            connect=lambda: self.__open_connection(db_config),
+            db_type=db_config.db_type
+        )
+        self.__metadata.preload()
+        self.__cursors = bind.CursorCache()
+        self.__server_timeout_set = False
+
         if db_config.on_connect:
             log.debug('Running on-connect script "%s"' % db_config.on_connect)
             self.__run_file(db_config.on_connect)
 
+    def __park_connection(self):
+        # Keep the connection, and everything that goes with it, in the pool.
+        self.__commit_batch()
+        self.__save_history()
+        if self.__stats_log is not None:
+            self.__stats_log.close()
+        state = {'db_config' : self.__db_config,
+                 'history'   : self.__history.get_history_list(),
+                 'settings'  : dict([(v.name, v.value)
+                                     for v in self.__settings.values()]),
+                 'metadata'  : self.__metadata,
+                 'stats_log' : self.__stats_log,
+                 'cursors'   : self.__cursors}
+        self.__configure_pool()
+        self.__pool.park(self.__db_config.db_key, self.__db, state)
+        self.__db = None
+        self.__metadata = None
+        self.__stats_log = None
+
+    def __resume_connection(self, db_config, pooled):
+        driver = db.get_driver(db_config.db_type)
+        print 'Reusing connection to %s database "%s" on host %s.' %\
+              (driver.display_name, db_config.database, db_config.host)
+        self.__db = pooled.database
+        state = pooled.state
+        self.__metadata = state['metadata']
+        self.__stats_log = state['stats_log']
+        self.__cursors = state['cursors']
+        self.__server_timeout_set = True # Not known; clear it if unwanted.
+        for name, value in state['settings'].items():
+            self.__settings[name].set_value(value)
+
+        history_file = HISTORY_FILE_FORMAT % db_config.primary_alias
+        self.__history_file = os.path.expanduser(history_file)
+        self.__history.replace_history(state['history'])
+
+    def __configure_pool(self):
+        self.__pool.max_idle = self.__settings['poolsize'].value
+        self.__pool.idle_timeout = self.__settings['pooltimeout'].value
+        self.__jobs.configure_pool(self.__pool.max_idle,
+                                   self.__pool.idle_timeout)
+
+    def __open_connection(self, db_config):
+        driver = db.get_driver(db_config.db_type)
+        return driver.connect(host=db_config.host,
+                              port=db_config.port,
+                              user=db_config.user,
+                              password=db_config.password,
+                              database=db_config.database)
+
     def __ensure_connected(self):
+        if self.__pending_connection is not None:
+            self.__await_connection()
         if self.__db == None:
             raise NotConnectedError, 'Not connected to a database.'
 
@@ -1744,15 +2792,24 @@ class Main(object):
                 self.__alias = "__cmdline__"
                 save_history = False
 
-            assert(self.__alias)
+            assert(self.__alias or self.__fanout_pattern)
 
             cmd = SQLCmd(cfg)
             cmd.save_history = save_history
-            cmd.set_database(self.__alias)
+            if self.__batch is not None:
+                cmd.set_setting('commitevery', str(self.__batch))
+            if self.__alias:
+                cmd.set_database(self.__alias)
         except ConfigurationError, ex:
             die(str(ex))
 
-        if self.__input_file:
+        if self.__parallel:
+            return self.__run_scripts()
+        elif self.__fanout_pattern:
+            cmd.run_command_and_exit('.fanout %s %s' %
+                                     (self.__fanout_pattern,
+                                      self.__fanout_query))
+        elif self.__input_file:
             try:
                 cmd.run_file_and_exit(self.__input_file)
             except IOError, (ex, errormsg):
@@ -1761,9 +2818,58 @@ class Main(object):
         else:
             cmd.cmdloop()
 
+        return cmd.exit_status
+
+    def __run_scripts(self):
+        try:
+            scripts = parallel.find_scripts(self.__scripts)
+            deps = {}
+            if self.__order_file:
+                deps = parallel.read_ordering_file(self.__order_file)
+        except ConfigurationError, ex:
+            die(str(ex))
+
+        # Each script runs in its own sqlcmd process, with its own
+        # connection. The child imports the same sqlcmd package as this
+        # process, even if it isn't installed.
+        env = dict(os.environ)
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)
+        ))
+        env['PYTHONPATH'] = os.pathsep.join(
+            [package_dir] + [p for p in [env.get('PYTHONPATH')] if p]
+        )
+        command = [sys.executable, '-c',
+                   'import sys, sqlcmd; sys.argv[0] = "sqlcmd"; '
+                   'sys.exit(sqlcmd.main())',
+                   '-c', self.__config_file,
+                   '-l', self.__log_level_name]
+        if self.__batch is not None:
+            command += ['-b', str(self.__batch)]
+        if self.__db_connect_info:
+            command += ['-d', ','.join(self.__db_connect_info)]
+        else:
+            command += [self.__alias]
+
+        runner = parallel.ScriptRunner(lambda script: command + ['@' + script],
+                                       jobs=self.__jobs, env=env)
+        start = time.time()
+        results = runner.run(scripts, deps)
+        parallel.write_report(results, time.time() - start)
+        if [r for r in results if not r.succeeded]:
+            return 1
+        return 0
+
     def __parse_params(self, argv):
-        USAGE = 'Usage: %prog [OPTIONS] [alias] [@file]'
+        USAGE = 'Usage: %prog [OPTIONS] [alias] [@file]\n' \
+                '       %prog [OPTIONS] [-j N] [-o FILE] alias @file|@dir ...\n' \
+                '       %prog [OPTIONS] --fanout PATTERN query'
         opt_parser = CommandLineParser(usage=USAGE)
+        opt_parser.add_option('-b', '--batch', action='store', type='int',
+                              dest='batch', metavar='N',
+                              help='Commit the statements in the script in '
+                                   'batches of N, instead of one at a time. '
+                                   'Sets "commitevery".')
         opt_parser.add_option('-c', '--config', action='store', dest='config',
                               default=RC_FILE,
                               help='Specifies the configuration file to use. '
@@ -1771,6 +2877,18 @@ class Main(object):
         opt_parser.add_option('-d', '--db', action='store', dest='database',
                               help='Database to use. Format: '
                                     'database,dbtype,host[:port],user,password')
+        opt_parser.add_option('-f', '--fanout', action='store',
+                              dest='fanout', metavar='PATTERN',
+                              help='Run a query against every database whose '
+                                   'alias matches PATTERN, in parallel, then '
+                                   'exit. The query is the only parameter.')
+        opt_parser.add_option('-j', '--jobs', action='store', type='int',
+                              dest='jobs', metavar='N',
+                              help='Run the @file scripts (or the .sql files '
+                                   'in the @directories) in parallel, at most '
+                                   'N at a time, each over its own '
+                                   'connection. Default: %d' %
+                                   DEFAULT_PARALLEL_JOBS)
         opt_parser.add_option('-l', '--loglevel', action='store',
                               dest='loglevel',
                               help='Enable log messages as level "n", where ' \
@@ -1779,6 +2897,11 @@ class Main(object):
         opt_parser.add_option('-L', '--logfile', action='store', dest='logfile',
                               help='Dump log messages to LOGFILE, instead of ' \
                                    'standard output')
+        opt_parser.add_option('-o', '--order', action='store', dest='order',
+                              metavar='FILE',
+                              help='When running scripts in parallel, read '
+                                   'the scripts that must wait for other '
+                                   'scripts from FILE.')
         opt_parser.add_option('-v', '--version', action='store_true',
                               dest='show_version',
                               help='Show the version stamp and exit.')
@@ -1789,8 +2912,6 @@ class Main(object):
             sys.exit(0)
 
         args = args[1:]
-        if not len(args) in (0, 1, 2):
-            opt_parser.die_with_usage('Incorrect number of parameters')
 
         if options.loglevel:
             if not (options.loglevel in LOG_LEVELS):
@@ -1801,22 +2922,41 @@ class Main(object):
         self.__alias = None
         self.__db_connect_info = None
         self.__log_level = LOG_LEVELS[options.loglevel]
+        self.__log_level_name = options.loglevel
         self.__log_file = options.logfile
         self.__config_file = options.config
+        self.__fanout_pattern = options.fanout
+        self.__fanout_query = None
+        self.__batch = options.batch
+
+        if options.fanout:
+            if len(args) != 1:
+                opt_parser.die_with_usage('--fanout requires exactly one '
+                                          'parameter: the query')
+            self.__fanout_query = args[0]
+            args = []
 
-        if len(args) == 0:
-            pass # handled below
-
-        elif len(args) == 1:
-            if args[0].startswith('@'):
-                self.__input_file = args[0][1:]
-            else:
-                self.__alias = args[0]
-        else:
+        if args and (not args[0].startswith('@')):
             self.__alias = args[0]
-            if not args[1].startswith('@'):
+            args = args[1:]
+
+        self.__scripts = []
+        for arg in args:
+            if not arg.startswith('@'):
                 opt_parser.die_with_usage('File parameter must start with "@"')
-            self.__input_file = args[1][1:]
+            self.__scripts.append(arg[1:])
+
+        self.__jobs = options.jobs or DEFAULT_PARALLEL_JOBS
+        self.__order_file = options.order
+        self.__parallel = (options.jobs is not None) or \
+                          (options.order is not None) or \
+                          (len(self.__scripts) > 1) or \
+                          (len([s for s in self.__scripts
+                                if os.path.isdir(s)]) > 0)
+        if self.__scripts and not self.__parallel:
+            self.__input_file = self.__scripts[0]
+        if self.__parallel and not self.__scripts:
+            opt_parser.die_with_usage('No scripts to run')
 
         if options.database:
             self.__db_connect_info = options.database.split(',')
@@ -1824,7 +2964,8 @@ class Main(object):
                 opt_parser.die_with_usage('Bad argument "%s" to -d option' %\
                                           options.database)
 
-        if not (self.__db_connect_info or self.__alias):
+        if not (self.__db_connect_info or self.__alias or
+                self.__fanout_pattern):
             opt_parser.die_with_usage('You must specify either an alias or a '
                                       'valid argument to "-d"')
 
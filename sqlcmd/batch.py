@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Transaction batching for *sqlcmd* scripts.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import time
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['CommitBatch']
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.batch')
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class CommitBatch(object):
+    """
+    Keeps track of the statements in the transaction that's currently open
+    on behalf of a script, so that they can be committed together, once
+    there are enough of them or they've been accumulating long enough.
+    """
+    def __init__(self):
+        self.clear()
+
+    @property
+    def open(self):
+        """Whether a batch has been started and not yet committed."""
+        return self.start_time is not None
+
+    def begin(self, position):
+        """
+        Start a new batch.
+
+        :Parameters:
+            position : tuple
+                the ``(file, line)`` at which the batch's first statement
+                starts, for use in error messages
+        """
+        self.start_time = time.time()
+        self.position = position
+        self.statements = 0
+
+    def add(self):
+        """Note that another statement in the batch has succeeded."""
+        self.statements += 1
+
+    def due(self, max_statements, max_seconds):
+        """
+        Determine whether the batch should be committed now.
+
+        :Parameters:
+            max_statements : int
+                the most statements in a batch, or 0 for no limit
+            max_seconds : int
+                the most seconds a batch may stay open, or 0 for no limit
+
+        :rtype: bool
+        :return: ``True`` if the batch should be committed
+        """
+        if (max_statements > 0) and (self.statements >= max_statements):
+            return True
+        if (max_seconds > 0) and \
+           (time.time() - self.start_time >= max_seconds):
+            return True
+        return False
+
+    def clear(self):
+        """Forget the batch, once it's been committed or rolled back."""
+        self.start_time = None
+        self.position = None
+        self.statements = 0
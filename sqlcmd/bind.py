@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Bind variables and cached cursors for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import re
+
+from sqlcmd import dbapi
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['CursorCache', 'bind_variables']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# The parts of a statement that matter when binding variables. Only the
+# "variable" matches outside strings, quoted identifiers, comments and
+# dollar-quoted bodies become parameters.
+BIND_RE = re.compile(r"""
+    (?P<literal>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?
+      | --[^\n]*
+      | /\*.*?(?:\*/|\Z)
+      | (?<![A-Za-z0-9_$])\$(?P<tag>(?:[A-Za-z_][A-Za-z0-9_]*)?)\$
+        .*?(?:\$(?P=tag)\$|\Z))
+  | \$(?:\{(?P<braced>[A-Za-z0-9_-]+)\}|(?P<name>[A-Za-z0-9_-]+))
+  | (?P<percent>%)
+""", re.VERBOSE | re.DOTALL)
+
+DEFAULT_CURSOR_CACHE_SIZE = 20
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.bind')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def bind_variables(sql, variables, paramstyle, substitute=None):
+    """
+    Turn the variable references (``$name`` or ``${name}``) in a SQL
+    statement into bind parameters. References inside string literals are
+    left to ``substitute``, which replaces them with text, as usual;
+    references in quoted identifiers, comments and dollar-quoted bodies
+    are left alone. An undefined variable is bound as an empty string,
+    just as it would be substituted with one.
+
+    :Parameters:
+        sql : str
+            the statement
+        variables : dict
+            the values of the variables, by name
+        paramstyle : str
+            the DB API parameter style of the driver
+        substitute : function
+            a function to substitute variables in the text of a string
+            literal, or ``None`` to leave string literals alone
+
+    :rtype:  tuple
+    :return: ``(sql, parameters)``, where ``parameters`` is the sequence
+             of values to bind, or ``None`` if the statement refers to no
+             variables (in which case ``sql`` is the statement with its
+             string literals substituted)
+    """
+    chunks = []
+    parameters = []
+    pos = 0
+    for m in BIND_RE.finditer(sql):
+        chunks.append((sql[pos:m.start()], False))
+        pos = m.end()
+        literal = m.group('literal')
+        name = m.group('name') or m.group('braced')
+        if literal is not None:
+            if substitute is not None:
+                literal = substitute(literal)
+            chunks.append((literal, False))
+        elif name is not None:
+            parameters.append(variables.get(name, ''))
+            chunks.append((dbapi.placeholder(paramstyle, len(parameters)),
+                           True))
+        else:
+            chunks.append((m.group(), False))
+    chunks.append((sql[pos:], False))
+
+    if not parameters:
+        return (''.join([text for text, marker in chunks]), None)
+
+    if paramstyle in ('format', 'pyformat'):
+        # The driver treats the statement as a format string.
+        chunks = [(marker and text or text.replace('%', '%%'), marker)
+                  for text, marker in chunks]
+    return (''.join([text for text, marker in chunks]), parameters)
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class CursorCache(object):
+    """
+    A least-recently-used cache of the cursors a connection has used to run
+    parameterized statements, keyed by statement. Drivers that keep a
+    statement prepared on the cursor that last ran it (e.g.,
+    ``cx_Oracle``) skip parsing and planning it again when the same
+    statement is run on the same cursor. Other drivers (e.g., ``sqlite3``,
+    whose statement cache belongs to the connection) only save the cost
+    of opening a cursor.
+    """
+    def __init__(self, max_size=DEFAULT_CURSOR_CACHE_SIZE):
+        """
+        Create a cache.
+
+        :Parameters:
+            max_size : int
+                the most cursors to keep open
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__cursors = {}
+        self.__last_used = {}
+        self.__clock = 0
+
+    def __len__(self):
+        return len(self.__cursors)
+
+    def cursor(self, sql, open_cursor):
+        """
+        Get the cached cursor for a statement, opening (and caching) a new
+        one if there isn't one. If the cache is full, the least recently
+        used cursor is closed. If ``max_size`` is 0 or less, nothing is
+        cached: the cursor is always new, and the caller must close it.
+
+        :Parameters:
+            sql : str
+                the statement, with its parameter markers
+            open_cursor : function
+                function to call to open a new cursor
+
+        :rtype:  grizzled.db.Cursor
+        :return: the cursor
+        """
+        self.__clock += 1
+        if self.max_size <= 0:
+            self.__trim(0)
+            self.misses += 1
+            return open_cursor()
+
+        cursor = self.__cursors.get(sql)
+        if cursor is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            cursor = open_cursor()
+            self.__cursors[sql] = cursor
+        self.__last_used[sql] = self.__clock
+
+        # The statement just used is the most recent, so it's never the
+        # one trimmed.
+        self.__trim(self.max_size)
+        return cursor
+
+    def holds(self, cursor):
+        """
+        Determine whether a cursor belongs to the cache, in which case it
+        must not be closed by the caller.
+
+        :Parameters:
+            cursor : grizzled.db.Cursor
+                the cursor
+
+        :rtype:  bool
+        :return: ``True`` if the cursor is cached
+        """
+        for cached in self.__cursors.values():
+            if cached is cursor:
+                return True
+        return False
+
+    def discard(self, cursor):
+        """
+        Forget a cursor (for instance, because it's been closed after its
+        statement was cancelled).
+
+        :Parameters:
+            cursor : grizzled.db.Cursor
+                the cursor
+        """
+        for sql, cached in self.__cursors.items():
+            if cached is cursor:
+                del self.__cursors[sql]
+                del self.__last_used[sql]
+
+    def close_all(self):
+        """Close all the cached cursors."""
+        self.__trim(0)
+
+    def __trim(self, size):
+        while len(self.__cursors) > size:
+            sql = min(self.__last_used, key=self.__last_used.get)
+            cursor = self.__cursors.pop(sql)
+            del self.__last_used[sql]
+            try:
+                cursor.close()
+            except Exception, ex:
+                log.debug('Unable to close cached cursor: %s' % ex)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Cancelling running statements, on Ctrl-C or when they exceed a limit, for
+*sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import errno
+import logging
+import os
+import select
+import signal
+import threading
+import time
+
+from sqlcmd import dbapi
+from sqlcmd.exception import StatementCancelledError
+
+try:
+    import fcntl
+except ImportError:
+    # Not a POSIX system (e.g., Windows), where select() doesn't work on
+    # the pipe that signal.set_wakeup_fd() needs. Ctrl-C raises
+    # KeyboardInterrupt once the driver returns, as it always did.
+    fcntl = None
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['StatementWatch']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Python 2 writes a NUL byte to the wakeup file descriptor for a signal. A
+# different byte tells the watching thread to stop.
+STOP_WATCHING = 'x'
+
+# Size assumed for a value that isn't a string, when counting the bytes
+# fetched.
+NON_STRING_SIZE = 8
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.cancel')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def batch_size(batch):
+    """
+    Estimate the size of a batch of rows: the length of each string value,
+    plus a fixed amount for any other value.
+
+    :Parameters:
+        batch : list
+            the rows
+
+    :rtype:  int
+    :return: the approximate number of bytes
+    """
+    size = 0
+    for row in batch:
+        for value in row:
+            if value is None:
+                continue
+            if isinstance(value, (basestring, buffer)):
+                size += len(value)
+            else:
+                size += NON_STRING_SIZE
+    return size
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class StatementWatch(object):
+    """
+    Watches a running statement, and asks the database to cancel it when
+    the user presses Ctrl-C (SIGINT) or the statement runs too long. It
+    also stops fetching rows once there are too many of them.
+
+    Python only runs signal handlers between byte codes, so a handler
+    can't do anything until the driver call that's running the statement
+    returns, which is exactly what it needs to make happen. Instead, the
+    signal wakes a separate thread (via ``signal.set_wakeup_fd()``), which
+    sends the cancel request while the main thread is still waiting for
+    the database. The same thread sends it when the time limit expires.
+    The handler itself just notes when the interrupt arrived. On systems
+    without ``fcntl`` (e.g., Windows), SIGINT is left alone, so Ctrl-C
+    raises ``KeyboardInterrupt`` once the driver returns, and only the
+    time limit is watched.
+
+    Use it in a ``with`` statement around the code that runs the
+    statement and fetches its rows, and fetch the rows through
+    ``cursor()``. Fetching stops once the statement is cancelled, or
+    (without an error) once the row or byte limit is reached; ``limit``
+    then describes the limit. If the statement was cancelled, the
+    ``with`` statement raises a ``StatementCancelledError`` saying why,
+    and how long the statement took to stop, whatever else happened
+    inside it.
+    """
+    def __init__(self, cancel, timeout=0, max_rows=0, max_bytes=0):
+        """
+        Create a watch.
+
+        :Parameters:
+            cancel : function
+                a function that asks the database to cancel the running
+                statement, and returns ``True`` if it could
+            timeout : int
+                how many seconds the statement may run, or 0 for no limit
+            max_rows : int
+                how many rows may be fetched, or 0 for no limit
+            max_bytes : int
+                roughly how many bytes of rows may be fetched, or 0 for no
+                limit
+        """
+        self.requested = None
+        self.timed_out = False
+        self.sent = False
+        self.stopped = None
+        self.limit = None
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.__cancel = cancel
+        self.__started = None
+        self.__old_handler = None
+        self.__old_wakeup_fd = -1
+        self.__pipe = None
+        self.__stop = None
+        self.__signals = False
+        self.__thread = None
+
+    @property
+    def stop_time(self):
+        """
+        How many seconds passed between the cancel request and the
+        statement stopping, or ``None`` if it wasn't cancelled.
+        """
+        if (self.requested is None) or (self.stopped is None):
+            return None
+        return self.stopped - self.requested
+
+    def __enter__(self):
+        self.__started = time.time()
+
+        # Signal handlers can only be installed by the main thread. Other
+        # threads just get the time limit.
+        self.__signals = (fcntl is not None) and \
+                         (threading.currentThread().getName() == 'MainThread')
+        if not (self.__signals or (self.timeout > 0)):
+            return self
+
+        if fcntl is None:
+            self.__stop = threading.Event()
+        else:
+            (read_fd, write_fd) = os.pipe()
+            flags = fcntl.fcntl(write_fd, fcntl.F_GETFL)
+            fcntl.fcntl(write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self.__pipe = (read_fd, write_fd)
+        if self.__signals:
+            self.__old_handler = signal.signal(signal.SIGINT,
+                                               self.__on_interrupt)
+            self.__old_wakeup_fd = signal.set_wakeup_fd(write_fd)
+        self.__thread = threading.Thread(target=self.__watch,
+                                         name='sqlcmd-cancel')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.__thread is not None:
+            if self.__signals:
+                signal.set_wakeup_fd(self.__old_wakeup_fd)
+                signal.signal(signal.SIGINT, self.__old_handler)
+            if self.__pipe is None:
+                self.__stop.set()
+                self.__thread.join()
+            else:
+                os.write(self.__pipe[1], STOP_WATCHING)
+                self.__thread.join()
+                for fd in self.__pipe:
+                    os.close(fd)
+            self.__thread = None
+
+        if (self.requested is None) and (type is not None) and \
+           (self.timeout > 0) and \
+           (time.time() - self.__started >= self.timeout):
+            # The database's own statement timeout got there first.
+            self.timed_out = True
+            self.requested = self.__started + self.timeout
+
+        if self.requested is None:
+            return False
+
+        self.stopped = time.time()
+        if self.timed_out:
+            pl = ''
+            if self.timeout != 1:
+                pl = 's'
+            message = 'Statement cancelled after running for the %d ' \
+                      'second%s allowed by "timeout".' % (self.timeout, pl)
+        elif self.sent:
+            message = 'Statement cancelled.'
+        else:
+            message = 'Statement interrupted, but the database couldn\'t ' \
+                      'be asked to cancel it.'
+        raise StatementCancelledError('%s It stopped %5.3f seconds after the '
+                                      'cancel request.' %
+                                      (message, self.stop_time))
+
+    def cancel(self):
+        """
+        Ask the database to cancel the statement now. This method is meant
+        to be called from a thread other than the one running the
+        statement.
+
+        :rtype:  bool
+        :return: ``True`` if a cancel request was sent
+        """
+        if self.requested is None:
+            self.requested = time.time()
+        self.sent = self.__cancel()
+        log.debug('Cancel request sent: %s' % self.sent)
+        return self.sent
+
+    def check(self):
+        """
+        Raise ``KeyboardInterrupt`` if the statement has been cancelled.
+        """
+        if self.requested is not None:
+            raise KeyboardInterrupt
+
+    def cursor(self, cursor):
+        """
+        Wrap a cursor on which a query was just executed, so that fetching
+        its rows stops once the statement is cancelled or a limit is
+        reached.
+
+        :Parameters:
+            cursor : grizzled.db.Cursor
+                the cursor
+
+        :rtype:  object
+        :return: an object to pass to the renderer in place of the cursor
+        """
+        return _WatchedCursor(cursor, self)
+
+    def __on_interrupt(self, signum, frame):
+        # Runs in the main thread, once the driver lets go. The watcher
+        # thread has usually seen the signal already.
+        if self.requested is None:
+            self.requested = time.time()
+
+    def __watch(self):
+        ready = self.__wait_for_wakeup()
+        if ready:
+            # Under Python 2, only signals with Python handlers wake this
+            # thread, and the only one here is SIGINT.
+            if (self.__pipe is None) or \
+               (os.read(self.__pipe[0], 1) == STOP_WATCHING):
+                return
+        else:
+            log.debug('Statement timed out after %d seconds.' % self.timeout)
+            self.timed_out = True
+
+        if self.requested is None:
+            self.requested = time.time()
+        self.sent = self.__cancel()
+        log.debug('Cancel request sent: %s' % self.sent)
+
+    def __wait_for_wakeup(self):
+        # Returns whether the pipe is readable, or False on timeout.
+        while True:
+            remaining = None
+            if self.timeout > 0:
+                remaining = max(self.__started + self.timeout - time.time(),
+                                0)
+            if self.__pipe is None:
+                # Only the time limit is being watched.
+                self.__stop.wait(remaining)
+                return self.__stop.isSet()
+            try:
+                (ready, ignored, ignored) = select.select([self.__pipe[0]],
+                                                          [], [], remaining)
+                return bool(ready)
+            except select.error, ex:
+                # The signal may have been delivered to this thread.
+                if ex.args[0] != errno.EINTR:
+                    raise
+
+class _WatchedCursor(object):
+    def __init__(self, cursor, watch):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.__cursor = cursor
+        self.__watch = watch
+        self.__rows = 0
+        self.__bytes = 0
+
+    def fetchmany(self, n):
+        watch = self.__watch
+        watch.check()
+        if watch.limit is not None:
+            return []
+
+        batch = dbapi.fetchmany(self.__cursor, n)
+        self.__rows += len(batch)
+        if (watch.max_rows > 0) and (self.__rows > watch.max_rows):
+            batch = batch[:len(batch) - (self.__rows - watch.max_rows)]
+            self.__rows = watch.max_rows
+            watch.limit = 'Stopped after %d rows, the "maxrows" limit. The ' \
+                          'remaining rows were discarded.' % watch.max_rows
+
+        if watch.max_bytes > 0:
+            self.__bytes += batch_size(batch)
+            if self.__bytes > watch.max_bytes:
+                watch.limit = 'Stopped after %d rows, which reached the ' \
+                              '"maxbytes" limit (%d bytes). The remaining ' \
+                              'rows were discarded.' %\
+                              (self.__rows, watch.max_bytes)
+        return batch
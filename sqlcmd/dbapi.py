@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Helpers that reach beneath the Grizzled db wrappers, for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+
+from grizzled import db
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['begin', 'can_interrupt', 'cancel', 'fetchmany', 'fetch_batches',
+           'interrupt', 'is_thread_bound', 'ping', 'placeholder',
+           'set_statement_timeout', 'underlying_connection',
+           'underlying_cursor']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Trivial queries used to check that a connection still works.
+DEFAULT_PING_QUERY = 'SELECT 1'
+PING_QUERIES = {'oracle' : 'SELECT 1 FROM dual'}
+
+# Database types whose connections can only be used by the thread that
+# opened them.
+THREAD_BOUND_TYPES = ('sqlite',)
+
+# Name of the method an enhanced driver (a grizzled.db.DBDriver subclass)
+# can provide to cancel the statement running on one of its connections.
+# It's called with the DB API connection.
+DRIVER_CANCEL_HOOK = 'cancel_statement'
+
+# Methods DB API connections provide to cancel the running statement:
+# psycopg2 has cancel(); sqlite3 has interrupt().
+CONNECTION_CANCEL_METHODS = ('cancel', 'interrupt')
+
+# Statements that set a server-side time limit on each statement a session
+# runs, in milliseconds (0 meaning none), by database type. (MySQL's limit
+# only applies to SELECT statements.)
+STATEMENT_TIMEOUT_SQL = {
+    'postgresql' : 'SET statement_timeout = %d',
+    'mysql'      : 'SET SESSION max_execution_time = %d',
+}
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.dbapi')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def underlying_cursor(cursor):
+    """
+    Get the real DB API cursor wrapped by a ``grizzled.db.Cursor``.
+
+    :Parameters:
+        cursor : grizzled.db.Cursor
+            the wrapping cursor
+
+    :rtype:  object
+    :return: the DB API cursor, or ``None`` if ``cursor`` isn't a Grizzled
+             cursor
+    """
+    return getattr(cursor, '_Cursor__cursor', None)
+
+def underlying_connection(database):
+    """
+    Get the real DB API connection wrapped by a ``grizzled.db.DB``.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the wrapping database object
+
+    :rtype:  object
+    :return: the DB API connection, or ``None`` if ``database`` isn't a
+             Grizzled database object
+    """
+    return getattr(database, '_DB__db', None)
+
+def begin(database, cursor):
+    """
+    Start an explicit transaction, if the connection would otherwise
+    commit every statement by itself. Grizzled opens SQLite connections in
+    that mode, which makes a batch of inserts cost one disk sync per row.
+    Other drivers already start a transaction implicitly, so this function
+    does nothing for them. The transaction is ended by the usual
+    ``commit()`` or ``rollback()``.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database
+        cursor : grizzled.db.Cursor
+            a cursor on which to issue the ``BEGIN``
+
+    :rtype:  bool
+    :return: ``True`` if a transaction was started, ``False`` if not
+    """
+    connection = underlying_connection(database)
+    if getattr(connection, 'isolation_level', '') is not None:
+        return False
+
+    try:
+        cursor.execute('BEGIN')
+        return True
+    except db.Error, ex:
+        # Most likely, a transaction is already active.
+        log.debug('BEGIN failed: %s' % ex)
+        return False
+
+def can_interrupt(database, db_type=None):
+    """
+    Determine whether ``interrupt()`` has a way to cancel a statement
+    running on a connection.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database
+        db_type : str
+            the Grizzled database type (e.g., "mysql"), if known
+
+    :rtype:  bool
+    :return: ``True`` if a statement can be cancelled, ``False`` if not
+    """
+    connection = underlying_connection(database)
+    if connection is None:
+        return False
+
+    if _driver_cancel_hook(database) is not None:
+        return True
+
+    for method in CONNECTION_CANCEL_METHODS:
+        if getattr(connection, method, None) is not None:
+            return True
+
+    return (db_type == 'mysql') and hasattr(connection, 'thread_id')
+
+def interrupt(database, db_type=None, connect=None):
+    """
+    Ask the database server to stop working on whatever statement is
+    running on a connection, without waiting for it to stop. This function
+    is meant to be called from a thread other than the one running the
+    statement, which gets an error once the server gives up on it.
+
+    The enhanced driver's ``cancel_statement()`` method is used, if it
+    has one; otherwise, the connection's ``cancel()`` (psycopg2) or
+    ``interrupt()`` (sqlite3) method. A MySQL statement is cancelled by
+    issuing ``KILL QUERY`` on a second connection, if ``connect`` is
+    supplied. Errors are logged, not raised.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database on which the statement is running
+        db_type : str
+            the Grizzled database type (e.g., "mysql"), if known
+        connect : function
+            a function that opens another connection to the same database,
+            if one is needed to cancel the statement
+
+    :rtype:  bool
+    :return: ``True`` if a cancel request was sent, ``False`` if there's no
+             way to send one
+    """
+    connection = underlying_connection(database)
+    if connection is None:
+        return False
+
+    hook = _driver_cancel_hook(database)
+    if hook is not None:
+        try:
+            hook(connection)
+            return True
+        except Exception, ex:
+            log.debug('%s() failed: %s' % (DRIVER_CANCEL_HOOK, ex))
+            return False
+
+    for method in CONNECTION_CANCEL_METHODS:
+        func = getattr(connection, method, None)
+        if func is not None:
+            try:
+                func()
+                return True
+            except Exception, ex:
+                log.debug('%s() failed: %s' % (method, ex))
+                return False
+
+    if (db_type == 'mysql') and (connect is not None) and \
+       hasattr(connection, 'thread_id'):
+        return _kill_query(connection.thread_id(), connect)
+
+    return False
+
+def cancel(database, cursor, db_type=None, connect=None):
+    """
+    Ask the database server to stop working on whatever statement is
+    running on a connection (for instance, because nobody wants the rest
+    of its rows), then close the cursor. Drivers that have no way of
+    cancelling a statement just get the cursor closed. Errors are logged,
+    not raised.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database on which the statement is running
+        cursor : grizzled.db.Cursor
+            the cursor running the statement
+        db_type : str
+            the Grizzled database type, if known (see ``interrupt()``)
+        connect : function
+            a function that opens another connection to the same database
+            (see ``interrupt()``)
+
+    :rtype:  bool
+    :return: ``True`` if a cancel request was sent to the driver, ``False``
+             if the driver doesn't support one
+    """
+    cancelled = interrupt(database, db_type, connect)
+    try:
+        cursor.close()
+    except Exception, ex:
+        log.debug('Unable to close cancelled cursor: %s' % ex)
+
+    return cancelled
+
+def ping(database, db_type):
+    """
+    Check that a connection still works, by running a trivial query on it.
+    Errors are logged, not raised.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database
+        db_type : str
+            the Grizzled database type (e.g., "oracle")
+
+    :rtype:  bool
+    :return: ``True`` if the query succeeded, ``False`` if not
+    """
+    sql = PING_QUERIES.get(db_type, DEFAULT_PING_QUERY)
+    try:
+        cursor = database.cursor()
+        try:
+            cursor.execute(sql)
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        return True
+    except Exception, ex:
+        log.debug('Connection check failed: %s' % ex)
+        return False
+
+def set_statement_timeout(database, db_type, seconds):
+    """
+    Have the database server cancel any statement that runs longer than a
+    time limit, if it supports that. The limit stays in effect for the
+    connection (though a rollback can undo it, on some databases) until it
+    is changed again. Errors are logged, not raised.
+
+    :Parameters:
+        database : grizzled.db.DB
+            the database
+        db_type : str
+            the Grizzled database type (e.g., "postgresql")
+        seconds : int
+            the time limit, or 0 to remove the limit
+
+    :rtype:  bool
+    :return: ``True`` if the limit was set, ``False`` if the database
+             doesn't support one, or setting it failed
+    """
+    sql = STATEMENT_TIMEOUT_SQL.get(db_type)
+    if sql is None:
+        return False
+
+    try:
+        cursor = database.cursor()
+        try:
+            cursor.execute(sql % (seconds * 1000))
+        finally:
+            cursor.close()
+        return True
+    except Exception, ex:
+        log.debug('Unable to set statement timeout: %s' % ex)
+        return False
+
+def is_thread_bound(db_type):
+    """
+    Determine whether a connection must be used only by the thread that
+    opened it. (The ``sqlite3`` module enforces that.)
+
+    :Parameters:
+        db_type : str
+            the Grizzled database type
+
+    :rtype:  bool
+    :return: ``True`` if connections can't be handed to another thread
+    """
+    return db_type in THREAD_BOUND_TYPES
+
+def placeholder(paramstyle, position):
+    """
+    Get the parameter marker for a positional parameter, for a driver's
+    parameter style. The parameters themselves are passed as a sequence.
+
+    :Parameters:
+        paramstyle : str
+            the DB API parameter style of the driver
+        position : int
+            the parameter's position, starting at 1
+
+    :rtype:  str
+    :return: the parameter marker
+    """
+    if paramstyle == 'qmark':
+        return '?'
+    elif paramstyle in ('format', 'pyformat'):
+        return '%s'
+    else:
+        # 'numeric' and 'named'. Drivers using 'named' (e.g., cx_Oracle)
+        # also accept positional ":1"-style parameters.
+        return ':%d' % position
+
+def fetchmany(cursor, n):
+    """
+    Fetch up to ``n`` rows from a cursor.
+
+    ``grizzled.db.Cursor.fetchmany()`` fetches the rows but doesn't return
+    them, so this function calls the underlying DB API cursor directly,
+    translating its exceptions the same way Grizzled does.
+
+    :Parameters:
+        cursor : grizzled.db.Cursor
+            the cursor
+        n : int
+            maximum number of rows to fetch
+
+    :rtype:  list
+    :return: the rows; an empty list means there are no more
+    """
+    real_cursor = underlying_cursor(cursor)
+    if real_cursor is None:
+        return cursor.fetchmany(n)
+
+    dbi = cursor._Cursor__driver.get_import()
+    try:
+        return real_cursor.fetchmany(n)
+    except dbi.Warning, ex:
+        raise db.Warning(ex)
+    except dbi.Error, ex:
+        raise db.Error(ex)
+
+def fetch_batches(cursor, n):
+    """
+    Generator that fetches the remaining rows from a cursor, ``n`` rows
+    at a time.
+
+    :Parameters:
+        cursor : grizzled.db.Cursor
+            the cursor
+        n : int
+            maximum number of rows in each batch
+
+    :rtype:  generator
+    :return: a generator yielding non-empty lists of rows
+    """
+    n = max(n, 1)
+    while True:
+        batch = fetchmany(cursor, n)
+        if not batch:
+            break
+        yield batch
+
+def _driver_cancel_hook(database):
+    driver = getattr(database, '_DB__driver', None)
+    return getattr(driver, DRIVER_CANCEL_HOOK, None)
+
+def _kill_query(thread_id, connect):
+    try:
+        killer = connect()
+    except Exception, ex:
+        log.debug('Unable to connect to cancel the statement: %s' % ex)
+        return False
+
+    try:
+        cursor = killer.cursor()
+        try:
+            cursor.execute('KILL QUERY %d' % thread_id)
+        finally:
+            cursor.close()
+        return True
+    except Exception, ex:
+        log.debug('KILL QUERY failed: %s' % ex)
+        return False
+    finally:
+        killer.close()
@@ -47,6 +47,7 @@ $Id$
 # ---------------------------------------------------------------------------
 
 from cmd import Cmd
+from collections import deque
 import logging
 import os
 import sys
@@ -89,6 +90,8 @@ class ECmd(Cmd):
 
         """
         Cmd.__init__(self, completekey, stdin, stdout)
+        self.cmdqueue = deque()
+        self.__sources = []
 
     def interrupted(self):
         """
@@ -96,6 +99,40 @@ class ECmd(Cmd):
         """
         pass
 
+    def push_source(self, lines):
+        """
+        Read commands from an iterable of lines (typically a generator over
+        a script file) before going back to the previous source of input.
+        The lines are consumed lazily, one at a time, so the source is never
+        held in memory. Sources nest: a source pushed while another is
+        being read is drained first.
+
+        :Parameters:
+            lines : iterable
+                the lines, without their trailing newlines
+        """
+        self.__sources.append(iter(lines))
+
+    def next_line(self):
+        """
+        Get the next command to run: first any command in ``cmdqueue``,
+        then the next line of the innermost pushed source and, when all
+        sources are exhausted, the user's input.
+
+        :rtype: str
+        :return: the next line of input
+        """
+        if self.cmdqueue:
+            return self.cmdqueue.popleft()
+
+        while self.__sources:
+            try:
+                return self.__sources[-1].next()
+            except StopIteration:
+                self.__sources.pop()
+
+        return self.get_input(self.prompt)
+
     def cmdloop(self, intro=None):
         """
         Repeatedly issue a prompt, accept input, parse an initial prefix
@@ -122,12 +159,7 @@ class ECmd(Cmd):
             stop = None
             while not stop:
                 try:
-                    if self.cmdqueue:
-                        line = self.cmdqueue.pop(0)
-                    else:
-                        line = self.get_input(self.prompt)
-
-                    line = self.precmd(line)
+                    line = self.precmd(self.next_line())
                     stop = self.onecmd(line)
                     stop = self.postcmd(stop, line)
                 except KeyboardInterrupt:
@@ -75,3 +75,11 @@ class BadCommandError(NonFatalError):
     """Thrown to indicate bad input from the user."""
     def __init__(self, value):
         NonFatalError.__init__(self, value)
+
+class StatementCancelledError(NonFatalError):
+    """
+    Thrown to indicate that a running SQL statement was stopped, because
+    the user interrupted it.
+    """
+    def __init__(self, value):
+        NonFatalError.__init__(self, value)
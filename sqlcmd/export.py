@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Result set export for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import base64
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import logging
+import os
+
+from sqlcmd.dbapi import fetch_batches
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['EXPORT_FORMATS', 'DelimitedExporter', 'JSONLinesExporter',
+           'open_data_file', 'export_result_set']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+EXPORT_FORMATS = ('csv', 'tsv', 'jsonl')
+
+GZIP_EXTENSION = '.gz'
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.export')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def open_data_file(path, mode='wb'):
+    """
+    Open a file for export or import. If the file's name ends in ".gz",
+    it's opened as a gzip file.
+
+    :Parameters:
+        path : str
+            the path to the file
+        mode : str
+            the mode in which to open the file
+
+    :rtype:  file
+    :return: the open file
+    """
+    path = os.path.expanduser(path)
+    if path.endswith(GZIP_EXTENSION):
+        return gzip.open(path, mode)
+    else:
+        return open(path, mode)
+
+def export_result_set(cursor, format, f, fetch_size=500, timer=None):
+    """
+    Write the rows of an executed query to a file, without any column
+    sizing or padding, fetching the rows in batches.
+
+    :Parameters:
+        cursor : grizzled.db.Cursor
+            the cursor on which the query was executed
+        format : str
+            one of the values in ``EXPORT_FORMATS``
+        f : file
+            the open output file
+        fetch_size : int
+            number of rows to fetch at a time
+        timer : sqlcmd.timing.StatementTimer
+            if not ``None``, the timer in which to record fetch times
+
+    :rtype:  int
+    :return: the number of rows written
+    """
+    col_names = [col[0] for col in (cursor.description or [])]
+    if format == 'csv':
+        exporter = DelimitedExporter(f, col_names, 'excel')
+    elif format == 'tsv':
+        exporter = DelimitedExporter(f, col_names, 'excel-tab')
+    elif format == 'jsonl':
+        exporter = JSONLinesExporter(f, col_names)
+    else:
+        raise ValueError, 'Unknown export format "%s"' % format
+
+    rows = 0
+    if col_names:
+        batches = fetch_batches(cursor, fetch_size)
+        if timer is not None:
+            batches = timer.timed_batches(batches)
+        for batch in batches:
+            exporter.write_rows(batch)
+            rows += len(batch)
+
+    return rows
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, buffer):
+        return base64.b64encode(str(value))
+    return value
+
+def _json_value(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, decimal.Decimal):
+        if value.is_finite():
+            return str(value)
+        return json.dumps(str(value))
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return json.dumps(value.isoformat())
+    if isinstance(value, buffer):
+        return json.dumps(base64.b64encode(str(value)))
+    if isinstance(value, str):
+        return json.dumps(value.decode('utf-8', 'replace'))
+    return json.dumps(unicode(value))
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class DelimitedExporter(object):
+    """
+    Writes rows as delimited text (CSV or TSV), preceded by a header line
+    with the column names. NULLs are written as empty fields, Unicode
+    values are encoded as UTF-8, and binary values are base64-encoded.
+    """
+    def __init__(self, f, col_names, dialect):
+        """
+        Create a new exporter and write the header line.
+
+        :Parameters:
+            f : file
+                the open output file
+            col_names : list
+                the column names
+            dialect : str
+                the ``csv`` module dialect to use
+        """
+        self.__writer = csv.writer(f, dialect=dialect, lineterminator='\n')
+        self.__writer.writerow([_encode(name) for name in col_names])
+
+    def write_rows(self, rows):
+        self.__writer.writerows([[_encode(v) for v in row] for row in rows])
+
+class JSONLinesExporter(object):
+    """
+    Writes each row as a JSON object on a line by itself. Numbers are
+    written as JSON numbers, dates and times as ISO 8601 strings, and
+    binary values as base64-encoded strings.
+    """
+    def __init__(self, f, col_names):
+        """
+        Create a new exporter.
+
+        :Parameters:
+            f : file
+                the open output file
+            col_names : list
+                the column names
+        """
+        self.__f = f
+        self.__keys = [_json_value(name) + ': ' for name in col_names]
+
+    def write_rows(self, rows):
+        keys = self.__keys
+        lines = []
+        for row in rows:
+            fields = [keys[i] + _json_value(row[i])
+                      for i in range(0, len(row))]
+            lines.append('{' + ', '.join(fields) + '}\n')
+        self.__f.write(''.join(lines))
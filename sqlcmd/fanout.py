@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Runs a query against several databases at once.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import fnmatch
+import logging
+import Queue
+import sys
+import threading
+
+from sqlcmd import dbapi
+from sqlcmd import render
+from sqlcmd import timing
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['FanOut', 'ShardResult', 'match_databases']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+COLUMN_SEPARATOR = u' | '
+ALIAS_HEADER = u'alias'
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.fanout')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def match_databases(config, pattern):
+    """
+    Find the databases whose aliases match a shell-style wildcard pattern
+    (e.g., "shard*"). A database with several matching aliases is only
+    returned once.
+
+    :Parameters:
+        config : sqlcmd.config.SQLCmdConfig
+            the configuration
+        pattern : str
+            the pattern
+
+    :rtype:  list
+    :return: the ``DBInstanceConfigItem`` objects for the matching
+             databases, sorted by primary alias
+    """
+    matches = {}
+    for alias in config.get_aliases():
+        if fnmatch.fnmatchcase(alias, pattern):
+            item = config.get(alias)
+            matches[item.db_key] = item
+    return sorted(matches.values(), key=lambda item: item.primary_alias)
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ShardResult(object):
+    """
+    The outcome of running a fanned-out query against one database.
+    """
+    def __init__(self, alias, statement):
+        self.alias = alias
+        self.timer = timing.StatementTimer(statement)
+        self.error = None
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+class FanOut(object):
+    """
+    Runs one query against several databases in parallel, using a fixed
+    number of worker threads, each with its own connection. Result rows are
+    written as they arrive, from whichever database returns them first,
+    each tagged with the alias of the database it came from.
+    """
+    def __init__(self,
+                 db_configs,
+                 connect,
+                 workers=8,
+                 out=None,
+                 fetch_size=500,
+                 show_binary=False,
+                 binary_max=20):
+        """
+        Create a new fan-out.
+
+        :Parameters:
+            db_configs : list
+                the ``DBInstanceConfigItem`` objects for the databases
+            connect : function
+                a function that takes a ``DBInstanceConfigItem`` and returns
+                an open connection to it. It's called from the worker
+                threads.
+            workers : int
+                the maximum number of databases to query at once
+            out : file
+                where to write the rows. Defaults to ``sys.stdout``.
+            fetch_size : int
+                number of rows to fetch from each cursor at a time
+            show_binary : bool
+                whether or not to display the contents of binary columns
+            binary_max : int
+                maximum number of characters to show from a binary column
+        """
+        self.__db_configs = db_configs
+        self.__connect = connect
+        self.__workers = max(1, min(workers, len(db_configs)))
+        self.__out = out or sys.stdout
+        self.__fetch_size = fetch_size
+        self.__show_binary = show_binary
+        self.__binary_max = binary_max
+        self.__alias_width = max([len(ALIAS_HEADER)] +
+                                 [len(c.primary_alias) for c in db_configs])
+        self.__stopped = False
+
+    def run(self, sql):
+        """
+        Run the query against every database, writing the rows as they
+        arrive.
+
+        :Parameters:
+            sql : str
+                the query
+
+        :rtype:  list
+        :return: a ``ShardResult`` for each database, in the order the
+                 databases were given
+        """
+        todo = Queue.Queue()
+        for db_config in self.__db_configs:
+            todo.put(db_config)
+        results = Queue.Queue()
+
+        for i in range(self.__workers):
+            t = threading.Thread(target=self.__work, args=(sql, todo, results),
+                                 name='sqlcmd-fanout-%d' % i)
+            t.setDaemon(True)
+            t.start()
+
+        finished = {}
+        header = None
+        try:
+            while len(finished) < len(self.__db_configs):
+                try:
+                    # Wait in short slices, so Ctrl-C gets through.
+                    item = results.get(True, 0.1)
+                except Queue.Empty:
+                    continue
+
+                if isinstance(item, ShardResult):
+                    finished[item.alias] = item
+                    continue
+
+                (alias, names, lines) = item
+                if names != header:
+                    header = names
+                    self.__write_header(names)
+                self.__write_lines(alias, lines)
+        except KeyboardInterrupt:
+            # Tell the workers to give up after their current batch.
+            self.__stopped = True
+            raise
+
+        return [finished[c.primary_alias] for c in self.__db_configs]
+
+    def __write_header(self, names):
+        header = COLUMN_SEPARATOR.join([ALIAS_HEADER.ljust(self.__alias_width)]
+                                       + list(names))
+        self.__out.write(u'%s\n%s\n' % (header, u'-' * len(header)))
+
+    def __write_lines(self, alias, lines):
+        prefix = alias.ljust(self.__alias_width) + COLUMN_SEPARATOR
+        self.__out.write(u''.join([u'%s%s\n' % (prefix, line)
+                                   for line in lines]))
+
+    def __work(self, sql, todo, results):
+        while not self.__stopped:
+            try:
+                db_config = todo.get_nowait()
+            except Queue.Empty:
+                break
+            results.put(self.__run_one(sql, db_config, results))
+
+    def __run_one(self, sql, db_config, results):
+        alias = db_config.primary_alias
+        result = ShardResult(alias, sql)
+        timer = result.timer
+        rows = 0
+        try:
+            database = self.__connect(db_config)
+            try:
+                cursor = database.cursor()
+                try:
+                    cursor.execute(sql)
+                    timer.executed()
+                    if cursor.description:
+                        rows = self.__fetch(alias, cursor, database, timer,
+                                            results)
+                    else:
+                        rows = cursor.rowcount
+                        database.commit()
+                finally:
+                    cursor.close()
+            finally:
+                database.close()
+            timer.finish(rows=rows)
+        except Exception, ex:
+            log.debug('Fan-out query failed on "%s": %s' % (alias, ex))
+            result.error = str(ex) or ex.__class__.__name__
+        return result
+
+    def __fetch(self, alias, cursor, database, timer, results):
+        names = tuple([d[0] for d in cursor.description])
+        plans = [render.ColumnPlan(d[0], d[1], database, self.__show_binary,
+                                   self.__binary_max)
+                 for d in cursor.description]
+        rows = 0
+        batches = dbapi.fetch_batches(cursor, self.__fetch_size)
+        for batch in timer.timed_batches(batches):
+            if self.__stopped:
+                break
+            columns = zip(*batch)
+            formatted = [plan.format_values(list(values))
+                         for plan, values in zip(plans, columns)]
+            lines = [COLUMN_SEPARATOR.join(row) for row in zip(*formatted)]
+            results.put((alias, names, lines))
+            rows += len(batch)
+        return rows
@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Background statement execution for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from grizzled import db
+
+from sqlcmd import cancel
+from sqlcmd import dbapi
+from sqlcmd.exception import StatementCancelledError
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['Job', 'JobList', 'Spool']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Job states
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Spooled output is compressed, and written, in blocks of about this many
+# bytes. Each block is preceded by its compressed length.
+SPOOL_BLOCK_SIZE = 64 * 1024
+BLOCK_HEADER = struct.Struct('>I')
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.jobs')
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class Spool(object):
+    """
+    Holds the output of a background job in a temporary file, compressed,
+    so that a job producing a large result set costs little memory or
+    disk. One thread writes the output while another reads it back; the
+    reader sees everything written so far.
+    """
+    def __init__(self):
+        fd, self.__path = tempfile.mkstemp('.out', 'sqlcmd')
+        log.debug('Spooling job output to "%s"' % self.__path)
+        self.__file = os.fdopen(fd, 'wb')
+        self.__pending = []
+        self.__pending_size = 0
+        self.__lock = threading.Lock()
+        self.bytes = 0
+
+    def write(self, s):
+        """
+        Write output to the spool. Unicode output is written as UTF-8.
+
+        :Parameters:
+            s : str or unicode
+                the output
+        """
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        with self.__lock:
+            self.__pending.append(s)
+            self.__pending_size += len(s)
+            self.bytes += len(s)
+            if self.__pending_size >= SPOOL_BLOCK_SIZE:
+                self.__write_block()
+
+    def flush(self):
+        """Make everything written so far visible to readers."""
+        with self.__lock:
+            self.__write_block()
+
+    def read(self, position=0):
+        """
+        Read the output written since a previous read.
+
+        :Parameters:
+            position : int
+                where the previous read left off (0 at first)
+
+        :rtype:  tuple
+        :return: ``(text, position)``: the output, and the position to pass
+                 to the next read
+        """
+        # The lock keeps the writer from adding a block while it's being
+        # read, so only whole blocks are ever seen.
+        chunks = []
+        with self.__lock:
+            self.__write_block()
+            f = open(self.__path, 'rb')
+            try:
+                f.seek(position)
+                while True:
+                    header = f.read(BLOCK_HEADER.size)
+                    if len(header) < BLOCK_HEADER.size:
+                        break
+                    (length,) = BLOCK_HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length:
+                        break
+                    chunks.append(data)
+                    position += BLOCK_HEADER.size + length
+            finally:
+                f.close()
+        return (''.join([zlib.decompress(data) for data in chunks]),
+                position)
+
+    def close(self):
+        """Remove the temporary file."""
+        with self.__lock:
+            self.__file.close()
+        try:
+            os.remove(self.__path)
+        except OSError, ex:
+            log.warning('Unable to remove temporary file "%s": %s' %
+                        (self.__path, ex))
+
+    def __write_block(self):
+        if not self.__pending:
+            return
+        data = zlib.compress(''.join(self.__pending), 1)
+        self.__file.write(BLOCK_HEADER.pack(len(data)))
+        self.__file.write(data)
+        self.__file.flush()
+        self.__pending = []
+        self.__pending_size = 0
+
+class Job(object):
+    """
+    A statement running, or finished running, in the background, on its
+    own connection.
+    """
+    def __init__(self, id, db_key, statement):
+        self.id = id
+        self.db_key = db_key
+        self.statement = statement
+        self.state = RUNNING
+        self.rows = None
+        self.fetched = 0
+        self.error = None
+        self.cancelled = False
+        self.watch = None
+        self.started = time.time()
+        self.finished = None
+        self.output = Spool()
+        self.position = 0
+        self.__done = threading.Event()
+
+    @property
+    def done(self):
+        """Whether the job has finished, one way or another."""
+        return self.__done.isSet()
+
+    @property
+    def elapsed(self):
+        """How many seconds the job has been running, or ran."""
+        return (self.finished or time.time()) - self.started
+
+    def wait(self, timeout=None):
+        """
+        Wait for the job to finish.
+
+        :Parameters:
+            timeout : float
+                how many seconds to wait, or ``None`` to wait as long as it
+                takes
+
+        :rtype:  bool
+        :return: whether the job has finished
+        """
+        # Wait in short slices; a wait with no timeout can't be interrupted
+        # by Ctrl-C.
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while not self.__done.wait(0.1):
+            if (deadline is not None) and (time.time() >= deadline):
+                break
+        return self.done
+
+    def cancel(self):
+        """
+        Ask the database to cancel the job's statement. A job whose
+        statement hasn't started yet fails without running it.
+
+        :rtype:  bool
+        :return: ``False`` if the statement is running, and the database
+                 couldn't be asked to cancel it
+        """
+        self.cancelled = True
+        watch = self.watch
+        if watch is None:
+            return True
+        return watch.cancel()
+
+    def read_output(self):
+        """
+        Read the job's output produced since the last call.
+
+        :rtype:  str
+        :return: the output
+        """
+        (text, self.position) = self.output.read(self.position)
+        return text
+
+    def finish(self, state, rows=None, error=None):
+        self.state = state
+        self.rows = rows
+        self.error = error
+        self.finished = time.time()
+        try:
+            self.output.flush()
+        finally:
+            # Whatever happens, anyone waiting for the job must be woken.
+            self.__done.set()
+
+class JobList(object):
+    """
+    Runs statements in background threads, each on a connection of its
+    own, and keeps track of them until their output has been collected.
+    Connections are pooled, so that running one job after another doesn't
+    mean connecting each time.
+    """
+    def __init__(self, pool):
+        """
+        Create a job list.
+
+        :Parameters:
+            pool : sqlcmd.pool.ConnectionPool
+                the pool in which to keep idle job connections
+        """
+        self.__pool = pool
+        self.__jobs = {}
+        self.__next_id = 1
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__jobs)
+
+    def submit(self, statement, db_config, connect, render, timeout=0):
+        """
+        Start running a statement in the background.
+
+        :Parameters:
+            statement : str
+                the SQL statement
+            db_config : sqlcmd.config.DBInstanceConfigItem
+                the database on which to run it
+            connect : function
+                a function that opens a new connection to the database
+            render : function
+                a function that takes a connection, a cursor on which a
+                query was executed and an output file, writes the rows to
+                the file, and returns how many there were
+            timeout : int
+                how many seconds the statement may run before it's
+                cancelled, or 0 for no limit
+
+        :rtype:  Job
+        :return: the job
+        """
+        with self.__lock:
+            job = Job(self.__next_id, db_config.db_key, statement)
+            self.__next_id += 1
+            self.__jobs[job.id] = job
+
+        t = threading.Thread(target=self.__run,
+                             args=(job, db_config, connect, render,
+                                   timeout),
+                             name='sqlcmd-job-%d' % job.id)
+        t.setDaemon(True)
+        t.start()
+        return job
+
+    def jobs(self):
+        """
+        Get the jobs, in the order they were submitted.
+
+        :rtype:  list
+        :return: the ``Job`` objects
+        """
+        return [self.__jobs[id] for id in sorted(self.__jobs.keys())]
+
+    def running(self):
+        """
+        Get the jobs that haven't finished.
+
+        :rtype:  list
+        :return: the ``Job`` objects
+        """
+        return [job for job in self.jobs() if not job.done]
+
+    def get(self, id=None):
+        """
+        Get a job.
+
+        :Parameters:
+            id : int
+                the job's ID, or ``None`` for the most recently submitted job
+
+        :rtype:  Job
+        :return: the job, or ``None`` if there's no such job
+        """
+        if id is None:
+            ids = self.__jobs.keys()
+            if not ids:
+                return None
+            id = max(ids)
+        return self.__jobs.get(id)
+
+    def remove(self, job):
+        """
+        Forget a finished job, and discard its output.
+
+        :Parameters:
+            job : Job
+                the job
+        """
+        assert job.done
+        del self.__jobs[job.id]
+        job.output.close()
+
+    def configure_pool(self, max_idle, idle_timeout):
+        """
+        Change the limits on the pool of idle job connections. (See
+        ``sqlcmd.pool.ConnectionPool``.)
+
+        :Parameters:
+            max_idle : int
+                the maximum number of idle connections to keep
+            idle_timeout : int
+                the number of seconds after which an idle connection is
+                closed
+        """
+        with self.__lock:
+            self.__pool.max_idle = max_idle
+            self.__pool.idle_timeout = idle_timeout
+            self.__pool.evict()
+
+    def close(self):
+        """Forget all the finished jobs, and close the pooled connections."""
+        for job in self.jobs():
+            if job.done:
+                self.remove(job)
+        with self.__lock:
+            self.__pool.close_all()
+
+    def __run(self, job, db_config, connect, render, timeout):
+        # The job is only marked as finished once its connection is back
+        # in the pool. Connections that can't change threads aren't pooled.
+        thread_bound = dbapi.is_thread_bound(db_config.db_type)
+        database = None
+        (state, rows, error) = (DONE, None, None)
+        try:
+            if not thread_bound:
+                with self.__lock:
+                    pooled = self.__pool.take(job.db_key)
+                if pooled is not None:
+                    database = pooled.database
+            if database is None:
+                database = connect()
+            rows = self.__execute(job, database, db_config.db_type,
+                                  connect, render, timeout)
+        except:
+            ex = sys.exc_info()[1]
+            log.debug('Job %d failed: %s' % (job.id, ex))
+            (state, error) = (FAILED, str(ex))
+            if database is not None:
+                try:
+                    database.rollback()
+                except db.Error:
+                    pass
+
+        try:
+            if database is not None:
+                self.__release(db_config, database, thread_bound)
+            job.finish(state, rows=rows, error=error)
+        except:
+            # The job is finished either way; it must never be left
+            # looking as if it's still running.
+            ex = sys.exc_info()[1]
+            log.debug('Job %d failed to finish: %s' % (job.id, ex))
+            try:
+                job.finish(FAILED, rows=rows, error=str(ex))
+            except:
+                log.debug('Job %d output lost: %s' %
+                          (job.id, sys.exc_info()[1]))
+
+    def __execute(self, job, database, db_type, connect, render, timeout):
+        # Each job is a transaction of its own, committed if it succeeds.
+        # The statement can be cancelled by the time limit, or from another
+        # thread through the job. A pooled connection may still have the
+        # previous job's limit, so the server's limit is always set.
+        dbapi.set_statement_timeout(database, db_type, timeout)
+        watch = cancel.StatementWatch(
+            lambda: dbapi.interrupt(database, db_type, connect=connect),
+            timeout=timeout
+        )
+        cursor = database.cursor()
+        try:
+            with watch:
+                job.watch = watch
+                if job.cancelled:
+                    raise StatementCancelledError('Statement cancelled '
+                                                  'before it started.')
+                dbapi.begin(database, cursor)
+                cursor.execute(job.statement)
+                if cursor.description:
+                    rows = render(database,
+                                  _ProgressCursor(watch.cursor(cursor), job),
+                                  job.output)
+                else:
+                    rows = max(cursor.rowcount, 0)
+                    pl = ''
+                    if rows != 1:
+                        pl = 's'
+                    job.output.write('%d row%s\n' % (rows, pl))
+            database.commit()
+            return rows
+        finally:
+            job.watch = None
+            try:
+                cursor.close()
+            except db.Error:
+                pass
+
+    def __release(self, db_config, database, thread_bound):
+        if thread_bound:
+            try:
+                database.close()
+            except db.Error, ex:
+                log.debug('Error closing job connection: %s' % ex)
+        else:
+            with self.__lock:
+                self.__pool.park(db_config.db_key, database,
+                                 {'db_config' : db_config})
+
+class _ProgressCursor(object):
+    # Counts the rows fetched so far, so that ".jobs" can show them.
+    def __init__(self, cursor, job):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.__cursor = cursor
+        self.__job = job
+
+    def fetchmany(self, n):
+        batch = dbapi.fetchmany(self.__cursor, n)
+        self.__job.fetched += len(batch)
+        return batch
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Incremental SQL statement lexer for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import re
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['SQLLexer', 'Statement']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Lexer states, carried from one line to the next.
+NORMAL        = 0
+SINGLE_QUOTE  = 1
+DOUBLE_QUOTE  = 2
+BLOCK_COMMENT = 3
+DOLLAR_QUOTE  = 4
+
+# Text that leaves the state alone: anything but a semicolon, the start of
+# a comment, or a quote, dollar quote or block comment that doesn't end on
+# the same line. A dollar quote tag ($$ or $tag$) can't follow an
+# identifier character, so names like v$session are left alone.
+NORMAL_TEXT_PATTERN = r"""(?:[^'"$;/-]+|%s|"(?:[^"]|"")*"|/\*.*?\*/|""" \
+                      r"""-(?!-)|/(?!\*)|(?<=[A-Za-z0-9_$])\$|""" \
+                      r"""\$(?!(?:[A-Za-z_][A-Za-z0-9_]*)?\$))*"""
+NORMAL_TEXT_RE = re.compile(NORMAL_TEXT_PATTERN % r"'(?:[^']|'')*'")
+BACKSLASH_NORMAL_TEXT_RE = re.compile(NORMAL_TEXT_PATTERN %
+                                      r"'(?:[^'\\]|''|\\.)*'")
+DOLLAR_TAG_RE = re.compile(r'\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$')
+
+
+# The end of a quoted string. Doubled quotes are escaped quotes.
+SINGLE_QUOTE_END_RE = re.compile(r"''|'")
+BACKSLASH_SINGLE_QUOTE_END_RE = re.compile(r"\\.|''|'")
+DOUBLE_QUOTE_END_RE = re.compile(r'""|"')
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.lexer')
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class Statement(object):
+    """
+    A complete SQL statement, as assembled by ``SQLLexer``, without its
+    terminating semicolon. The statement remembers which parts of it are
+    dollar-quoted bodies, so that variable substitution can leave them alone.
+    """
+    def __init__(self, pieces):
+        """
+        Create a statement.
+
+        :Parameters:
+            pieces : list
+                ``(text, literal)`` tuples, where ``literal`` is ``True`` for
+                dollar-quoted text
+        """
+        self.__pieces = pieces
+
+    def text(self, substitute=None):
+        """
+        Get the text of the statement.
+
+        :Parameters:
+            substitute : function
+                if not ``None``, a function to apply to each part of the
+                statement that isn't dollar-quoted (e.g., to substitute
+                variable references)
+
+        :rtype: str
+        :return: the statement
+        """
+        if len(self.__pieces) == 1:
+            (text, literal) = self.__pieces[0]
+            if (substitute is not None) and (not literal):
+                text = substitute(text)
+        elif substitute is None:
+            text = ''.join([piece for piece, literal in self.__pieces])
+        else:
+            text = ''.join([literal and piece or substitute(piece)
+                            for piece, literal in self.__pieces])
+        return text.strip()
+
+    def __str__(self):
+        return self.text()
+
+class SQLLexer(object):
+    """
+    Splits input lines into SQL statements. The lexer is fed one line at a
+    time and tracks string literals, quoted identifiers, block comments and
+    dollar-quoted bodies across lines, so a semicolon ends a statement only
+    when it's outside all of them. "--" comments are dropped.
+
+    Statements are accumulated as lists of fragments and joined only when
+    they're complete, so the cost of lexing is linear in the size of the
+    input, however many lines a statement spans.
+    """
+    def __init__(self, backslash_escapes=False):
+        """
+        Create a lexer.
+
+        :Parameters:
+            backslash_escapes : bool
+                whether a backslash escapes the next character in a
+                single-quoted string, as in MySQL
+        """
+        self.backslash_escapes = backslash_escapes
+        self.__clear()
+
+    @property
+    def pending(self):
+        """
+        Whether the lexer holds the beginning of a statement that hasn't been
+        terminated yet.
+        """
+        return (self.__state != NORMAL) or self.__has_text
+
+    def feed(self, line):
+        """
+        Lex another line of input.
+
+        :Parameters:
+            line : str
+                the line, without its trailing newline
+
+        :rtype: list
+        :return: the ``Statement`` objects completed by the line, if any
+        """
+        if self.backslash_escapes:
+            text_re = BACKSLASH_NORMAL_TEXT_RE
+        else:
+            text_re = NORMAL_TEXT_RE
+
+        state = self.__state
+        if (state == NORMAL) and (not self.__has_text):
+            # The usual case, a line holding one complete statement, is
+            # handled without any further ado. If the line's only
+            # semicolon is at the end, and it has an even number of single
+            # quotes and no comments, double quotes, dollar quotes or
+            # escapes, that semicolon can't be inside a string, so the line
+            # needn't be lexed at all. (Plain "in" tests are much cheaper
+            # than a regex search here.)
+            line = line.strip()
+            if (line[-1:] == ';') and (line.count(';') == 1) and \
+               (line.count("'") % 2 == 0) and ('"' not in line) and \
+               ('$' not in line) and ('--' not in line) and \
+               ('/*' not in line) and \
+               not (self.backslash_escapes and ('\\' in line)):
+                self.__clear()
+                if len(line) == 1:
+                    return []
+                return [Statement([(line[:-1], False)])]
+
+            stop = text_re.match(line).end()
+            if (stop == len(line) - 1) and (line[stop] == ';'):
+                self.__clear()
+                if stop == 0:
+                    return []
+                return [Statement([(line[:stop], False)])]
+
+        statements = []
+        if self.pending:
+            # Line breaks within strings are significant.
+            if state in (SINGLE_QUOTE, DOUBLE_QUOTE, DOLLAR_QUOTE):
+                self.__add('\n')
+            else:
+                self.__add(' ')
+
+        if state == NORMAL:
+            line = line.lstrip()
+
+        pos = 0
+        end = len(line)
+        while pos < end:
+            if state == NORMAL:
+                stop = text_re.match(line, pos).end()
+                if stop == end:
+                    self.__add(line[pos:].rstrip())
+                    break
+
+                self.__add(line[pos:stop])
+                pos = stop + 1
+                c = line[stop]
+                if c == ';':
+                    statement = self.__finish()
+                    if statement is not None:
+                        statements.append(statement)
+                elif c == '-':
+                    # "--" comment
+                    break
+                elif c == "'":
+                    state = SINGLE_QUOTE
+                    self.__add(c)
+                elif c == '"':
+                    state = DOUBLE_QUOTE
+                    self.__add(c)
+                elif c == '/':
+                    state = BLOCK_COMMENT
+                    self.__add('/*')
+                    pos += 1
+                else:
+                    state = DOLLAR_QUOTE
+                    self.__tag = DOLLAR_TAG_RE.match(line, stop).group()
+                    self.__start_run(True)
+                    self.__add(self.__tag)
+                    pos = stop + len(self.__tag)
+
+            elif state == BLOCK_COMMENT:
+                i = line.find('*/', pos)
+                if i < 0:
+                    self.__add(line[pos:])
+                    break
+                self.__add(line[pos:i + 2])
+                pos = i + 2
+                state = NORMAL
+
+            elif state == DOLLAR_QUOTE:
+                i = line.find(self.__tag, pos)
+                if i < 0:
+                    self.__add(line[pos:])
+                    break
+                i += len(self.__tag)
+                self.__add(line[pos:i])
+                self.__start_run(False)
+                pos = i
+                self.__tag = None
+                state = NORMAL
+
+            else:
+                if state == DOUBLE_QUOTE:
+                    end_re = DOUBLE_QUOTE_END_RE
+                elif self.backslash_escapes:
+                    end_re = BACKSLASH_SINGLE_QUOTE_END_RE
+                else:
+                    end_re = SINGLE_QUOTE_END_RE
+
+                closed = False
+                scan = pos
+                while not closed:
+                    m = end_re.search(line, scan)
+                    if m is None:
+                        break
+                    scan = m.end()
+                    closed = len(m.group()) == 1
+
+                if not closed:
+                    self.__add(line[pos:])
+                    break
+                self.__add(line[pos:scan])
+                pos = scan
+                state = NORMAL
+
+        self.__state = state
+        return statements
+
+    def reset(self):
+        """
+        Discard any partial statement.
+
+        :rtype: str
+        :return: the text of the discarded partial statement
+        """
+        self.__start_run(False)
+        text = ''.join([piece for piece, literal in self.__pieces]).strip()
+        self.__clear()
+        return text
+
+    def __clear(self):
+        self.__state = NORMAL
+        self.__tag = None
+        self.__pieces = []
+        self.__run = []
+        self.__run_literal = False
+        self.__has_text = False
+
+    def __add(self, text):
+        if text:
+            self.__run.append(text)
+            if not self.__has_text:
+                self.__has_text = not text.isspace()
+
+    def __start_run(self, literal):
+        if self.__run:
+            self.__pieces.append((''.join(self.__run), self.__run_literal))
+            self.__run = []
+        self.__run_literal = literal
+
+    def __finish(self):
+        self.__start_run(False)
+        pieces = self.__pieces
+        has_text = self.__has_text
+        self.__clear()
+        if has_text:
+            return Statement(pieces)
+        return None
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Bulk loading of data files for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import csv
+import json
+import logging
+import os
+import re
+
+from sqlcmd import dbapi
+from sqlcmd.exception import BadCommandError
+from sqlcmd.export import GZIP_EXTENSION
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['IMPORT_FORMATS', 'format_for_file', 'read_rows',
+           'insert_statement', 'batches']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+IMPORT_FORMATS = ('csv', 'tsv', 'jsonl')
+
+# Column names go into the INSERT statement as they are, so they must be
+# plain identifiers.
+COLUMN_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.load')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def format_for_file(path):
+    """
+    Determine the format of a data file from its extension, ignoring any
+    trailing ".gz".
+
+    :Parameters:
+        path : str
+            the file's path
+
+    :rtype:  str
+    :return: one of the values in ``IMPORT_FORMATS``, or ``None`` if the
+             extension isn't recognized
+    """
+    if path.endswith(GZIP_EXTENSION):
+        path = path[:-len(GZIP_EXTENSION)]
+    ext = os.path.splitext(path)[1].lower()[1:]
+    if ext == 'json':
+        ext = 'jsonl'
+    if ext in IMPORT_FORMATS:
+        return ext
+    return None
+
+def read_rows(f, format):
+    """
+    Start reading rows from an open data file. CSV and TSV files must
+    start with a header line containing the column names; empty fields
+    are read as NULLs. In a JSON Lines file, the column names are taken
+    from the keys of the first object. A blank column name is an error.
+
+    :Parameters:
+        f : file
+            the open data file
+        format : str
+            one of the values in ``IMPORT_FORMATS``
+
+    :rtype:  tuple
+    :return: a ``(col_names, rows)`` tuple, where ``rows`` is an iterator
+             that reads the remaining rows (as lists) lazily
+    """
+    if format in ('csv', 'tsv'):
+        if format == 'csv':
+            reader = csv.reader(f, dialect='excel')
+        else:
+            reader = csv.reader(f, dialect='excel-tab')
+        try:
+            col_names = [name.decode('utf-8') for name in reader.next()]
+        except StopIteration:
+            return [], iter([])
+        _check_col_names(col_names)
+        return col_names, _delimited_rows(reader)
+
+    elif format == 'jsonl':
+        objects = _json_objects(f)
+        try:
+            first = objects.next()
+        except StopIteration:
+            return [], iter([])
+        col_names = first.keys()
+        _check_col_names(col_names)
+        return col_names, _json_rows(col_names, first, objects)
+
+    else:
+        raise ValueError, 'Unknown import format "%s"' % format
+
+def insert_statement(table, col_names, paramstyle):
+    """
+    Build a parameterized INSERT statement for a table.
+
+    :Parameters:
+        table : str
+            the table name
+        col_names : list
+            the column names
+        paramstyle : str
+            the DB API parameter style of the driver
+
+    :rtype:  str
+    :return: the INSERT statement, which takes its parameters as a
+             sequence
+    """
+    markers = [dbapi.placeholder(paramstyle, i)
+               for i in range(1, len(col_names) + 1)]
+
+    return 'insert into %s (%s) values (%s)' %\
+           (table, ', '.join(col_names), ', '.join(markers))
+
+def batches(rows, n):
+    """
+    Generator that groups rows into lists of up to ``n`` rows.
+
+    :Parameters:
+        rows : iterator
+            the rows
+        n : int
+            maximum number of rows in a batch
+
+    :rtype:  generator
+    :return: a generator yielding non-empty lists of rows
+    """
+    n = max(n, 1)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _check_col_names(col_names):
+    for i, name in enumerate(col_names):
+        if not name.strip():
+            raise BadCommandError('Column %d of the header has no name.' %
+                                  (i + 1))
+        if not COLUMN_NAME_RE.match(name):
+            raise BadCommandError('Column %d of the header, "%s", isn\'t a '
+                                  'valid column name. Names must be '
+                                  'letters, digits and underscores, not '
+                                  'starting with a digit.' % (i + 1, name))
+
+def _decode(value):
+    if value == '':
+        return None
+    return value.decode('utf-8')
+
+def _delimited_rows(reader):
+    for row in reader:
+        if row:
+            yield [_decode(v) for v in row]
+
+def _json_objects(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _json_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+def _json_rows(col_names, first, objects):
+    yield [_json_value(first.get(name)) for name in col_names]
+    for obj in objects:
+        yield [_json_value(obj.get(name)) for name in col_names]
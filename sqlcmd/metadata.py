@@ -0,0 +1,700 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Cached database metadata, for command completion.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import bisect
+import logging
+import marshal
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from grizzled import db
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['MetadataCache', 'PrefixIndex', 'SchemaStore']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+SCHEMA_FILE_MAGIC = 'SQLCMDSC'
+SCHEMA_FILE_VERSION = 2
+
+# format version, marshal version
+SCHEMA_FILE_HEADER = struct.Struct('<BB')
+
+# Seconds to wait before retrying a background load that failed.
+REFRESH_RETRY_DELAY = 60
+
+# Queries that return (schema, table) rows, by database type. Grizzled
+# doesn't know about schemas, so databases that aren't listed here just
+# don't get schema-qualified completion.
+SCHEMA_QUERIES = {
+    'postgresql' : "SELECT table_schema, table_name "
+                   "FROM information_schema.tables "
+                   "WHERE table_schema NOT IN "
+                   "('pg_catalog', 'information_schema')",
+    'mysql'      : "SELECT table_schema, table_name "
+                   "FROM information_schema.tables "
+                   "WHERE table_schema NOT IN "
+                   "('information_schema', 'mysql', 'performance_schema')",
+    'sqlserver'  : "SELECT table_schema, table_name "
+                   "FROM information_schema.tables",
+    'oracle'     : "SELECT lower(owner), lower(table_name) FROM all_tables",
+}
+
+# Queries that return (table, column) rows for every table at once, by
+# database type. For other databases, the column names are loaded one table
+# at a time.
+COLUMN_QUERIES = {
+    'postgresql' : "SELECT table_name, column_name "
+                   "FROM information_schema.columns "
+                   "WHERE table_schema NOT IN "
+                   "('pg_catalog', 'information_schema')",
+    'mysql'      : "SELECT table_name, column_name "
+                   "FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE()",
+    'sqlserver'  : "SELECT table_name, column_name "
+                   "FROM information_schema.columns",
+    'oracle'     : "SELECT lower(table_name), lower(column_name) "
+                   "FROM all_tab_columns",
+}
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.metadata')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def _load_columns(cursor, table):
+    # Plain tuples, so the metadata can be marshalled.
+    return [tuple(col) for col in cursor.get_table_metadata(table)]
+
+def _query_pairs(database, cursor, sql):
+    """
+    Run a query that returns (name, name) rows, and group the second names
+    by the first. Returns ``None`` if the query fails.
+    """
+    try:
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+    except db.Error, ex:
+        log.debug('Metadata query failed: %s' % ex)
+        try:
+            database.rollback()
+        except db.Error:
+            pass
+        return None
+
+    result = {}
+    for (outer, inner) in rows:
+        result.setdefault(outer, []).append(inner)
+    return result
+
+def _load_schemas(database, cursor, db_type):
+    sql = SCHEMA_QUERIES.get(db_type)
+    if sql is None:
+        return {}
+    return _query_pairs(database, cursor, sql) or {}
+
+def _load_column_names(database, cursor, db_type, tables):
+    sql = COLUMN_QUERIES.get(db_type)
+    if sql is not None:
+        result = _query_pairs(database, cursor, sql)
+        if result is not None:
+            return result
+
+    result = {}
+    for table in tables:
+        try:
+            result[table] = [col[0] for col in
+                             cursor.get_table_metadata(table)]
+        except db.Error, ex:
+            log.debug('Unable to get columns for table "%s": %s' %
+                      (table, ex))
+    return result
+
+def _index_dict(d):
+    """Convert a dict of name lists to a dict of ``PrefixIndex`` objects."""
+    if d is None:
+        return None
+    return dict([(k, PrefixIndex(v)) for k, v in d.items()])
+
+def _unindex_dict(d):
+    if d is None:
+        return None
+    return dict([(k, v.names) for k, v in d.items()])
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class PrefixIndex(object):
+    """
+    A sorted list of names that can be searched by prefix in logarithmic
+    time.
+    """
+    def __init__(self, names):
+        """
+        Create a new index.
+
+        :Parameters:
+            names : iterable
+                the names to index. Duplicates are removed.
+        """
+        self.names = sorted(set(names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def matching(self, prefix):
+        """
+        Get the names that start with a prefix.
+
+        :Parameters:
+            prefix : str
+                the prefix. An empty prefix matches everything.
+
+        :rtype:  list
+        :return: the matching names, in sorted order
+        """
+        if not prefix:
+            return list(self.names)
+
+        # The names that start with the prefix are contiguous, starting at
+        # the prefix's insertion point; so the scan only touches matches.
+        start = bisect.bisect_left(self.names, prefix)
+        end = start
+        while (end < len(self.names)) and self.names[end].startswith(prefix):
+            end += 1
+        return self.names[start:end]
+
+class SchemaStore(object):
+    """
+    A file in which a ``MetadataCache`` saves its contents between sessions.
+    The file is in Python's compact ``marshal`` format, preceded by a small
+    header, and it records the key of the database it describes (see
+    ``sqlcmd.config.DBInstanceConfigItem.db_key``). A file written for a
+    different database, by a different ``marshal`` version, or that can't be
+    read for any other reason is treated as empty.
+    """
+    def __init__(self, path, key):
+        """
+        Create a new store.
+
+        :Parameters:
+            path : str
+                the path to the file
+            key : str
+                the key of the database whose metadata the file holds
+        """
+        self.path = path
+        self.key = key
+
+    def load(self):
+        """
+        Read the file.
+
+        :rtype:  dict
+        :return: the contents, as passed to ``save()``, or an empty
+                 dictionary if there's no usable file.
+        """
+        try:
+            f = open(self.path, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return {}
+
+        header_size = len(SCHEMA_FILE_MAGIC) + SCHEMA_FILE_HEADER.size
+        if (len(data) < header_size) or \
+           (not data.startswith(SCHEMA_FILE_MAGIC)):
+            log.debug('Ignoring schema cache "%s": bad header' % self.path)
+            return {}
+
+        (format_version, marshal_version) = \
+            SCHEMA_FILE_HEADER.unpack_from(data, len(SCHEMA_FILE_MAGIC))
+        if (format_version != SCHEMA_FILE_VERSION) or \
+           (marshal_version != marshal.version):
+            log.debug('Ignoring schema cache "%s": version mismatch' %
+                      self.path)
+            return {}
+
+        try:
+            contents = marshal.loads(data[header_size:])
+            if contents.pop('key') != self.key:
+                log.debug('Ignoring schema cache "%s": it\'s for a different '
+                          'database' % self.path)
+                return {}
+            return contents
+        except (ValueError, EOFError, TypeError, KeyError), ex:
+            log.debug('Ignoring schema cache "%s": %s' % (self.path, ex))
+            return {}
+
+    def save(self, contents):
+        """
+        Write the file. The file is written under a unique temporary name
+        and then renamed, so a concurrent session (or thread) never reads
+        a partial file.
+
+        :Parameters:
+            contents : dict
+                the metadata to save. It may contain only types that
+                ``marshal`` supports.
+        """
+        contents = dict(contents)
+        contents['key'] = self.key
+        try:
+            data = marshal.dumps(contents, marshal.version)
+        except ValueError, ex:
+            log.debug('Unable to save schema cache "%s": %s' % (self.path, ex))
+            return
+
+        temp = None
+        try:
+            (fd, temp) = tempfile.mkstemp('.tmp',
+                                          os.path.basename(self.path) + '.',
+                                          os.path.dirname(self.path))
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(SCHEMA_FILE_MAGIC)
+                f.write(SCHEMA_FILE_HEADER.pack(SCHEMA_FILE_VERSION,
+                                                marshal.version))
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temp, self.path)
+        except (IOError, OSError), ex:
+            log.debug('Unable to save schema cache "%s": %s' % (self.path, ex))
+            if temp is not None:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+
+class MetadataCache(object):
+    """
+    Caches the metadata for one database connection: table names, schemas,
+    the column names used for completion, and the column metadata shown by
+    ``.describe``. Entries expire after a configurable number of seconds,
+    and can be invalidated explicitly (e.g., after DDL).
+
+    The metadata is loaded by a background thread, over a second
+    connection, so completion never has to wait for the database; until the
+    thread is done, completion just works with whatever has been loaded so
+    far. If the cache has a ``SchemaStore``, it starts out with the metadata
+    saved by an earlier session, and saves whatever it loads.
+    """
+    def __init__(self, db, ttl=300, store=None, connect=None, db_type=None):
+        """
+        Create a new cache.
+
+        :Parameters:
+            db : grizzled.db.DB
+                the connection to query when metadata must be loaded
+                immediately
+            ttl : int
+                how many seconds loaded metadata stays valid. 0 disables
+                caching; a negative value means it never expires.
+            store : SchemaStore
+                where to save the metadata between sessions, or ``None``
+            connect : function
+                a function that takes no arguments and opens a new
+                connection to the same database, for background loads; or
+                ``None`` to load everything in the foreground
+            db_type : str
+                the Grizzled database type (e.g., "postgresql"), used to
+                find the queries for schemas and column names
+        """
+        self.ttl = ttl
+        self.__db = db
+        self.__db_type = db_type
+        self.__store = store
+        self.__connect = connect
+        self.__lock = threading.Lock()
+        self.__loading = False
+        self.__loading_columns = set()
+        self.__retry_at = 0
+        self.__generation = 0
+        self.__clear()
+
+        if store is not None:
+            contents = store.load()
+            if contents.get('tables') is not None:
+                (self.__tables_loaded_at, names) = contents['tables']
+                self.__tables = PrefixIndex(names)
+                self.__schemas = _index_dict(contents.get('schemas'))
+                self.__column_names = _index_dict(
+                    contents.get('column_names')
+                )
+                self.__columns = contents.get('columns', {})
+                log.debug('Loaded cached metadata for %d tables from "%s"' %
+                          (len(self.__tables), store.path))
+
+    def preload(self):
+        """
+        Start loading any metadata that's missing or expired, in the
+        background. Returns immediately.
+        """
+        with self.__lock:
+            complete = (self.__tables is not None) and \
+                       (self.__column_names is not None) and \
+                       self.__is_fresh(self.__tables_loaded_at)
+        if not complete:
+            self.__load_in_background()
+
+    def complete(self, text):
+        """
+        Complete a table name, schema-qualified table name ("schema.table")
+        or table-qualified column name ("table.column"). Never queries the
+        database: if the metadata isn't loaded yet, or has expired, a
+        background load is started, and the completions come from whatever
+        is available now.
+
+        :Parameters:
+            text : str
+                the text to complete
+
+        :rtype:  list
+        :return: the possible completions, which may be empty
+        """
+        with self.__lock:
+            tables = self.__tables
+            schemas = self.__schemas
+            column_names = self.__column_names
+            complete = (tables is not None) and (column_names is not None) \
+                       and self.__is_fresh(self.__tables_loaded_at)
+        if not complete:
+            self.__load_in_background()
+
+        if '.' in text:
+            (qualifier, prefix) = text.rsplit('.', 1)
+            matches = []
+            for names in (schemas, column_names):
+                if names and (qualifier in names):
+                    matches += ['%s.%s' % (qualifier, name)
+                                for name in names[qualifier].matching(prefix)]
+            return matches
+
+        matches = []
+        if tables is not None:
+            matches += tables.matching(text)
+        if schemas:
+            matches += ['%s.' % s for s in sorted(schemas.keys())
+                        if s.startswith(text)]
+        return matches
+
+    def tables(self):
+        """
+        Get the table names, loading them from the database if they aren't
+        cached.
+
+        :rtype:  PrefixIndex
+        :return: the table names
+        """
+        with self.__lock:
+            tables = self.__tables
+            loaded_at = self.__tables_loaded_at
+
+        if (tables is None) or (self.ttl == 0) or \
+           ((not self.__is_fresh(loaded_at)) and
+            (not self.__load_in_background())):
+            return self.refresh()
+        return tables
+
+    def columns(self, table):
+        """
+        Get the column metadata for a table, loading it from the database if
+        it isn't cached.
+
+        :Parameters:
+            table : str
+                the table name
+
+        :rtype:  list
+        :return: the column metadata, as returned by the cursor's
+                 ``get_table_metadata()`` method
+        """
+        with self.__lock:
+            entry = self.__columns.get(table)
+
+        if (entry is None) or (self.ttl == 0) or \
+           ((not self.__is_fresh(entry[0])) and
+            (not self.__load_in_background())):
+            cursor = self.__db.cursor()
+            try:
+                columns = _load_columns(cursor, table)
+            finally:
+                cursor.close()
+            with self.__lock:
+                self.__columns[table] = (time.time(), columns)
+            self.__save()
+            return columns
+
+        return entry[1]
+
+    def cached_columns(self, table):
+        """
+        Get the column metadata for a table, if it's cached, without ever
+        querying the database on this connection. If it isn't cached, or
+        has expired, it's loaded in the background, over a second
+        connection, for next time.
+
+        :Parameters:
+            table : str
+                the table name
+
+        :rtype:  list
+        :return: the column metadata, as returned by the cursor's
+                 ``get_table_metadata()`` method, or ``None`` if it isn't
+                 available yet
+        """
+        with self.__lock:
+            entry = self.__columns.get(table)
+
+        if (entry is not None) and (self.ttl != 0) and \
+           self.__is_fresh(entry[0]):
+            return entry[1]
+
+        if self.__connect is not None:
+            with self.__lock:
+                if not table in self.__loading_columns:
+                    self.__loading_columns.add(table)
+                    t = threading.Thread(target=self.__background_columns,
+                                         args=(table,),
+                                         name='sqlcmd-metadata')
+                    t.setDaemon(True)
+                    t.start()
+        return None
+
+    def refresh(self):
+        """
+        Discard the cached metadata and reload the table names from the
+        database. The rest of the metadata is reloaded in the background.
+
+        :rtype:  PrefixIndex
+        :return: the table names
+        """
+        start = time.time()
+        cursor = self.__db.cursor()
+        try:
+            names = cursor.get_tables()
+        finally:
+            cursor.close()
+        tables = PrefixIndex(names)
+        with self.__lock:
+            self.__generation += 1
+            self.__clear()
+            self.__tables = tables
+            self.__tables_loaded_at = time.time()
+        log.debug('Loaded %d table names in %.3f seconds' %
+                  (len(tables), time.time() - start))
+        self.__save()
+        self.__load_in_background(force=True)
+        return tables
+
+    def invalidate(self):
+        """
+        Discard the cached metadata. The next lookup reloads it.
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__clear()
+        self.__save()
+
+    def __clear(self):
+        self.__tables = None
+        self.__tables_loaded_at = None
+        self.__schemas = None
+        self.__column_names = None
+        self.__columns = {}
+
+    def __is_fresh(self, loaded_at):
+        if self.ttl < 0:
+            return True
+        return (time.time() - loaded_at) < self.ttl
+
+    def __save(self):
+        if (self.__store is None) or (self.ttl == 0):
+            return
+        with self.__lock:
+            tables = None
+            if self.__tables is not None:
+                tables = (self.__tables_loaded_at, self.__tables.names)
+            contents = {'tables'       : tables,
+                        'schemas'      : _unindex_dict(self.__schemas),
+                        'column_names' : _unindex_dict(self.__column_names),
+                        'columns'      : dict(self.__columns)}
+        self.__store.save(contents)
+
+    def __load_in_background(self, force=False):
+        """
+        Start a background load, unless one is already running. Returns
+        ``False`` if there's no way to load in the background.
+        """
+        if self.__connect is None:
+            return False
+
+        with self.__lock:
+            if (not self.__loading) and \
+               (force or (time.time() >= self.__retry_at)):
+                self.__loading = True
+                t = threading.Thread(target=self.__background_load,
+                                     name='sqlcmd-metadata')
+                t.setDaemon(True)
+                t.start()
+        return True
+
+    def __background_columns(self, table):
+        with self.__lock:
+            generation = self.__generation
+        try:
+            database = self.__connect()
+            try:
+                cursor = database.cursor()
+                try:
+                    columns = _load_columns(cursor, table)
+                finally:
+                    cursor.close()
+            finally:
+                database.close()
+
+            with self.__lock:
+                if generation != self.__generation:
+                    return
+                self.__columns[table] = (time.time(), columns)
+            self.__save()
+
+        except Exception, ex:
+            log.debug('Background load of columns for "%s" failed: %s' %
+                      (table, ex))
+
+        finally:
+            with self.__lock:
+                self.__loading_columns.discard(table)
+
+    def __background_load(self):
+        with self.__lock:
+            generation = self.__generation
+            described = self.__columns.keys()
+        try:
+            start = time.time()
+            database = self.__connect()
+            try:
+                cursor = database.cursor()
+                try:
+                    # Publish each stage as soon as it's loaded, so that
+                    # completion can use it while the next one runs.
+                    # Each stage is discarded if the cache was invalidated
+                    # or reloaded since the load started.
+                    names = cursor.get_tables()
+                    tables = PrefixIndex(names)
+                    with self.__lock:
+                        if generation != self.__generation:
+                            return
+                        self.__tables = tables
+                        self.__tables_loaded_at = time.time()
+
+                    schemas = _index_dict(
+                        _load_schemas(database, cursor, self.__db_type)
+                    )
+                    with self.__lock:
+                        if generation != self.__generation:
+                            return
+                        self.__schemas = schemas
+
+                    column_names = _index_dict(
+                        _load_column_names(database, cursor, self.__db_type,
+                                           names)
+                    )
+                    with self.__lock:
+                        if generation != self.__generation:
+                            return
+                        self.__column_names = column_names
+
+                    existing = set(names)
+                    columns = {}
+                    for table in described:
+                        if table in existing:
+                            columns[table] = (time.time(),
+                                              _load_columns(cursor, table))
+                    with self.__lock:
+                        if generation != self.__generation:
+                            return
+                        self.__columns = columns
+                finally:
+                    cursor.close()
+            finally:
+                database.close()
+
+            log.debug('Loaded metadata for %d tables in the background in '
+                      '%.3f seconds' % (len(tables), time.time() - start))
+            self.__save()
+
+        except Exception, ex:
+            log.debug('Background metadata load failed: %s' % ex)
+            with self.__lock:
+                self.__retry_at = time.time() + REFRESH_RETRY_DELAY
+
+        finally:
+            with self.__lock:
+                self.__loading = False
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Output pagers for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import errno
+import locale
+import logging
+import os
+import subprocess
+import sys
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['PagerClosed', 'ExternalPager', 'BuiltinPager', 'open_pager']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+DEFAULT_PAGE_SIZE = 24
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.pager')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def open_pager():
+    """
+    Open the pager named by the ``PAGER`` environment variable or, if
+    ``PAGER`` isn't set, the built-in pager.
+
+    :rtype:  object
+    :return: an ``ExternalPager`` or a ``BuiltinPager``
+    """
+    command = os.environ.get('PAGER', '').strip()
+    if command:
+        try:
+            return ExternalPager(command)
+        except OSError, ex:
+            log.warning('Unable to run pager "%s": %s. Using the built-in '
+                        'pager.' % (command, ex))
+
+    try:
+        page_size = int(os.environ.get('LINES', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return BuiltinPager(page_size)
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class PagerClosed(Exception):
+    """
+    Raised by a pager's ``write()`` method when the user has quit the
+    pager, so the caller can stop producing output.
+    """
+    pass
+
+class ExternalPager(object):
+    """
+    File-like object that pipes its output to an external pager program,
+    such as ``less`` or ``more``.
+    """
+    def __init__(self, command):
+        """
+        Start the pager.
+
+        :Parameters:
+            command : str
+                the pager command, which is run via the shell
+        """
+        self.__encoding = (sys.stdout.encoding or
+                           locale.getpreferredencoding() or 'utf-8')
+        self.__process = subprocess.Popen(command, shell=True,
+                                          stdin=subprocess.PIPE)
+        self.__closed = False
+
+    def write(self, s):
+        if self.__closed:
+            raise PagerClosed()
+
+        if isinstance(s, unicode):
+            s = s.encode(self.__encoding, 'replace')
+        try:
+            self.__process.stdin.write(s)
+            self.__process.stdin.flush()
+        except IOError, ex:
+            if ex.errno != errno.EPIPE:
+                raise
+            self.__closed = True
+            raise PagerClosed()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Close the pipe to the pager and wait for the user to exit it.
+        """
+        try:
+            self.__process.stdin.close()
+        except IOError:
+            pass
+        self.__process.wait()
+
+class BuiltinPager(object):
+    """
+    File-like object that writes to standard output, pausing after each
+    screenful until the user presses Enter. Entering "q" quits the pager.
+    """
+    PROMPT = '--More-- (Enter to continue, q to quit) '
+
+    def __init__(self, page_size, out=None):
+        """
+        Create a new built-in pager.
+
+        :Parameters:
+            page_size : int
+                number of lines on the screen
+            out : file
+                where to write the output. Defaults to ``sys.stdout``.
+        """
+        self.__page_size = max(page_size - 1, 1)
+        self.__out = out or sys.stdout
+        self.__lines = 0
+        self.__closed = False
+
+    def write(self, s):
+        if self.__closed:
+            raise PagerClosed()
+
+        for line in s.splitlines(True):
+            self.__out.write(line)
+            if line.endswith('\n'):
+                self.__lines += 1
+                if self.__lines >= self.__page_size:
+                    self.__more()
+
+    def flush(self):
+        self.__out.flush()
+
+    def close(self):
+        self.__out.flush()
+
+    def __more(self):
+        self.__lines = 0
+        self.__out.flush()
+        try:
+            answer = raw_input(BuiltinPager.PROMPT)
+        except EOFError:
+            answer = 'q'
+
+        if answer.strip().lower().startswith('q'):
+            self.__closed = True
+            raise PagerClosed()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Runs independent SQL scripts in parallel.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from sqlcmd.exception import ConfigurationError
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['ScriptRunner', 'ScriptResult', 'find_scripts',
+           'read_ordering_file', 'write_report']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+SCRIPT_EXTENSION = '.sql'
+
+OK = 'ok'
+FAILED = 'FAILED'
+SKIPPED = 'skipped'
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.parallel')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def find_scripts(paths):
+    """
+    Expand a list of script files and directories into a list of script
+    files. A directory stands for every ".sql" file in it, in name order.
+
+    :Parameters:
+        paths : list
+            the files and directories
+
+    :rtype:  list
+    :return: the script paths, as absolute paths, without duplicates
+
+    :raise ConfigurationError: a path doesn't exist
+    """
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted([n for n in os.listdir(path)
+                            if n.endswith(SCRIPT_EXTENSION)])
+            found = [os.path.join(path, n) for n in names]
+        elif os.path.isfile(path):
+            found = [path]
+        else:
+            raise ConfigurationError('Script "%s" does not exist' % path)
+
+        for script in found:
+            script = os.path.abspath(script)
+            if not script in scripts:
+                scripts.append(script)
+
+    return scripts
+
+def read_ordering_file(path):
+    """
+    Read a file that says which scripts must wait for which others. Each
+    line looks like a make(1) dependency line::
+
+        load_orders.sql: create_tables.sql load_customers.sql
+
+    meaning that "load_orders.sql" can't start until both of the scripts
+    after the colon have finished successfully. Script names are relative
+    to the directory containing the ordering file. Blank lines and lines
+    starting with "#" are ignored.
+
+    :Parameters:
+        path : str
+            the path to the ordering file
+
+    :rtype:  dict
+    :return: maps each script's absolute path to the set of absolute paths
+             of the scripts it depends on
+
+    :raise ConfigurationError: the file can't be read, or has a bad line
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    resolve = lambda name: os.path.normpath(os.path.join(base, name))
+    deps = {}
+    try:
+        f = open(path)
+    except IOError, ex:
+        raise ConfigurationError('Unable to read ordering file "%s": %s' %
+                                 (path, ex.strerror))
+    try:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if (not line) or line.startswith('#'):
+                continue
+            if not ':' in line:
+                raise ConfigurationError('%s, line %d: expected "script: '
+                                         'prerequisite ..."' % (path, i + 1))
+            (target, prereqs) = line.split(':', 1)
+            if not target.strip():
+                raise ConfigurationError('%s, line %d: missing script name' %
+                                         (path, i + 1))
+            deps.setdefault(resolve(target.strip()), set()).update(
+                [resolve(name) for name in prereqs.split()]
+            )
+    finally:
+        f.close()
+
+    return deps
+
+def write_report(results, elapsed, out=None):
+    """
+    Write a summary of a parallel run: each script's status, exit code and
+    run time, followed by the totals.
+
+    :Parameters:
+        results : list
+            the ``ScriptResult`` objects
+        elapsed : float
+            the total time, in seconds
+        out : file
+            where to write the report. Defaults to ``sys.stdout``.
+    """
+    out = out or sys.stdout
+    names = [os.path.basename(r.script) for r in results]
+    width = max([len('script')] + [len(n) for n in names])
+    out.write('%-*s  %-7s %5s %9s\n' % (width, 'script', 'status', 'exit',
+                                        'time'))
+    counts = {OK : 0, FAILED : 0, SKIPPED : 0}
+    for name, r in zip(names, results):
+        counts[r.status] += 1
+        exit_code = '-' if r.exit_code is None else str(r.exit_code)
+        elapsed_str = '-' if r.elapsed is None else '%.3f' % r.elapsed
+        line = '%-*s  %-7s %5s %9s' % (width, name, r.status, exit_code,
+                                       elapsed_str)
+        if r.reason:
+            line += '  (%s)' % r.reason
+        out.write(line + '\n')
+
+    out.write('%d scripts: %d succeeded, %d failed, %d skipped. Total time: '
+              '%.3f seconds\n' % (len(results), counts[OK], counts[FAILED],
+                                   counts[SKIPPED], elapsed))
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ScriptResult(object):
+    """
+    The outcome of one script.
+    """
+    def __init__(self, script, status, exit_code=None, elapsed=None,
+                 reason=None):
+        self.script = script
+        self.status = status
+        self.exit_code = exit_code
+        self.elapsed = elapsed
+        self.reason = reason
+
+    @property
+    def succeeded(self):
+        return self.status == OK
+
+class ScriptRunner(object):
+    """
+    Runs a set of scripts, each in its own *sqlcmd* process (and, therefore,
+    over its own database connection), with at most a fixed number running
+    at a time. A script whose prerequisites haven't all succeeded yet waits;
+    one whose prerequisites failed is skipped. Each script's output is
+    captured, and written in one piece when the script finishes, so the
+    output of different scripts isn't interleaved.
+    """
+    def __init__(self, command, jobs=4, out=None, env=None):
+        """
+        Create a new runner.
+
+        :Parameters:
+            command : function
+                a function that takes a script path and returns the command
+                (as an argument list) that runs it
+            jobs : int
+                the maximum number of scripts to run at once
+            out : file
+                where to write the scripts' output. Defaults to
+                ``sys.stdout``.
+            env : dict
+                the environment in which to run the commands. Defaults to
+                this process's environment.
+        """
+        self.__command = command
+        self.__env = env
+        self.__jobs = max(jobs, 1)
+        self.__out = out or sys.stdout
+        self.__cond = threading.Condition()
+        self.__results = {}
+        self.__running = {}
+
+    def run(self, scripts, deps=None):
+        """
+        Run the scripts.
+
+        :Parameters:
+            scripts : list
+                the absolute paths of the scripts, in the order in which
+                they should be started, all else being equal
+            deps : dict
+                maps script paths to the sets of scripts they depend on, as
+                returned by ``read_ordering_file()``. Dependencies on
+                scripts that aren't being run are ignored.
+
+        :rtype:  list
+        :return: a ``ScriptResult`` for each script, in the order given
+        """
+        deps = deps or {}
+        pending = list(scripts)
+        wanted = set(scripts)
+        for script in scripts:
+            for dep in deps.get(script, ()):
+                if not dep in wanted:
+                    log.warning('Ignoring dependency of "%s" on "%s", which '
+                                'isn\'t being run.' % (script, dep))
+
+        try:
+            with self.__cond:
+                while pending or self.__running:
+                    for script in list(pending):
+                        if len(self.__running) >= self.__jobs:
+                            break
+                        prereqs = [d for d in deps.get(script, ())
+                                   if d in wanted]
+                        failed = [d for d in prereqs
+                                  if (d in self.__results) and
+                                  (not self.__results[d].succeeded)]
+                        if failed:
+                            pending.remove(script)
+                            self.__results[script] = ScriptResult(
+                                script, SKIPPED,
+                                reason='%s did not succeed' %
+                                       os.path.basename(failed[0])
+                            )
+                        elif all([d in self.__results for d in prereqs]):
+                            pending.remove(script)
+                            self.__start(script)
+
+                    if pending and not self.__running:
+                        # Nothing is running, and nothing can start: the
+                        # remaining scripts depend on each other.
+                        for script in pending:
+                            self.__results[script] = ScriptResult(
+                                script, SKIPPED, reason='dependency cycle'
+                            )
+                        pending = []
+
+                    if self.__running:
+                        # Wait in short slices, so Ctrl-C gets through.
+                        self.__cond.wait(0.1)
+
+        except KeyboardInterrupt:
+            for process in self.__running.values():
+                if process is not None:
+                    try:
+                        process.terminate()
+                    except OSError:
+                        pass
+            raise
+
+        return [self.__results[s] for s in scripts]
+
+    def __start(self, script):
+        # Called with the condition held.
+        self.__running[script] = None
+        t = threading.Thread(target=self.__run_one, args=(script,),
+                             name='sqlcmd-script')
+        t.setDaemon(True)
+        t.start()
+
+    def __run_one(self, script):
+        start = time.time()
+        try:
+            # The child has its own copy of the descriptor, so ours can
+            # be closed as soon as it's started.
+            with open(os.devnull) as devnull:
+                process = subprocess.Popen(self.__command(script),
+                                           stdin=devnull,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.STDOUT,
+                                           env=self.__env)
+            with self.__cond:
+                self.__running[script] = process
+            output = process.communicate()[0]
+            exit_code = process.returncode
+            if exit_code == 0:
+                result = ScriptResult(script, OK, exit_code)
+            else:
+                result = ScriptResult(script, FAILED, exit_code)
+        except Exception, ex:
+            output = ''
+            result = ScriptResult(script, FAILED, reason=str(ex))
+        result.elapsed = time.time() - start
+
+        with self.__cond:
+            self.__out.write('==> %s (%s, %.3f seconds) <==\n%s\n' %
+                             (script, result.status, result.elapsed, output))
+            self.__out.flush()
+            self.__results[script] = result
+            del self.__running[script]
+            self.__cond.notify()
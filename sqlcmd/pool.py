@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Database connection management: a pool of idle connections, for quick
+switching between aliases, and connections opened in the background.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import sys
+import threading
+import time
+
+from grizzled import db
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['ConnectionPool', 'PendingConnection']
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.pool')
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class PooledConnection(object):
+    """
+    An idle connection in a ``ConnectionPool``, along with the state that
+    goes with it.
+    """
+    def __init__(self, key, database, state):
+        self.key = key
+        self.database = database
+        self.state = state
+        self.parked_at = time.time()
+
+class ConnectionPool(object):
+    """
+    Holds open database connections that aren't in use, keyed by database
+    (see ``sqlcmd.config.DBInstanceConfigItem.db_key``), so that switching
+    back to a recently used database doesn't require a new connection. Each
+    connection is stored with an arbitrary state object, which the caller
+    uses to keep whatever goes with the connection (e.g., history and
+    settings).
+
+    Connections that have been idle too long are closed, as are the least
+    recently used connections, if the pool is full. A connection is checked
+    before it's handed out again, and discarded if it no longer works.
+    """
+    def __init__(self, max_idle=3, idle_timeout=600, check=None):
+        """
+        Create a new pool.
+
+        :Parameters:
+            max_idle : int
+                the maximum number of idle connections to keep. 0 disables
+                pooling.
+            idle_timeout : int
+                the number of seconds after which an idle connection is
+                closed. A negative value means never.
+            check : function
+                a function that takes a ``PooledConnection`` and returns
+                ``True`` if its connection still works, or ``None`` to skip
+                the check
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.__check = check
+        self.__idle = []
+
+    def __len__(self):
+        return len(self.__idle)
+
+    def park(self, key, database, state=None):
+        """
+        Return a connection to the pool. Any open transaction is rolled
+        back, just as if the connection had been closed. If pooling is
+        disabled, the connection is simply closed. The pool can hold more
+        than one connection with the same key.
+
+        :Parameters:
+            key : str
+                the database key
+            database : grizzled.db.DB
+                the connection
+            state : object
+                the state to keep with the connection
+        """
+        if self.max_idle <= 0:
+            self.__close(PooledConnection(key, database, state))
+            return
+
+        try:
+            database.rollback()
+        except db.Error, ex:
+            log.debug('Rollback of parked connection failed: %s' % ex)
+            self.__close(PooledConnection(key, database, state))
+            return
+
+        self.__idle.append(PooledConnection(key, database, state))
+        self.evict()
+
+    def take(self, key):
+        """
+        Remove a connection from the pool, checking that it still works.
+        If there's more than one for the key, the most recently parked one
+        is taken.
+
+        :Parameters:
+            key : str
+                the database key
+
+        :rtype:  PooledConnection
+        :return: the pooled connection, or ``None`` if there isn't a usable
+                 one for the key
+        """
+        self.evict()
+        for i in range(len(self.__idle) - 1, -1, -1):
+            pooled = self.__idle[i]
+            if pooled.key == key:
+                del self.__idle[i]
+                if (self.__check is not None) and (not self.__check(pooled)):
+                    log.debug('Discarding dead pooled connection to %s' % key)
+                    self.__close(pooled)
+                    return None
+                return pooled
+        return None
+
+    def evict(self):
+        """
+        Close connections that have been idle too long, and, if there are
+        more than ``max_idle`` connections, the least recently used ones.
+        """
+        if self.idle_timeout >= 0:
+            cutoff = time.time() - self.idle_timeout
+            for pooled in [p for p in self.__idle if p.parked_at < cutoff]:
+                log.debug('Closing idle connection to %s' % pooled.key)
+                self.__idle.remove(pooled)
+                self.__close(pooled)
+
+        while len(self.__idle) > max(self.max_idle, 0):
+            pooled = self.__idle.pop(0)
+            log.debug('Pool full. Closing connection to %s' % pooled.key)
+            self.__close(pooled)
+
+    def close_all(self):
+        """Close every connection in the pool."""
+        while self.__idle:
+            self.__close(self.__idle.pop())
+
+    def __close(self, pooled):
+        try:
+            pooled.database.close()
+        except db.Error, ex:
+            log.debug('Error closing connection to %s: %s' % (pooled.key, ex))
+
+class PendingConnection(object):
+    """
+    A database connection that's being opened by a background thread.
+    """
+    def __init__(self, connect):
+        """
+        Start opening the connection.
+
+        :Parameters:
+            connect : function
+                a function that takes no arguments and returns an open
+                connection
+        """
+        self.__connect = connect
+        self.__database = None
+        self.__error = None
+        self.__done = threading.Event()
+        t = threading.Thread(target=self.__run, name='sqlcmd-connect')
+        t.setDaemon(True)
+        t.start()
+
+    @property
+    def ready(self):
+        """Whether the connection attempt has finished, one way or another."""
+        return self.__done.isSet()
+
+    def wait(self):
+        """
+        Wait for the connection attempt to finish.
+
+        :rtype:  grizzled.db.DB
+        :return: the open connection
+
+        :raise Exception: whatever exception the connection attempt raised
+        """
+        # Wait in short slices; a wait with no timeout can't be interrupted
+        # by Ctrl-C.
+        while not self.__done.wait(0.1):
+            pass
+        if self.__error is not None:
+            (etype, evalue, etb) = self.__error
+            raise etype, evalue, etb
+        return self.__database
+
+    def __run(self):
+        try:
+            self.__database = self.__connect()
+        except:
+            self.__error = sys.exc_info()
+        self.__done.set()
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Result set rendering for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import logging
+import sys
+
+from sqlcmd.dbapi import fetch_batches
+from sqlcmd.spill import SpillBuffer
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['ResultSetRenderer', 'ColumnPlan', 'WIDTH_MODES',
+           'BINARY_VALUE_MARKER', 'BINARY_FILTER', 'TRUNCATION_MARKER']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Ways of calculating column widths. "window" sizes the columns from the
+# first few rows (and the cursor metadata), then streams the rest. "exact"
+# looks at every row before displaying anything. "metadata" sizes the
+# columns from the cursor and catalog metadata alone, without looking at
+# any rows.
+WIDTH_MODES = ('window', 'exact', 'metadata')
+
+BINARY_VALUE_MARKER = "<binary>"
+BINARY_FILTER = ''.join([(len(repr(chr(x)))==3) and chr(x) or '?'
+                         for x in range(256)])
+
+# Display sizes (from cursor.description) larger than this are ignored
+# when sizing columns in "window" mode; they'd waste too much screen.
+MAX_METADATA_WIDTH = 40
+
+# In "metadata" mode, a string that's too wide for its column is cut short
+# and ends with this marker.
+TRUNCATION_MARKER = '>'
+
+# Widths of the fixed-size types, by the type name in the catalog, for
+# columns whose metadata doesn't include a size.
+CATALOG_TYPE_WIDTHS = {
+    'boolean'  : 5,
+    'date'     : 10,
+    'smallint' : 6,
+    'int'      : 11,
+    'integer'  : 11,
+    'bigint'   : 20,
+}
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.render')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def _is_size(value):
+    return (type(value) in (int, long)) and (value > 0)
+
+def _to_size(value):
+    # Some drivers (e.g., PostgreSQL and MySQL) report catalog sizes as
+    # strings.
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class ColumnPlan(object):
+    """
+    Describes how to format one column of a result set. A plan is built
+    once per result set, from the column's type code in
+    ``cursor.description``, and is then applied to whole columns of
+    values at a time.
+    """
+    def __init__(self, name, type_code, db, show_binary, binary_max):
+        """
+        Create a new column plan.
+
+        :Parameters:
+            name : str
+                the column name
+            type_code : object
+                the type code from ``cursor.description``
+            db : grizzled.db.DB
+                the open database, used to get the driver's type codes
+            show_binary : bool
+                whether or not to display the contents of binary columns
+            binary_max : int
+                maximum number of characters to show from a binary column
+        """
+        self.name = name
+        self.right_justify = False
+        self.binary = (type_code == db.BINARY)
+        if self.binary:
+            self.width = max(len(name), len(BINARY_VALUE_MARKER))
+            if show_binary:
+                self.format_values = self.__binary_formatter(binary_max)
+            else:
+                self.format_values = self.__format_binary_marker
+        elif type_code == db.NUMBER:
+            self.width = len(name)
+            self.right_justify = True
+            self.format_values = self.__format_numbers
+        else:
+            self.width = len(name)
+            self.format_values = self.__format_strings
+
+    def __format_strings(self, values):
+        return [u'NULL' if v is None else unicode(v) for v in values]
+
+    def __format_numbers(self, values):
+        result = []
+        for v in values:
+            if v is None:
+                result.append('NULL')
+            elif (v - int(v)) == 0:
+                result.append(str(int(v)))
+            else:
+                result.append(str(v))
+        return result
+
+    def __format_binary_marker(self, values):
+        return ['NULL' if v is None else BINARY_VALUE_MARKER for v in values]
+
+    def __binary_formatter(self, binary_max):
+        def format_values(values):
+            return ['NULL' if v is None
+                    else str(v).translate(BINARY_FILTER)[:binary_max]
+                    for v in values]
+        return format_values
+
+class ResultSetRenderer(object):
+    """
+    Displays the result set of an executed query as a table.
+
+    Rows are fetched and formatted a batch at a time. Each batch is
+    formatted column by column, using a ``ColumnPlan`` per column, and
+    written with a single call to the output stream's ``write()`` method.
+
+    In "window" mode, the column widths are calculated from a bounded
+    look-ahead window of rows (plus any display sizes the driver reports
+    in ``cursor.description``); the remaining rows are printed as they're
+    fetched. A value that's wider than its column in a later row simply
+    pushes the rest of that row to the right.
+
+    In "exact" mode, every row is fetched and measured before anything is
+    displayed, so the columns are always exactly as wide as they need to
+    be. The formatted rows are held in memory, up to a limit; beyond that,
+    they're spilled to a temporary file.
+
+    In "metadata" mode, the column widths come from the sizes in
+    ``cursor.description`` and, if supplied, the table's catalog metadata,
+    capped at a maximum width. No rows are measured or held back; each
+    batch is printed as it's fetched. A string that's wider than its
+    column is truncated, and ends with ``TRUNCATION_MARKER``.
+    """
+    def __init__(self,
+                 db,
+                 out=None,
+                 col_spacing=1,
+                 show_binary=False,
+                 binary_max=20,
+                 width_mode='window',
+                 lookahead=1000,
+                 memory_limit=-1,
+                 fetch_size=500,
+                 max_width=MAX_METADATA_WIDTH,
+                 catalog=None,
+                 timer=None):
+        """
+        Create a new renderer.
+
+        :Parameters:
+            db : grizzled.db.DB
+                the open database, used to get the driver's type codes
+            out : file
+                where to write the output. Defaults to ``sys.stdout``.
+            col_spacing : int
+                number of spaces between columns
+            show_binary : bool
+                whether or not to display the contents of binary columns
+            binary_max : int
+                maximum number of characters to show from a binary column,
+                if ``show_binary`` is set. Negative means "no limit".
+            width_mode : str
+                one of the values in ``WIDTH_MODES``
+            lookahead : int
+                number of rows used to size the columns in "window" mode
+            memory_limit : int
+                number of bytes of formatted rows to hold in memory in
+                "exact" mode, before spilling to disk. Negative means
+                "no limit".
+            fetch_size : int
+                number of rows to fetch from the cursor at a time
+            max_width : int
+                maximum width of a column in "metadata" mode
+            catalog : list
+                column metadata for the table being queried, as returned
+                by the cursor's ``get_table_metadata()`` method, or
+                ``None``. Used to size the columns in "metadata" mode.
+            timer : sqlcmd.timing.StatementTimer
+                if not ``None``, the timer in which to record fetch times
+        """
+        assert width_mode in WIDTH_MODES
+        self.__db = db
+        self.__out = out or sys.stdout
+        self.__spacing = ' ' * col_spacing
+        self.__show_binary = show_binary
+        if binary_max < 0:
+            binary_max = sys.maxint
+        self.__binary_max = binary_max
+        self.__width_mode = width_mode
+        self.__lookahead = max(lookahead, 1)
+        self.__memory_limit = memory_limit
+        self.__fetch_size = max(fetch_size, 1)
+        self.__max_width = max(max_width, len(TRUNCATION_MARKER) + 1)
+        self.__catalog = {}
+        for col in catalog or []:
+            self.__catalog[col[0].lower()] = \
+                tuple(col[0:2]) + tuple([_to_size(v) for v in col[2:5]])
+        self.__timer = timer
+        self.bytes_written = 0
+
+    def render(self, cursor):
+        """
+        Fetch and display the rows from a cursor on which a query has
+        just been executed.
+
+        :Parameters:
+            cursor : grizzled.db.Cursor
+                the cursor
+
+        :rtype:  int
+        :return: the number of rows displayed
+        """
+        if not cursor.description:
+            self.__write_row_count(0)
+            return 0
+
+        plan = [ColumnPlan(col[0], col[1], self.__db, self.__show_binary,
+                           self.__binary_max)
+                for col in cursor.description]
+
+        if self.__width_mode == 'exact':
+            return self.__render_exact(cursor, plan)
+        elif self.__width_mode == 'metadata':
+            return self.__render_metadata(cursor, plan)
+        else:
+            return self.__render_window(cursor, plan)
+
+    def __render_exact(self, cursor, plan):
+        if cursor.rowcount > 1000:
+            self.__write("Processing result set...\n")
+
+        buf = SpillBuffer(self.__memory_limit)
+        try:
+            for batch in self.__batches(cursor):
+                columns = self.__format_batch(plan, batch)
+                size = 0
+                for i in range(0, len(plan)):
+                    lengths = [len(s) for s in columns[i]]
+                    plan[i].width = max(plan[i].width, max(lengths))
+                    size += sum(lengths)
+
+                buf.extend(zip(*columns), size)
+
+            rows = buf.total
+            self.__write_row_count(rows)
+            if rows > 0:
+                self.__write_header(plan)
+                row_format = self.__row_format(plan)
+                for chunk in buf.chunks():
+                    self.__write_rows(row_format, chunk)
+                self.__write('\n')
+
+            return rows
+        finally:
+            buf.close()
+
+    def __render_window(self, cursor, plan):
+        source = self.__batches(cursor)
+        window = []
+        complete = True
+        for batch in source:
+            window.append(zip(*self.__format_batch(plan, batch)))
+            if sum([len(rows) for rows in window]) > self.__lookahead:
+                complete = False
+                break
+
+        # If the window holds everything, we know the row count up front
+        # and can display it the same way "exact" mode does. Otherwise, the
+        # count comes at the end.
+        rows = sum([len(formatted) for formatted in window])
+        if complete:
+            self.__write_row_count(rows)
+            if rows == 0:
+                return 0
+
+        for formatted in window:
+            for data in formatted:
+                for i in range(0, len(plan)):
+                    plan[i].width = max(plan[i].width, len(data[i]))
+
+        if not complete:
+            for i in range(0, len(plan)):
+                display_size = cursor.description[i][2]
+                if (type(display_size) in (int, long)) and \
+                   (0 < display_size <= MAX_METADATA_WIDTH):
+                    plan[i].width = max(plan[i].width, display_size)
+
+        self.__write_header(plan)
+        row_format = self.__row_format(plan)
+        for formatted in window:
+            self.__write_rows(row_format, formatted)
+
+        for batch in source:
+            self.__write_rows(row_format,
+                              zip(*self.__format_batch(plan, batch)))
+            rows += len(batch)
+
+        self.__write('\n')
+        if not complete:
+            self.__write_row_count(rows)
+
+        return rows
+
+    def __render_metadata(self, cursor, plan):
+        for i in range(0, len(plan)):
+            plan[i].width = self.__metadata_width(plan[i],
+                                                  cursor.description[i])
+
+        # Only strings are truncated. A number that's cut short is
+        # misleading, so one that doesn't fit just pushes the rest of its
+        # row to the right.
+        truncate = [i for i in range(0, len(plan))
+                    if not plan[i].right_justify]
+        row_format = self.__row_format(plan)
+        rows = 0
+        for batch in self.__batches(cursor):
+            if rows == 0:
+                self.__write_header(plan)
+            columns = self.__format_batch(plan, batch)
+            for i in truncate:
+                columns[i] = self.__truncate(columns[i], plan[i].width)
+            self.__write_rows(row_format, zip(*columns))
+            rows += len(batch)
+
+        if rows > 0:
+            self.__write('\n')
+        self.__write_row_count(rows)
+        return rows
+
+    def __metadata_width(self, col, description):
+        # The width of a column, from whatever the driver and the catalog
+        # say about it. Columns with no usable size get the maximum width.
+        (display_size, internal_size, precision, scale) = description[2:6]
+        catalog = self.__catalog.get(col.name.lower())
+        type_name = None
+        char_size = None
+        if catalog is not None:
+            (type_name, char_size, precision, scale) = catalog[1:5]
+            type_name = (type_name or '').lower()
+
+        if col.binary:
+            if not self.__show_binary:
+                # The plan already allows for the marker.
+                return col.width
+            size = min(self.__binary_max, self.__max_width)
+            return max(size, len(col.name), len('NULL'))
+
+        size = None
+        if _is_size(char_size):
+            size = char_size
+        elif _is_size(display_size):
+            size = display_size
+        elif col.right_justify and _is_size(precision):
+            # Digits, plus room for a sign and a decimal point.
+            size = precision + 1
+            if _is_size(scale):
+                size += 1
+        elif type_name in CATALOG_TYPE_WIDTHS:
+            size = CATALOG_TYPE_WIDTHS[type_name]
+        elif col.right_justify and _is_size(internal_size) and \
+             (internal_size <= 8):
+            # A binary integer of this many bytes.
+            size = len(str(-2 ** (internal_size * 8 - 1)))
+        elif _is_size(internal_size):
+            size = internal_size
+
+        if (size is None) or (size > self.__max_width):
+            size = self.__max_width
+
+        return max(size, len(col.name), len('NULL'))
+
+    def __truncate(self, values, width):
+        if max(map(len, values)) <= width:
+            return values
+        cut = width - len(TRUNCATION_MARKER)
+        return [v if len(v) <= width else v[:cut] + TRUNCATION_MARKER
+                for v in values]
+
+    def __batches(self, cursor):
+        batches = fetch_batches(cursor, self.__fetch_size)
+        if self.__timer is not None:
+            batches = self.__timer.timed_batches(batches)
+        return batches
+
+    def __write(self, s):
+        self.__out.write(s)
+        self.bytes_written += len(s)
+
+    def __format_batch(self, plan, batch):
+        """
+        Format a batch of rows column by column. Returns a list with one
+        entry per column, each of which is a list of formatted values.
+        """
+        columns = zip(*batch)
+        return [plan[i].format_values(columns[i]) for i in range(0, len(plan))]
+
+    def __row_format(self, plan):
+        formats = []
+        for col in plan:
+            if col.right_justify:
+                formats.append('%%%ds' % col.width)
+            else:
+                formats.append('%%-%ds' % col.width)
+        return self.__spacing.join(formats) + '\n'
+
+    def __write_row_count(self, rows):
+        pl = ""
+        if rows != 1:
+            pl = "s"
+        self.__write("%d row%s\n\n" % (rows, pl))
+
+    def __write_header(self, plan):
+        headers = []
+        rules = []
+        for col in plan:
+            headers += ['%-*s' % (col.width, col.name)]
+            rules += ['-' * col.width]
+
+        self.__write(self.__spacing.join(headers) + '\n')
+        self.__write(self.__spacing.join(rules) + '\n')
+
+    def __write_rows(self, row_format, rows):
+        if rows:
+            self.__write(''.join([row_format % data for data in rows]))
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Query result cache for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import cPickle
+from cStringIO import StringIO
+import logging
+import re
+import time
+import zlib
+
+from sqlcmd import dbapi
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['ResultCache', 'CachedResult', 'normalize']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Runs of white space, outside quotes, are insignificant.
+WHITE_SPACE_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.resultcache')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def normalize(sql):
+    """
+    Normalize a statement for use in a cache key, by collapsing white space
+    outside quotes.
+
+    :Parameters:
+        sql : str
+            the statement
+
+    :rtype:  str
+    :return: the normalized statement
+    """
+    return WHITE_SPACE_RE.sub(lambda m: m.group(1) or ' ', sql.strip())
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class CachedResult(object):
+    """
+    A cached result set: the cursor description, plus the rows, stored as
+    a zlib-compressed stream of pickled batches.
+    """
+    def __init__(self, description, data, rows):
+        self.description = description
+        self.data = data
+        self.rows = rows
+        self.created = time.time()
+
+    @property
+    def age(self):
+        """How many seconds ago the result was cached."""
+        return time.time() - self.created
+
+    def cursor(self):
+        """
+        Get an object that can stand in for a cursor on which the query was
+        just executed, for the benefit of the renderer.
+
+        :rtype:  object
+        :return: an object with ``description`` and ``fetchmany()``
+        """
+        return _ReplayCursor(self)
+
+class ResultCache(object):
+    """
+    A size-bounded, least-recently-used cache of query results, each of
+    which expires after a fixed time. Results are keyed by
+    ``(database, normalized statement, parameters)``, so that all the
+    results for a database can be invalidated when it's changed.
+    """
+    def __init__(self, max_bytes, ttl):
+        """
+        Create a cache.
+
+        :Parameters:
+            max_bytes : int
+                the most (compressed) bytes of rows to keep
+            ttl : int
+                how many seconds a result stays valid
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.__results = {}
+        self.__last_used = {}
+        self.__bytes = 0
+        self.__clock = 0
+
+    def __len__(self):
+        return len(self.__results)
+
+    def get(self, key):
+        """
+        Get a cached result.
+
+        :Parameters:
+            key : tuple
+                ``(database key, statement, parameters)``
+
+        :rtype:  CachedResult
+        :return: the result, or ``None`` if it isn't cached or has expired
+        """
+        result = self.__results.get(key)
+        if result is None:
+            return None
+
+        if result.age >= self.ttl:
+            self.__remove(key)
+            return None
+
+        self.__clock += 1
+        self.__last_used[key] = self.__clock
+        return result
+
+    def recorder(self, cursor):
+        """
+        Wrap a cursor on which a query was just executed, so that the rows
+        are recorded as they're fetched. If all the rows are fetched and
+        they fit in the cache, ``put()`` can then cache them.
+
+        :Parameters:
+            cursor : grizzled.db.Cursor
+                the cursor
+
+        :rtype:  object
+        :return: an object to pass to the renderer in place of the cursor
+        """
+        return _RecordingCursor(cursor, self.max_bytes)
+
+    def put(self, key, recorder):
+        """
+        Cache the rows recorded by a recorder (see ``recorder()``), if
+        they were all fetched and fit.
+
+        :Parameters:
+            key : tuple
+                ``(database key, statement, parameters)``
+            recorder : object
+                the recorder
+
+        :rtype:  bool
+        :return: whether the result was cached
+        """
+        result = recorder.result()
+        if result is None:
+            return False
+
+        self.__remove(key)
+        self.__clock += 1
+        self.__results[key] = result
+        self.__last_used[key] = self.__clock
+        self.__bytes += len(result.data)
+        while self.__bytes > self.max_bytes:
+            self.__remove(min(self.__last_used, key=self.__last_used.get))
+        return key in self.__results
+
+    def invalidate(self, db_key=None):
+        """
+        Discard the cached results for a database.
+
+        :Parameters:
+            db_key : str
+                the database's key, or ``None`` to discard all results
+        """
+        for key in self.__results.keys():
+            if (db_key is None) or (key[0] == db_key):
+                self.__remove(key)
+
+    def __remove(self, key):
+        result = self.__results.pop(key, None)
+        if result is not None:
+            del self.__last_used[key]
+            self.__bytes -= len(result.data)
+
+class _RecordingCursor(object):
+    def __init__(self, cursor, max_bytes):
+        self.description = cursor.description
+        self.rowcount = cursor.rowcount
+        self.__cursor = cursor
+        self.__max_bytes = max_bytes
+        self.__compressor = zlib.compressobj(1)
+        self.__chunks = []
+        self.__size = 0
+        self.__rows = 0
+        self.__recording = True
+        self.__complete = False
+
+    def fetchmany(self, n):
+        batch = dbapi.fetchmany(self.__cursor, n)
+        if not batch:
+            self.__complete = True
+        elif self.__recording:
+            try:
+                chunk = self.__compressor.compress(
+                    cPickle.dumps(list(batch), cPickle.HIGHEST_PROTOCOL))
+            except (cPickle.PicklingError, TypeError), ex:
+                log.debug('Not caching result: %s' % ex)
+                self.__stop()
+            else:
+                self.__chunks.append(chunk)
+                self.__size += len(chunk)
+                self.__rows += len(batch)
+                if self.__size > self.__max_bytes:
+                    self.__stop()
+        return batch
+
+    def result(self):
+        if not (self.__recording and self.__complete):
+            return None
+        self.__chunks.append(self.__compressor.flush())
+        data = ''.join(self.__chunks)
+        self.__stop()
+        if len(data) > self.__max_bytes:
+            return None
+        return CachedResult(self.description, data, self.__rows)
+
+    def __stop(self):
+        self.__recording = False
+        self.__chunks = []
+
+class _ReplayCursor(object):
+    def __init__(self, result):
+        self.description = result.description
+        self.rowcount = result.rows
+        self.__input = StringIO(zlib.decompress(result.data))
+
+    def fetchmany(self, n):
+        # Batches are replayed as they were fetched, whatever n is.
+        try:
+            return cPickle.load(self.__input)
+        except EOFError:
+            return []
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Result set buffering for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import cPickle
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['SpillBuffer']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# A spilled chunk of rows starts with its row and column counts. Each column
+# follows, as a kind, the length of its data, and the data.
+CHUNK_HEADER = struct.Struct('<II')
+COLUMN_HEADER = struct.Struct('<cI')
+
+# Column kinds. The values of a str or unicode column are joined with a
+# separator that none of them contains (unicode columns are then encoded as
+# UTF-8), so they can be split apart again in one call. Any other column is
+# pickled.
+STR_COLUMN = 'S'
+UNICODE_COLUMN = 'U'
+PICKLED_COLUMN = 'P'
+SEPARATOR = '\0'
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.spill')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def encode_chunk(rows):
+    """
+    Encode a chunk of rows, column by column, in the spill file format.
+
+    :Parameters:
+        rows : list
+            the rows, each a tuple of (the same number of) strings
+
+    :rtype:  str
+    :return: the encoded chunk
+    """
+    columns = zip(*rows)
+    parts = [CHUNK_HEADER.pack(len(rows), len(columns))]
+    for values in columns:
+        (kind, data) = _encode_column(values)
+        parts.append(COLUMN_HEADER.pack(kind, len(data)))
+        parts.append(data)
+    return ''.join(parts)
+
+def decode_chunks(buf):
+    """
+    Generator that decodes the chunks of rows in a spill file's contents.
+
+    :Parameters:
+        buf : buffer
+            the contents (e.g., an ``mmap``)
+
+    :rtype:  generator
+    :return: a generator yielding a list of rows per chunk
+    """
+    offset = 0
+    end = len(buf)
+    while offset < end:
+        (n_rows, n_columns) = CHUNK_HEADER.unpack_from(buf, offset)
+        offset += CHUNK_HEADER.size
+        columns = []
+        for i in range(0, n_columns):
+            (kind, length) = COLUMN_HEADER.unpack_from(buf, offset)
+            offset += COLUMN_HEADER.size
+            columns.append(_decode_column(kind, buf[offset:offset + length]))
+            offset += length
+        if n_columns == 0:
+            yield [()] * n_rows
+        else:
+            yield zip(*columns)
+
+def _encode_column(values):
+    try:
+        if isinstance(values[0], unicode):
+            data = u'\0'.join(values)
+            if data.count(u'\0') == len(values) - 1:
+                return (UNICODE_COLUMN, data.encode('utf-8'))
+        else:
+            data = SEPARATOR.join(values)
+            if isinstance(data, str) and \
+               (data.count(SEPARATOR) == len(values) - 1):
+                return (STR_COLUMN, data)
+    except (TypeError, UnicodeError):
+        # Mixed str and unicode values.
+        pass
+    return (PICKLED_COLUMN, cPickle.dumps(list(values),
+                                          cPickle.HIGHEST_PROTOCOL))
+
+def _decode_column(kind, data):
+    if kind == STR_COLUMN:
+        return data.split(SEPARATOR)
+    elif kind == UNICODE_COLUMN:
+        return data.decode('utf-8').split(u'\0')
+    else:
+        return cPickle.loads(data)
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class SpillBuffer(object):
+    """
+    Holds formatted result set rows in memory, as a list of chunks, until
+    their total size exceeds a limit, then moves them (and all subsequent
+    rows) to a temporary file. The file holds each chunk column by column,
+    in a compact binary form, and is read back through ``mmap``. A
+    ``SpillBuffer`` can be iterated over as many times as necessary; it
+    must be closed when no longer needed, so the temporary file (if any)
+    is removed.
+    """
+    def __init__(self, memory_limit):
+        """
+        Create a new buffer.
+
+        :Parameters:
+            memory_limit : int
+                the number of bytes to hold in memory before spilling to
+                disk. A negative value means "never spill".
+        """
+        self.__memory_limit = memory_limit
+        self.__chunks = []
+        self.__size = 0
+        self.__file = None
+        self.__path = None
+        self.total = 0
+
+    @property
+    def spilled(self):
+        """``True`` if the buffer has moved its rows to a temporary file."""
+        return self.__file is not None
+
+    def extend(self, rows, size):
+        """
+        Add a chunk of rows to the buffer.
+
+        :Parameters:
+            rows : list
+                the rows to add, each a tuple of strings
+            size : int
+                the (approximate) number of bytes the rows occupy
+        """
+        if not rows:
+            return
+
+        self.total += len(rows)
+        if self.__file is not None:
+            self.__file.write(encode_chunk(rows))
+        else:
+            self.__chunks.append(rows)
+            self.__size += size
+            if (self.__memory_limit >= 0) and \
+               (self.__size > self.__memory_limit):
+                self.__spill()
+
+    def append(self, row, size):
+        """
+        Add a row to the buffer. Adding rows a chunk at a time, with
+        ``extend()``, is much more efficient.
+
+        :Parameters:
+            row : tuple
+                the row to add
+            size : int
+                the (approximate) number of bytes the row occupies
+        """
+        self.extend([row], size)
+
+    def chunks(self):
+        """
+        Generator that yields the buffered rows, in the chunks in which
+        they were added.
+
+        :rtype:  generator
+        :return: a generator yielding lists of rows
+        """
+        if self.__file is None:
+            for rows in self.__chunks:
+                yield rows
+            return
+
+        self.__file.flush()
+        mapped = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for rows in decode_chunks(mapped):
+                yield rows
+        finally:
+            mapped.close()
+
+    def __iter__(self):
+        for rows in self.chunks():
+            for row in rows:
+                yield row
+
+    def close(self):
+        """
+        Release the buffered rows and remove the temporary file, if there
+        is one.
+        """
+        self.__chunks = []
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            try:
+                os.remove(self.__path)
+            except OSError, ex:
+                log.warning('Unable to remove temporary file "%s": %s' %
+                            (self.__path, ex))
+
+    def __spill(self):
+        fd, self.__path = tempfile.mkstemp('.dat', 'sqlcmd')
+        log.debug('Spilling result set to "%s"' % self.__path)
+        self.__file = os.fdopen(fd, 'w+b')
+        for rows in self.__chunks:
+            self.__file.write(encode_chunk(rows))
+        self.__chunks = []
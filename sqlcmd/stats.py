@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Persistent statement statistics for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import hashlib
+import logging
+import math
+import re
+import struct
+import time
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['StatsLog', 'fingerprint', 'percentile']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# Each record in a statistics file is a one-byte record type and a two-byte
+# payload length, followed by the payload. A FINGERPRINT record maps a
+# fingerprint ID to its normalized SQL; it's written the first time a
+# session sees the fingerprint. A TIMING record holds the timings for one
+# statement.
+RECORD_HEADER = struct.Struct('<cH')
+FINGERPRINT_RECORD = 'F'
+TIMING_RECORD = 'T'
+
+# fingerprint ID, timestamp, execute, first row, fetch, render, total, rows
+TIMING_PAYLOAD = struct.Struct('<8sddddddq')
+
+FINGERPRINT_ID_SIZE = 8
+MAX_FINGERPRINT_TEXT = 4096
+
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w.])[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?\b')
+VALUE_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.stats')
+
+# ---------------------------------------------------------------------------
+# Functions
+# ---------------------------------------------------------------------------
+
+def fingerprint(sql):
+    """
+    Normalize a SQL statement, so that statements that differ only in
+    their literal values, case and spacing look the same. String and
+    numeric literals become "?", lists of literals (e.g., in an "IN"
+    clause) become a single "(?)", and runs of white space become a
+    single blank.
+
+    :Parameters:
+        sql : str
+            the SQL statement
+
+    :rtype:  str
+    :return: the normalized statement
+    """
+    s = STRING_LITERAL_RE.sub('?', sql)
+    s = NUMBER_RE.sub('?', s)
+    s = VALUE_LIST_RE.sub('(?)', s)
+    s = WHITESPACE_RE.sub(' ', s).strip()
+    return s.lower()
+
+def percentile(sorted_values, p):
+    """
+    Get a percentile from a sorted list of values, using the nearest-rank
+    method.
+
+    :Parameters:
+        sorted_values : list
+            the values, in ascending order
+        p : float
+            the percentile, from 0 to 100
+
+    :rtype:  float
+    :return: the value at that percentile, or ``None`` if there are no
+             values
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil((p / 100.0) * len(sorted_values)))
+    return sorted_values[max(rank - 1, 0)]
+
+def _pack_time(value):
+    if value is None:
+        return float('nan')
+    return value
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class FingerprintStats(object):
+    """
+    Summary of the timings recorded for one statement fingerprint.
+    """
+    def __init__(self, fingerprint, totals, rows, last_run):
+        totals = sorted(totals)
+        self.fingerprint = fingerprint
+        self.count = len(totals)
+        self.p50 = percentile(totals, 50)
+        self.p95 = percentile(totals, 95)
+        self.max = totals[-1]
+        self.avg_rows = None
+        if rows:
+            self.avg_rows = sum(rows) / float(len(rows))
+        self.last_run = last_run
+
+class StatsLog(object):
+    """
+    An append-only file of per-statement timings, for one database alias.
+    """
+    def __init__(self, path):
+        """
+        Create a new statistics log. The file isn't opened until the first
+        record is written.
+
+        :Parameters:
+            path : str
+                the path to the statistics file
+        """
+        self.path = path
+        self.__file = None
+        self.__seen = set()
+        self.__broken = False
+
+    def record(self, timer):
+        """
+        Append the timings for a statement.
+
+        :Parameters:
+            timer : sqlcmd.timing.StatementTimer
+                the (finished) timer for the statement
+        """
+        if self.__broken:
+            return
+
+        text = fingerprint(timer.statement)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        text = text[:MAX_FINGERPRINT_TEXT]
+        id = hashlib.md5(text).digest()[:FINGERPRINT_ID_SIZE]
+
+        records = []
+        if not id in self.__seen:
+            records.append(self.__pack(FINGERPRINT_RECORD, id + text))
+            self.__seen.add(id)
+
+        rows = timer.rows
+        if rows is None:
+            rows = -1
+        records.append(self.__pack(TIMING_RECORD,
+                                   TIMING_PAYLOAD.pack(
+                                       id,
+                                       time.time(),
+                                       _pack_time(timer.execute),
+                                       _pack_time(timer.first_row),
+                                       _pack_time(timer.fetch),
+                                       _pack_time(timer.render),
+                                       _pack_time(timer.total),
+                                       rows)))
+        try:
+            if self.__file is None:
+                self.__file = open(self.path, 'ab')
+            self.__file.write(''.join(records))
+            self.__file.flush()
+        except IOError, ex:
+            log.warning('Unable to write statistics file "%s": %s' %
+                        (self.path, ex))
+            self.close()
+            self.__broken = True
+
+    def close(self):
+        """Close the file, if it's open."""
+        if self.__file is not None:
+            try:
+                self.__file.close()
+            except IOError:
+                pass
+            self.__file = None
+
+    def summarize(self):
+        """
+        Read the file and summarize the timings for each fingerprint.
+
+        :rtype:  list
+        :return: a list of ``FingerprintStats`` objects, in no particular
+                 order
+        """
+        fingerprints = {}
+        totals = {}
+        rows = {}
+        last_run = {}
+        for kind, payload in self.__read_records():
+            if kind == FINGERPRINT_RECORD:
+                fingerprints[payload[:FINGERPRINT_ID_SIZE]] = \
+                    payload[FINGERPRINT_ID_SIZE:].decode('utf-8', 'replace')
+            elif kind == TIMING_RECORD:
+                (id, timestamp, execute, first_row, fetch, render, total,
+                 row_count) = TIMING_PAYLOAD.unpack(payload)
+                if math.isnan(total):
+                    continue
+                totals.setdefault(id, []).append(total)
+                if row_count >= 0:
+                    rows.setdefault(id, []).append(row_count)
+                last_run[id] = max(last_run.get(id, 0), timestamp)
+
+        return [FingerprintStats(fingerprints.get(id, '?'), totals[id],
+                                 rows.get(id), last_run[id])
+                for id in totals.keys()]
+
+    def __pack(self, kind, payload):
+        return RECORD_HEADER.pack(kind, len(payload)) + payload
+
+    def __read_records(self):
+        if self.__file is not None:
+            self.__file.flush()
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return
+
+        try:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                kind, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    # Truncated record, probably from a crash. Ignore it.
+                    break
+                yield kind, payload
+        finally:
+            f.close()
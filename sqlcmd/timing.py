@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+#
+# $Id$
+
+"""
+Statement timing for *sqlcmd*.
+
+COPYRIGHT AND LICENSE
+
+Copyright  2008 Brian M. Clapper
+
+This is free software, released under the following BSD-like license:
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+   this list of conditions and the following disclaimer.
+
+2. The end-user documentation included with the redistribution, if any,
+   must include the following acknowlegement:
+
+      This product includes software developed by Brian M. Clapper
+      (bmc@clapper.org, http://www.clapper.org/bmc/). That software is
+      copyright  2008 Brian M. Clapper.
+
+    Alternately, this acknowlegement may appear in the software itself, if
+    and wherever such third-party acknowlegements normally appear.
+
+THIS SOFTWARE IS PROVIDED ``AS IS'' AND ANY EXPRESSED OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+EVENT SHALL BRIAN M. CLAPPER BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF
+THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+$Id$
+"""
+
+# ---------------------------------------------------------------------------
+# Imports
+# ---------------------------------------------------------------------------
+
+import json
+import logging
+import time
+
+# ---------------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------------
+
+__all__ = ['StatementTimer', 'TIMING_FORMATS']
+
+# ---------------------------------------------------------------------------
+# Constants
+# ---------------------------------------------------------------------------
+
+# "brief" shows just the execution time, as soon as it's known. "full"
+# shows the whole breakdown once the statement is done, and "json" shows
+# the breakdown as a JSON object on a single line.
+TIMING_FORMATS = ('brief', 'full', 'json')
+
+# ---------------------------------------------------------------------------
+# Globals
+# ---------------------------------------------------------------------------
+
+log = logging.getLogger('sqlcmd.timing')
+
+# ---------------------------------------------------------------------------
+# Classes
+# ---------------------------------------------------------------------------
+
+class StatementTimer(object):
+    """
+    Records where the time goes while a statement runs: executing it,
+    waiting for the first row, fetching all of its rows, and formatting
+    and writing them. All times are in seconds; a time that doesn't apply
+    to the statement (e.g., the first-row latency of an UPDATE) is
+    ``None``.
+    """
+    def __init__(self, statement):
+        """
+        Create a new timer and start it.
+
+        :Parameters:
+            statement : str
+                the statement being timed
+        """
+        self.statement = statement
+        self.start_time = time.time()
+        self.execute = None
+        self.first_row = None
+        self.fetch = None
+        self.render = None
+        self.total = None
+        self.rows = None
+        self.bytes = None
+        self.__render_start = None
+
+    def executed(self):
+        """Note that the statement has finished executing."""
+        self.execute = time.time() - self.start_time
+
+    def timed_batches(self, batches):
+        """
+        Wrap a generator of row batches (e.g., from
+        ``sqlcmd.dbapi.fetch_batches()``), adding the time spent fetching
+        each batch to the fetch time, and noting when the first row
+        arrives. Everything between the start of the first fetch and the
+        call to ``finish()`` that isn't fetching is render time.
+
+        :Parameters:
+            batches : generator
+                the batches to time
+
+        :rtype:  generator
+        :return: a generator yielding the same batches
+        """
+        if self.__render_start is None:
+            self.__render_start = time.time()
+        if self.fetch is None:
+            self.fetch = 0.0
+
+        while True:
+            start = time.time()
+            try:
+                batch = batches.next()
+            except StopIteration:
+                self.fetch += time.time() - start
+                break
+
+            now = time.time()
+            self.fetch += now - start
+            if self.first_row is None:
+                self.first_row = now - self.start_time
+            yield batch
+
+    def finish(self, rows=None, bytes=None):
+        """
+        Stop the timer.
+
+        :Parameters:
+            rows : int
+                number of rows fetched or affected, if known
+            bytes : int
+                number of bytes written, if known
+        """
+        now = time.time()
+        self.total = now - self.start_time
+        self.rows = rows
+        self.bytes = bytes
+        if self.__render_start is not None:
+            self.render = max((now - self.__render_start) - self.fetch, 0.0)
+
+    @property
+    def rows_per_second(self):
+        if (self.rows is None) or (not self.total):
+            return None
+        return self.rows / self.total
+
+    def as_dict(self):
+        """
+        Get the timings as a dictionary.
+
+        :rtype:  dict
+        :return: the timings, keyed by name
+        """
+        return {'statement'       : self.statement,
+                'execute'         : self.execute,
+                'first_row'       : self.first_row,
+                'fetch'           : self.fetch,
+                'render'          : self.render,
+                'total'           : self.total,
+                'rows'            : self.rows,
+                'rows_per_second' : self.rows_per_second,
+                'bytes'           : self.bytes}
+
+    def format_json(self):
+        """
+        Format the timings as a JSON object on a single line.
+
+        :rtype:  str
+        :return: the JSON string
+        """
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def format_full(self):
+        """
+        Format the timings for humans, one per line.
+
+        :rtype:  str
+        :return: the formatted timings
+        """
+        lines = []
+        for label, value in (('Execution time', self.execute),
+                             ('First row', self.first_row),
+                             ('Fetch time', self.fetch),
+                             ('Render time', self.render),
+                             ('Total time', self.total)):
+            if value is not None:
+                lines.append('%-15s %8.3f seconds' % (label + ':', value))
+
+        if self.rows is not None:
+            s = '%-15s %8d' % ('Rows:', self.rows)
+            if self.rows_per_second is not None:
+                s += ' (%d rows/second)' % self.rows_per_second
+            lines.append(s)
+
+        if self.bytes is not None:
+            lines.append('%-15s %8d' % ('Bytes written:', self.bytes))
+
+        return '\n'.join(lines)
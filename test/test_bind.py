@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Unit tests for sqlcmd.bind.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd.bind import CursorCache
+
+class FakeCursor(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class CursorCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+    def open_cursor(self):
+        cursor = FakeCursor(len(self.opened))
+        self.opened.append(cursor)
+        return cursor
+
+    def test_reuse(self):
+        cache = CursorCache(2)
+        first = cache.cursor('select 1', self.open_cursor)
+        self.failUnless(cache.cursor('select 1', self.open_cursor) is first)
+        self.assertEqual(len(self.opened), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.failUnless(cache.holds(first))
+        self.failIf(first.closed)
+
+    def test_evicts_least_recently_used(self):
+        cache = CursorCache(2)
+        a = cache.cursor('a', self.open_cursor)
+        b = cache.cursor('b', self.open_cursor)
+        cache.cursor('a', self.open_cursor)
+        c = cache.cursor('c', self.open_cursor)
+        self.assertEqual(len(cache), 2)
+        self.failUnless(b.closed)
+        self.failIf(cache.holds(b))
+        self.failIf(a.closed or c.closed)
+        self.failUnless(cache.holds(a) and cache.holds(c))
+
+    def test_size_one(self):
+        # The cursor just added is never the one evicted.
+        cache = CursorCache(1)
+        a = cache.cursor('a', self.open_cursor)
+        b = cache.cursor('b', self.open_cursor)
+        self.failUnless(a.closed)
+        self.failIf(b.closed)
+        self.failUnless(cache.cursor('b', self.open_cursor) is b)
+
+    def test_size_zero(self):
+        # Nothing is cached, and the caller owns the cursor.
+        cache = CursorCache(0)
+        a = cache.cursor('a', self.open_cursor)
+        b = cache.cursor('a', self.open_cursor)
+        self.failIf(a is b)
+        self.assertEqual(len(cache), 0)
+        self.failIf(cache.holds(a))
+        self.failIf(a.closed or b.closed)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_shrink(self):
+        # Reducing the size closes cursors on the next use.
+        cache = CursorCache(3)
+        cursors = [cache.cursor(sql, self.open_cursor)
+                   for sql in ('a', 'b', 'c')]
+        cache.max_size = 0
+        cache.cursor('d', self.open_cursor)
+        self.assertEqual(len(cache), 0)
+        self.failUnless(all([cursor.closed for cursor in cursors]))
+
+    def test_discard(self):
+        cache = CursorCache(2)
+        a = cache.cursor('a', self.open_cursor)
+        cache.discard(a)
+        self.failIf(cache.holds(a))
+        self.failIf(a.closed)
+        self.failIf(cache.cursor('a', self.open_cursor) is a)
+
+    def test_close_all(self):
+        cache = CursorCache(2)
+        a = cache.cursor('a', self.open_cursor)
+        b = cache.cursor('b', self.open_cursor)
+        cache.close_all()
+        self.assertEqual(len(cache), 0)
+        self.failUnless(a.closed and b.closed)
+
+if __name__ == '__main__':
+    unittest.main()
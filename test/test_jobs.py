@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Unit tests for sqlcmd.jobs.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from grizzled import db
+
+from sqlcmd import dbapi
+from sqlcmd import jobs
+from sqlcmd.pool import ConnectionPool
+
+logging.getLogger('sqlcmd').addHandler(logging.NullHandler())
+
+LONG_QUERY = 'with recursive c(x) as (select 1 union all select x + 1 ' \
+             'from c where x < 100000000) select x from c'
+
+class FakeDBConfig(object):
+    db_type = 'sqlite'
+    db_key = 'test'
+
+def connect():
+    return db.get_driver('sqlite').connect(database=':memory:')
+
+def render(database, cursor, out):
+    rows = 0
+    for batch in dbapi.fetch_batches(cursor, 100):
+        for row in batch:
+            out.write(u'%s\n' % u'|'.join([unicode(v) for v in row]))
+        rows += len(batch)
+    return rows
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spool = jobs.Spool()
+
+    def tearDown(self):
+        self.spool.close()
+
+    def test_read_back(self):
+        self.spool.write('one\n')
+        self.spool.write('two\n')
+        (text, position) = self.spool.read()
+        self.assertEqual(text, 'one\ntwo\n')
+        self.assertEqual(self.spool.read(position), ('', position))
+
+    def test_non_ascii(self):
+        # Unicode is spooled as UTF-8.
+        self.spool.write(u'caf\xe9 日本\n')
+        self.spool.write('plain\n')
+        (text, position) = self.spool.read()
+        self.assertEqual(text.decode('utf-8'), u'caf\xe9 日本\nplain\n')
+        self.assertEqual(self.spool.bytes, len(text))
+
+    def test_incremental_reads(self):
+        self.spool.write('a' * 10)
+        (text, position) = self.spool.read()
+        self.assertEqual(text, 'a' * 10)
+        self.assertEqual(self.spool.read(position), ('', position))
+
+        # Enough to fill several blocks.
+        big = u'\xfc' * (jobs.SPOOL_BLOCK_SIZE * 2)
+        self.spool.write(big)
+        self.spool.write('end')
+        (text, position) = self.spool.read(position)
+        self.assertEqual(text, big.encode('utf-8') + 'end')
+
+class JobListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs = jobs.JobList(ConnectionPool(check=None))
+
+    def tearDown(self):
+        for job in self.jobs.jobs():
+            job.cancel()
+            job.wait(10)
+            self.jobs.remove(job)
+        self.jobs.close()
+
+    def submit(self, statement, timeout=0):
+        return self.jobs.submit(statement, FakeDBConfig(), connect, render,
+                                timeout=timeout)
+
+    def test_query(self):
+        job = self.submit(u"select 'caf\xe9', 2 union all select 'x', 3")
+        self.failUnless(job.wait(10))
+        self.assertEqual(job.state, jobs.DONE, job.error)
+        self.assertEqual(job.rows, 2)
+        self.assertEqual(job.read_output().decode('utf-8'),
+                         u'caf\xe9|2\nx|3\n')
+
+    def test_failure(self):
+        job = self.submit('select * from no_such_table')
+        self.failUnless(job.wait(10))
+        self.assertEqual(job.state, jobs.FAILED)
+        self.failUnless('no_such_table' in job.error)
+
+    def test_cancel(self):
+        job = self.submit(LONG_QUERY)
+        deadline = time.time() + 10
+        while (job.fetched == 0) and (time.time() < deadline):
+            time.sleep(0.01)
+        self.failUnless(job.fetched > 0)
+        self.failUnless(job.cancel())
+        self.failUnless(job.wait(10))
+        self.assertEqual(job.state, jobs.FAILED)
+        self.failUnless('cancelled' in job.error)
+
+    def test_timeout(self):
+        job = self.submit(LONG_QUERY, timeout=1)
+        self.failUnless(job.wait(10))
+        self.assertEqual(job.state, jobs.FAILED)
+        self.failUnless('timeout' in job.error)
+
+if __name__ == '__main__':
+    unittest.main()
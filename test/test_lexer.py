@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Unit tests for sqlcmd.lexer.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd.lexer import SQLLexer
+
+class SQLLexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lexer = SQLLexer()
+
+    def feed(self, *lines):
+        statements = []
+        for line in lines:
+            statements += [s.text() for s in self.lexer.feed(line)]
+        return statements
+
+    def test_one_line(self):
+        self.assertEqual(self.feed('select * from t;'), ['select * from t'])
+        self.failIf(self.lexer.pending)
+
+    def test_several_statements_per_line(self):
+        self.assertEqual(self.feed('select 1; select 2;select 3 ;'),
+                         ['select 1', 'select 2', 'select 3'])
+        self.failIf(self.lexer.pending)
+
+    def test_statement_left_open(self):
+        self.assertEqual(self.feed('select 1; select'), ['select 1'])
+        self.failUnless(self.lexer.pending)
+        self.assertEqual(self.feed('2 from t;'), ['select 2 from t'])
+        self.failIf(self.lexer.pending)
+
+    def test_multi_line(self):
+        self.assertEqual(self.feed('select a,', '  b', 'from t', ';'),
+                         ['select a, b from t'])
+
+    def test_empty_statements(self):
+        self.assertEqual(self.feed(';', ' ; ;'), [])
+        self.failIf(self.lexer.pending)
+
+    def test_quotes(self):
+        self.assertEqual(self.feed("select 'a;b', \"c;d\" from t;"),
+                         ['select \'a;b\', "c;d" from t'])
+        self.assertEqual(self.feed("select 'it''s;';"), ["select 'it''s;'"])
+        self.assertEqual(self.feed('select "a"";b" from t;'),
+                         ['select "a"";b" from t'])
+
+    def test_quote_across_lines(self):
+        # The line break is part of the string.
+        self.assertEqual(self.feed("insert into t values ('one;", "two');"),
+                         ["insert into t values ('one;\ntwo')"])
+
+    def test_line_comment(self):
+        self.assertEqual(self.feed('select 1 -- not here; or here', ';'),
+                         ['select 1'])
+        self.assertEqual(self.feed('-- just a comment;'), [])
+        self.failIf(self.lexer.pending)
+
+    def test_block_comment(self):
+        self.assertEqual(self.feed('select /* a; b */ 1;'),
+                         ['select /* a; b */ 1'])
+        self.assertEqual(self.feed('select /* a;', 'b */ 2;'),
+                         ['select /* a; b */ 2'])
+
+    def test_dollar_quotes(self):
+        self.assertEqual(self.feed('create function f() returns int as '
+                                   '$$ begin; return 1; end; $$ '
+                                   'language plpgsql;'),
+                         ['create function f() returns int as '
+                          '$$ begin; return 1; end; $$ language plpgsql'])
+
+    def test_tagged_dollar_quotes(self):
+        # Only the matching tag ends the body.
+        self.assertEqual(self.feed('do $body$', 'x; $$ y;', '$body$;'),
+                         ['do $body$\nx; $$ y;\n$body$'])
+
+    def test_substitution_skips_dollar_quotes(self):
+        statements = self.lexer.feed('select x, $$x$$ from x;')
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(statements[0].text(lambda s: s.replace('x', 'y')),
+                         'select y, $$x$$ from y')
+
+    def test_backslash_escapes(self):
+        line = r"select 'a\';b';"
+        lexer = SQLLexer(backslash_escapes=True)
+        self.assertEqual([s.text() for s in lexer.feed(line)],
+                         [r"select 'a\';b'"])
+
+        # Without backslash escapes, the backslash is just a character.
+        self.assertEqual(self.feed(line), [r"select 'a\'"])
+        self.failUnless(self.lexer.pending)
+
+    def test_reset(self):
+        self.feed('select 1; select', "'abc")
+        self.assertEqual(self.lexer.reset(), "select 'abc")
+        self.failIf(self.lexer.pending)
+        self.assertEqual(self.feed('select 2;'), ['select 2'])
+
+if __name__ == '__main__':
+    unittest.main()
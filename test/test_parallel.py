@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Unit tests for sqlcmd.parallel.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd import parallel
+from sqlcmd.exception import ConfigurationError
+
+logging.getLogger('sqlcmd').addHandler(logging.NullHandler())
+
+class ParallelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='sqlcmd-test')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, text):
+        f = open(self.path(name), 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        return self.path(name)
+
+class ReadOrderingFileTest(ParallelTestCase):
+
+    def test_dependencies(self):
+        path = self.write('order', '# comment\n'
+                                   '\n'
+                                   'c.sql: a.sql b.sql\n'
+                                   'c.sql: sub/d.sql\n'
+                                   'b.sql: a.sql\n'
+                                   'a.sql:\n')
+        deps = parallel.read_ordering_file(path)
+        self.assertEqual(deps, {
+            self.path('c.sql') : set([self.path('a.sql'), self.path('b.sql'),
+                                      self.path('sub/d.sql')]),
+            self.path('b.sql') : set([self.path('a.sql')]),
+            self.path('a.sql') : set(),
+        })
+
+    def test_missing_colon(self):
+        path = self.write('order', 'a.sql b.sql\n')
+        self.assertRaises(ConfigurationError, parallel.read_ordering_file,
+                          path)
+
+    def test_missing_script_name(self):
+        path = self.write('order', ': b.sql\n')
+        self.assertRaises(ConfigurationError, parallel.read_ordering_file,
+                          path)
+
+    def test_missing_file(self):
+        self.assertRaises(ConfigurationError, parallel.read_ordering_file,
+                          self.path('nonexistent'))
+
+class ScriptRunnerTest(ParallelTestCase):
+
+    # The "scripts" are Python programs that append their names to a log
+    # file, then exit with the status in their names.
+
+    def script(self, name, status=0):
+        return self.write(name,
+                          'import sys\n'
+                          'f = open(%r, "a")\n'
+                          'f.write(%r + "\\n")\n'
+                          'f.close()\n'
+                          'sys.exit(%d)\n' % (self.path('log'), name, status))
+
+    def run_scripts(self, scripts, deps=None, jobs=4):
+        out = StringIO()
+        runner = parallel.ScriptRunner(lambda s: [sys.executable, s],
+                                       jobs=jobs, out=out)
+        results = runner.run(scripts, deps)
+        return dict([(os.path.basename(r.script), r) for r in results])
+
+    def log(self):
+        if not os.path.exists(self.path('log')):
+            return []
+        return open(self.path('log')).read().split()
+
+    def test_all_succeed(self):
+        scripts = [self.script('a.sql'), self.script('b.sql')]
+        results = self.run_scripts(scripts)
+        self.assertEqual(results['a.sql'].status, parallel.OK)
+        self.assertEqual(results['b.sql'].status, parallel.OK)
+        self.assertEqual(results['a.sql'].exit_code, 0)
+        self.assertEqual(sorted(self.log()), ['a.sql', 'b.sql'])
+
+    def test_dependency_order(self):
+        a = self.script('a.sql')
+        b = self.script('b.sql')
+        c = self.script('c.sql')
+        results = self.run_scripts([c, b, a], {c : set([b]), b : set([a])})
+        for name in ('a.sql', 'b.sql', 'c.sql'):
+            self.assertEqual(results[name].status, parallel.OK)
+        self.assertEqual(self.log(), ['a.sql', 'b.sql', 'c.sql'])
+
+    def test_failure_skips_dependents(self):
+        a = self.script('a.sql', status=1)
+        b = self.script('b.sql')
+        c = self.script('c.sql')
+        d = self.script('d.sql')
+        results = self.run_scripts([a, b, c, d],
+                                   {b : set([a]), c : set([b])})
+        self.assertEqual(results['a.sql'].status, parallel.FAILED)
+        self.assertEqual(results['a.sql'].exit_code, 1)
+        self.assertEqual(results['b.sql'].status, parallel.SKIPPED)
+        self.assertEqual(results['b.sql'].reason, 'a.sql did not succeed')
+        self.assertEqual(results['c.sql'].status, parallel.SKIPPED)
+        self.assertEqual(results['c.sql'].reason, 'b.sql did not succeed')
+        self.assertEqual(results['d.sql'].status, parallel.OK)
+        self.assertEqual(sorted(self.log()), ['a.sql', 'd.sql'])
+
+    def test_dependency_cycle(self):
+        a = self.script('a.sql')
+        b = self.script('b.sql')
+        c = self.script('c.sql')
+        results = self.run_scripts([a, b, c], {a : set([b]), b : set([a])})
+        self.assertEqual(results['a.sql'].status, parallel.SKIPPED)
+        self.assertEqual(results['a.sql'].reason, 'dependency cycle')
+        self.assertEqual(results['b.sql'].status, parallel.SKIPPED)
+        self.assertEqual(results['c.sql'].status, parallel.OK)
+        self.assertEqual(self.log(), ['c.sql'])
+
+    def test_dependency_not_run(self):
+        # A dependency on a script that isn't being run is ignored.
+        a = self.script('a.sql')
+        results = self.run_scripts([a], {a : set([self.path('b.sql')])})
+        self.assertEqual(results['a.sql'].status, parallel.OK)
+
+    def test_one_at_a_time(self):
+        scripts = [self.script('%s.sql' % name) for name in 'abcd']
+        results = self.run_scripts(scripts, jobs=1)
+        self.assertEqual(self.log(), ['a.sql', 'b.sql', 'c.sql', 'd.sql'])
+
+if __name__ == '__main__':
+    unittest.main()
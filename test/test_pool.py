@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Unit tests for sqlcmd.pool.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import logging
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd.pool import ConnectionPool
+
+logging.getLogger('sqlcmd').addHandler(logging.NullHandler())
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.rolled_back = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_take(self):
+        pool = ConnectionPool()
+        connection = FakeConnection()
+        pool.park('a', connection, 'state')
+        self.failUnless(connection.rolled_back)
+        pooled = pool.take('a')
+        self.failUnless(pooled.database is connection)
+        self.assertEqual(pooled.state, 'state')
+        self.failUnless(pool.take('a') is None)
+
+    def test_same_key(self):
+        # Both connections are kept; the newest is taken first.
+        pool = ConnectionPool()
+        first = FakeConnection()
+        second = FakeConnection()
+        pool.park('a', first)
+        pool.park('a', second)
+        self.assertEqual(len(pool), 2)
+        self.failIf(first.closed or second.closed)
+        self.failUnless(pool.take('a').database is second)
+        self.failUnless(pool.take('a').database is first)
+
+    def test_full(self):
+        pool = ConnectionPool(max_idle=2)
+        connections = [FakeConnection() for i in range(3)]
+        for key, connection in zip('abc', connections):
+            pool.park(key, connection)
+        self.assertEqual(len(pool), 2)
+        self.failUnless(connections[0].closed)
+        self.failUnless(pool.take('a') is None)
+
+    def test_disabled(self):
+        pool = ConnectionPool(max_idle=0)
+        connection = FakeConnection()
+        pool.park('a', connection)
+        self.failUnless(connection.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(idle_timeout=0)
+        connection = FakeConnection()
+        pool.park('a', connection)
+        time.sleep(0.01)
+        pool.evict()
+        self.failUnless(connection.closed)
+        self.failUnless(pool.take('a') is None)
+
+    def test_dead_connection(self):
+        pool = ConnectionPool(check=lambda pooled: False)
+        connection = FakeConnection()
+        pool.park('a', connection)
+        self.failUnless(pool.take('a') is None)
+        self.failUnless(connection.closed)
+
+if __name__ == '__main__':
+    unittest.main()
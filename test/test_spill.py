@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Unit tests for sqlcmd.spill.
+#
+# $Id$
+# ---------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from sqlcmd import spill
+
+class ChunkTest(unittest.TestCase):
+
+    def round_trip(self, *chunks):
+        buf = ''.join([spill.encode_chunk(rows) for rows in chunks])
+        decoded = list(spill.decode_chunks(buf))
+        self.assertEqual(decoded, [list(rows) for rows in chunks])
+        for rows, decoded_rows in zip(chunks, decoded):
+            for row, decoded_row in zip(rows, decoded_rows):
+                self.assertEqual([type(v) for v in row],
+                                 [type(v) for v in decoded_row])
+        return buf
+
+    def column_kinds(self, rows):
+        buf = spill.encode_chunk(rows)
+        offset = spill.CHUNK_HEADER.size
+        kinds = []
+        while offset < len(buf):
+            (kind, length) = spill.COLUMN_HEADER.unpack_from(buf, offset)
+            kinds.append(kind)
+            offset += spill.COLUMN_HEADER.size + length
+        return kinds
+
+    def test_str(self):
+        rows = [('1', 'alice', ''), ('2', 'bob', 'x' * 1000)]
+        self.round_trip(rows)
+        self.assertEqual(self.column_kinds(rows), [spill.STR_COLUMN] * 3)
+
+    def test_unicode(self):
+        rows = [(u'caf\xe9', u''), (u'\u65e5\u672c', u'\U0001f600')]
+        self.round_trip(rows)
+        self.assertEqual(self.column_kinds(rows), [spill.UNICODE_COLUMN] * 2)
+
+    def test_mixed(self):
+        # A column mixing str and unicode is pickled; the others aren't.
+        rows = [('1', 'caf\xc3\xa9'), ('2', u'caf\xe9')]
+        self.round_trip(rows)
+        self.assertEqual(self.column_kinds(rows),
+                         [spill.STR_COLUMN, spill.PICKLED_COLUMN])
+
+    def test_nul(self):
+        rows = [('a\0b', u'c\0'), ('', u'\0')]
+        self.round_trip(rows)
+        self.assertEqual(self.column_kinds(rows), [spill.PICKLED_COLUMN] * 2)
+
+    def test_none(self):
+        rows = [('a', None), ('b', 'c')]
+        self.round_trip(rows)
+        self.assertEqual(self.column_kinds(rows),
+                         [spill.STR_COLUMN, spill.PICKLED_COLUMN])
+
+    def test_one_row(self):
+        self.round_trip([('only', u'one')])
+
+    def test_no_columns(self):
+        self.round_trip([(), ()])
+
+    def test_several_chunks(self):
+        self.round_trip([('1', u'a')], [('2', u'b'), ('3', u'c')],
+                        [(u'4', '\0')])
+
+class SpillBufferTest(unittest.TestCase):
+
+    def check(self, buf, chunks):
+        self.assertEqual(list(buf.chunks()), chunks)
+        self.assertEqual(list(buf), [row for rows in chunks for row in rows])
+        self.assertEqual(buf.total, sum([len(rows) for rows in chunks]))
+
+    def test_in_memory(self):
+        buf = spill.SpillBuffer(-1)
+        try:
+            chunks = [[('1', u'a')], [('2', u'b'), ('3', u'c')]]
+            for rows in chunks:
+                buf.extend(rows, 1000000)
+            self.failIf(buf.spilled)
+            self.check(buf, chunks)
+        finally:
+            buf.close()
+
+    def test_spilled(self):
+        buf = spill.SpillBuffer(10)
+        try:
+            chunks = [[('1', u'caf\xe9')], [('2', u'b\0'), ('3', 'c')],
+                      [('4', u'd')]]
+            for rows in chunks:
+                buf.extend(rows, 8)
+            buf.append(('5', u'e'), 2)
+            chunks.append([('5', u'e')])
+            self.failUnless(buf.spilled)
+
+            # It can be read more than once.
+            self.check(buf, chunks)
+            self.check(buf, chunks)
+        finally:
+            buf.close()
+
+if __name__ == '__main__':
+    unittest.main()